@@ -14,17 +14,23 @@ import discord
 from discord.ext import commands
 from discord.ext.commands.view import StringView
 
-import isodate
-
 from aiohttp import ClientSession
 from colorama import init, Fore, Style
 from emoji import UNICODE_EMOJI
 from motor.motor_asyncio import AsyncIOMotorClient
 from pkg_resources import parse_version
 
+from core import indexes, links
+from core.analytics import Analytics
+from core.archive import LogArchive
+from core.attachments import AttachmentMirror
+from core.blocking import BlockPolicy, BlockStore, NEW_ACCOUNT, RECENTLY_JOINED
 from core.changelog import Changelog
 from core.clients import ApiClient, PluginDatabaseClient
 from core.config import ConfigManager
+from core.inbound import InboundQueue
+from core.links import MessageLinks
+from core.relay import RelayRenderer
 from core.utils import info, error, human_join
 from core.models import PermissionLevel
 from core.thread import ThreadManager
@@ -71,7 +77,20 @@ class ModmailBot(commands.Bot):
         # TODO: Raise fatal error if mongo_uri or other essentials are not found
         self._db = AsyncIOMotorClient(self.config.mongo_uri).modmail_bot
         self._api = ApiClient(self)
+        self.links = MessageLinks(self)
+        self.relay = RelayRenderer(self)
+        self.attachment_mirror = AttachmentMirror(self)
+        self.analytics = Analytics(self)
+        self.blocks = BlockStore(self)
+        self.log_archive = LogArchive(self)
         self.plugin_db = PluginDatabaseClient(self)
+        self.inbound = InboundQueue(self._process_modmail_batch)
+        self._block_policy = None
+        self._emoji_cache = {}
+        self._log_migration = None
+        self._log_archival = None
+        # name -> task applying the changes other processes make
+        self._watchers = {}
 
         self.metadata_task = self.loop.create_task(self.metadata_loop())
         self._load_extensions()
@@ -192,6 +211,21 @@ class ModmailBot(commands.Bot):
             except asyncio.CancelledError:
                 logger.debug(info("data_task has been cancelled."))
 
+            for task in self._watchers.values():
+                task.cancel()
+
+            try:
+                self.loop.run_until_complete(self.api.log_appender.close())
+            except Exception:
+                logger.error(
+                    error("Failed to write pending log messages."), exc_info=True
+                )
+
+            try:
+                self.loop.run_until_complete(self.config.flush())
+            except Exception:
+                logger.error(error("Failed to save the config."), exc_info=True)
+
             self.loop.run_until_complete(self.logout())
             for task in asyncio.Task.all_tasks():
                 task.cancel()
@@ -204,6 +238,26 @@ class ModmailBot(commands.Bot):
                 self.loop.close()
                 logger.info(error(" - Shutting down bot - "))
 
+    def _start_watcher(self, name: str, watch, restart_delay: float = 5) -> None:
+        """Runs `watch` until the bot closes, restarting it when it fails."""
+        if self.is_closed():
+            return
+
+        def on_done(task):
+            if task.cancelled() or self.is_closed():
+                return
+            logger.error(
+                error(f"Stopped watching {name} changes, restarting."),
+                exc_info=task.exception(),
+            )
+            self.loop.call_later(
+                restart_delay, self._start_watcher, name, watch, restart_delay
+            )
+
+        task = self.loop.create_task(watch())
+        task.add_done_callback(on_done)
+        self._watchers[name] = task
+
     async def is_owner(self, user: discord.User) -> bool:
         raw = str(self.config.get("owners", "0")).split(",")
         allowed = {int(x) for x in raw}
@@ -211,20 +265,15 @@ class ModmailBot(commands.Bot):
 
     @property
     def log_channel(self) -> typing.Optional[discord.TextChannel]:
-        channel_id = self.config.get("log_channel_id")
-        if channel_id is not None:
-            return self.get_channel(int(channel_id))
-        if self.main_category is not None:
-            return self.main_category.channels[0]
-        return None
+        return self.config.snapshot.log_channel
 
     @property
-    def snippets(self) -> typing.Dict[str, str]:
-        return {k: v for k, v in self.config.get("snippets", {}).items() if v}
+    def snippets(self) -> typing.Mapping[str, str]:
+        return self.config.snapshot.snippets
 
     @property
-    def aliases(self) -> typing.Dict[str, str]:
-        return {k: v for k, v in self.config.get("aliases", {}).items() if v}
+    def aliases(self) -> typing.Mapping[str, str]:
+        return self.config.snapshot.aliases
 
     @property
     def token(self) -> str:
@@ -259,17 +308,7 @@ class ModmailBot(commands.Bot):
 
     @property
     def main_category(self) -> typing.Optional[discord.TextChannel]:
-        category_id = self.config.get("main_category_id")
-        if category_id is not None:
-            return discord.utils.get(self.modmail_guild.categories, id=int(category_id))
-
-        if self.modmail_guild:
-            return discord.utils.get(self.modmail_guild.categories, name="Modmail")
-        return None
-
-    @property
-    def blocked_users(self) -> typing.Dict[str, str]:
-        return self.config.get("blocked", {})
+        return self.config.snapshot.main_category
 
     @property
     def blocked_whitelisted_users(self) -> typing.List[str]:
@@ -277,46 +316,19 @@ class ModmailBot(commands.Bot):
 
     @property
     def prefix(self) -> str:
-        return self.config.get("prefix", "?")
+        return self.config.snapshot.prefix
 
     @property
     def mod_color(self) -> typing.Union[discord.Color, int]:
-        color = self.config.get("mod_color")
-        if not color:
-            return discord.Color.green()
-        try:
-            color = int(color.lstrip("#"), base=16)
-        except ValueError:
-            logger.error(error("Invalid mod_color provided"))
-            return discord.Color.green()
-        else:
-            return color
+        return self.config.snapshot.mod_color
 
     @property
     def recipient_color(self) -> typing.Union[discord.Color, int]:
-        color = self.config.get("recipient_color")
-        if not color:
-            return discord.Color.gold()
-        try:
-            color = int(color.lstrip("#"), base=16)
-        except ValueError:
-            logger.error(error("Invalid recipient_color provided"))
-            return discord.Color.gold()
-        else:
-            return color
+        return self.config.snapshot.recipient_color
 
     @property
     def main_color(self) -> typing.Union[discord.Color, int]:
-        color = self.config.get("main_color")
-        if not color:
-            return discord.Color.blurple()
-        try:
-            color = int(color.lstrip("#"), base=16)
-        except ValueError:
-            logger.error(error("Invalid main_color provided"))
-            return discord.Color.blurple()
-        else:
-            return color
+        return self.config.snapshot.main_color
 
     async def on_connect(self):
         logger.info(LINE)
@@ -325,37 +337,22 @@ class ModmailBot(commands.Bot):
         logger.info(info("Connected to gateway."))
 
         await self.config.refresh()
+        self.attachment_mirror.load_config()
+        await self.blocks.load()
         if self.db:
-            await self.setup_indexes()
+            self.loop.create_task(self.setup_indexes())
         self._connected.set()
 
     async def setup_indexes(self):
-        """Setup text indexes so we can use the $search operator"""
-        coll = self.db.logs
-        index_name = "messages.content_text_messages.author.name_text_key_text"
-
-        index_info = await coll.index_information()
-
-        # Backwards compatibility
-        old_index = "messages.content_text_messages.author.name_text"
-        if old_index in index_info:
-            logger.info(info(f"Dropping old index: {old_index}"))
-            await coll.drop_index(old_index)
-
-        if index_name not in index_info:
-            logger.info(info('Creating "text" index for logs collection.'))
-            logger.info(info("Name: " + index_name))
-            await coll.create_index(
-                [
-                    ("messages.content", "text"),
-                    ("messages.author.name", "text"),
-                    ("key", "text"),
-                ]
-            )
+        """Builds the indexes the bot's queries need, see `core.indexes`."""
+        await indexes.setup_indexes(self.db)
 
     async def on_ready(self):
         """Bot startup, sets uptime."""
         await self._connected.wait()
+        # The channels in the config can only be resolved once the guilds
+        # are cached.
+        self.config.invalidate()
         logger.info(LINE)
         logger.info(info("Client ready."))
         logger.info(LINE)
@@ -369,12 +366,25 @@ class ModmailBot(commands.Bot):
 
         if not self.guild:
             logger.error(error("WARNING - The GUILD_ID " "provided does not exist!"))
+            self.threads.mark_populated()
         else:
             await self.threads.populate_cache()
+            if self.api.separate_log_messages and self._log_migration is None:
+                self._log_migration = self.loop.create_task(
+                    self.api.migrate_log_messages()
+                )
+            if self.log_archive.days is not None and self._log_archival is None:
+                self._log_archival = self.loop.create_task(self.log_archive.run())
 
         # Wait until config cache is populated with stuff from db
         await self.config.wait_until_ready()
 
+        if not self._watchers:
+            self._start_watcher("config", self.config.watch)
+            self._start_watcher("blocks", self.blocks.watch)
+            for name, records in self.config.records.items():
+                self._start_watcher(name, records.watch)
+
         # closures
         closures = self.config.closures.copy()
         logger.info(
@@ -392,8 +402,7 @@ class ModmailBot(commands.Bot):
 
             if not thread:
                 # If the channel is deleted
-                self.config.closures.pop(str(recipient_id))
-                await self.config.update()
+                await self.config.closures.pop(str(recipient_id))
                 continue
 
             await thread.close(
@@ -407,50 +416,53 @@ class ModmailBot(commands.Bot):
 
         logger.info(LINE)
 
-    async def convert_emoji(self, name: str) -> str:
-        ctx = SimpleNamespace(bot=self, guild=self.modmail_guild)
-        converter = commands.EmojiConverter()
+    async def convert_emoji(self, name: str) -> typing.Union[str, discord.Emoji]:
+        emoji = self._emoji_cache.get(name)
+        if emoji is not None:
+            return emoji
 
+        emoji = name
         if name not in UNICODE_EMOJI:
+            ctx = SimpleNamespace(bot=self, guild=self.modmail_guild)
+            converter = commands.EmojiConverter()
             try:
-                name = await converter.convert(ctx, name.strip(":"))
+                emoji = await converter.convert(ctx, name.strip(":"))
             except commands.BadArgument:
                 logger.warning(info("%s is not a valid emoji."), name)
                 raise
-        return name
 
-    async def retrieve_emoji(self) -> typing.Tuple[str, str]:
+        self._emoji_cache[name] = emoji
+        return emoji
 
-        sent_emoji = self.config.get("sent_emoji", "✅")
-        blocked_emoji = self.config.get("blocked_emoji", "🚫")
+    def clear_emoji_cache(self) -> None:
+        """
+        Forgets all emoji resolved by `convert_emoji`, and the block
+        policy holding the sent and blocked emoji.
+        """
+        self._emoji_cache.clear()
+        self._block_policy = None
 
-        if sent_emoji != "disable":
-            try:
-                sent_emoji = await self.convert_emoji(sent_emoji)
-            except commands.BadArgument:
-                logger.warning(info("Removed sent emoji (%s)."), sent_emoji)
-                del self.config.cache["sent_emoji"]
-                await self.config.update()
-                sent_emoji = "✅"
+    async def on_guild_emojis_update(self, guild, before, after):
+        self.clear_emoji_cache()
 
-        if blocked_emoji != "disable":
-            try:
-                blocked_emoji = await self.convert_emoji(blocked_emoji)
-            except commands.BadArgument:
-                logger.warning(info("Removed blocked emoji (%s)."), blocked_emoji)
-                del self.config.cache["blocked_emoji"]
-                await self.config.update()
-                blocked_emoji = "🚫"
+    async def get_block_policy(self) -> BlockPolicy:
+        """The compiled block policy, recompiled when its config changes."""
+        policy = self._block_policy
+        if policy is None or not policy.is_current(self.config):
+            policy = self._block_policy = await BlockPolicy.compile(self)
+        return policy
 
-        return sent_emoji, blocked_emoji
+    async def retrieve_emoji(self) -> typing.Tuple[str, str]:
+        policy = await self.get_block_policy()
+        return policy.sent_emoji, policy.blocked_emoji
 
     async def _process_blocked(self, message: discord.Message) -> bool:
-        sent_emoji, blocked_emoji = await self.retrieve_emoji()
+        policy = await self.get_block_policy()
+        sent_emoji, blocked_emoji = policy.sent_emoji, policy.blocked_emoji
+        author_id = str(message.author.id)
 
-        if str(message.author.id) in self.blocked_whitelisted_users:
-            if str(message.author.id) in self.blocked_users:
-                del self.config.blocked[str(message.author.id)]
-                await self.config.update()
+        if author_id in self.blocked_whitelisted_users:
+            await self.blocks.remove(author_id)
 
             if sent_emoji != "disable":
                 try:
@@ -461,80 +473,42 @@ class ModmailBot(commands.Bot):
             return False
 
         now = datetime.utcnow()
+        block = self.blocks.get(author_id)
 
-        account_age = self.config.get("account_age")
-        guild_age = self.config.get("guild_age")
-        if account_age is None:
-            account_age = isodate.duration.Duration()
-        else:
+        min_account_age = min_guild_age = now
+
+        if policy.account_age is not None:
             try:
-                account_age = isodate.parse_duration(account_age)
-            except isodate.ISO8601Error:
-                logger.warning(
-                    "The account age limit needs to be a "
-                    "ISO-8601 duration formatted duration string "
-                    'greater than 0 days, not "%s".',
-                    str(account_age),
-                )
+                min_account_age = message.author.created_at + policy.account_age
+            except ValueError as exc:
+                logger.warning(exc.args[0])
                 del self.config.cache["account_age"]
                 await self.config.update()
-                account_age = isodate.duration.Duration()
 
-        if guild_age is None:
-            guild_age = isodate.duration.Duration()
-        else:
+        if policy.guild_age is not None:
             try:
-                guild_age = isodate.parse_duration(guild_age)
-            except isodate.ISO8601Error:
-                logger.warning(
-                    "The guild join age limit needs to be a "
-                    "ISO-8601 duration formatted duration string "
-                    'greater than 0 days, not "%s".',
-                    str(guild_age),
-                )
+                member = self.guild.get_member(message.author.id)
+                if member:
+                    min_guild_age = member.joined_at + policy.guild_age
+            except ValueError as exc:
+                logger.warning(exc.args[0])
                 del self.config.cache["guild_age"]
                 await self.config.update()
-                guild_age = isodate.duration.Duration()
-
-        reason = self.blocked_users.get(str(message.author.id))
-        if reason is None:
-            reason = ""
-
-        try:
-            min_account_age = message.author.created_at + account_age
-        except ValueError as exc:
-            logger.warning(exc.args[0])
-            del self.config.cache["account_age"]
-            await self.config.update()
-            min_account_age = now
-
-        try:
-            member = self.guild.get_member(message.author.id)
-            if member:
-                min_guild_age = member.joined_at + guild_age
-            else:
-                min_guild_age = now
-        except ValueError as exc:
-            logger.warning(exc.args[0])
-            del self.config.cache["guild_age"]
-            await self.config.update()
-            min_guild_age = now
 
         if min_account_age > now:
             # User account has not reached the required time
             reaction = blocked_emoji
-            changed = False
             delta = human_timedelta(min_account_age)
 
-            if str(message.author.id) not in self.blocked_users:
-                new_reason = (
-                    f"System Message: New Account. Required to wait for {delta}."
+            if block is None:
+                block = await self.blocks.add(
+                    author_id,
+                    NEW_ACCOUNT,
+                    f"Required to wait for {delta}.",
+                    expires_at=min_account_age,
                 )
-                self.config.blocked[str(message.author.id)] = new_reason
-                await self.config.update()
-                changed = True
 
-            if reason.startswith("System Message: New Account.") or changed:
+            if block.kind == NEW_ACCOUNT:
                 await message.channel.send(
                     embed=discord.Embed(
                         title="Message not sent!",
@@ -547,18 +521,17 @@ class ModmailBot(commands.Bot):
         elif min_guild_age > now:
             # User has not stayed in the guild for long enough
             reaction = blocked_emoji
-            changed = False
             delta = human_timedelta(min_guild_age)
 
-            if str(message.author.id) not in self.blocked_users:
-                new_reason = (
-                    f"System Message: Recently Joined. Required to wait for {delta}."
+            if block is None:
+                block = await self.blocks.add(
+                    author_id,
+                    RECENTLY_JOINED,
+                    f"Required to wait for {delta}.",
+                    expires_at=min_guild_age,
                 )
-                self.config.blocked[str(message.author.id)] = new_reason
-                await self.config.update()
-                changed = True
 
-            if reason.startswith("System Message: Recently Joined.") or changed:
+            if block.kind == RECENTLY_JOINED:
                 await message.channel.send(
                     embed=discord.Embed(
                         title="Message not sent!",
@@ -568,26 +541,16 @@ class ModmailBot(commands.Bot):
                     )
                 )
 
-        elif str(message.author.id) in self.blocked_users:
+        elif block is not None:
             reaction = blocked_emoji
-            if reason.startswith("System Message: New Account.") or reason.startswith(
-                "System Message: Recently Joined."
-            ):
+            if block.is_system:
                 # Met the age limit already
                 reaction = sent_emoji
-                del self.config.blocked[str(message.author.id)]
-                await self.config.update()
-            else:
-                end_time = re.search(r"%(.+?)%$", reason)
-                if end_time is not None:
-                    after = (
-                        datetime.fromisoformat(end_time.group(1)) - now
-                    ).total_seconds()
-                    if after <= 0:
-                        # No longer blocked
-                        reaction = sent_emoji
-                        del self.config.blocked[str(message.author.id)]
-                        await self.config.update()
+                await self.blocks.remove(author_id)
+            elif block.is_expired(now):
+                # No longer blocked
+                reaction = sent_emoji
+                await self.blocks.remove(author_id)
         else:
             reaction = sent_emoji
 
@@ -596,14 +559,30 @@ class ModmailBot(commands.Bot):
                 await message.add_reaction(reaction)
             except (discord.HTTPException, discord.InvalidArgument):
                 pass
-        return str(message.author.id) in self.blocked_users
+        return author_id in self.blocks
 
     async def process_modmail(self, message: discord.Message) -> None:
-        """Processes messages sent to the bot."""
-        blocked = await self._process_blocked(message)
-        if not blocked:
-            thread = await self.threads.find_or_create(message.author)
-            await thread.send(message)
+        """Queues messages sent to the bot, see `InboundQueue`."""
+        self.inbound.put(message)
+
+    async def _process_modmail_batch(
+        self, messages: typing.List[discord.Message]
+    ) -> None:
+        """Processes messages sent to the bot by a single recipient, in order."""
+        thread = None
+        for message in messages:
+            # One failed message shouldn't drop the rest of the batch.
+            try:
+                blocked = await self._process_blocked(message)
+                if blocked:
+                    continue
+                if thread is None:
+                    thread = await self.threads.find_or_create(message.author)
+                await thread.send(message)
+            except Exception:
+                logger.error(
+                    error(f"Failed to process message {message.id}."), exc_info=True
+                )
 
     async def get_context(self, message, *, cls=commands.Context):
         """
@@ -628,7 +607,7 @@ class ModmailBot(commands.Bot):
         invoker = view.get_word().lower()
 
         # Check if there is any aliases being called.
-        alias = self.config.get("aliases", {}).get(invoker)
+        alias = self.aliases.get(invoker)
         if alias is not None:
             ctx._alias_invoked = True
             len_ = len(f"{invoked_prefix}{invoker}")
@@ -746,22 +725,48 @@ class ModmailBot(commands.Bot):
                 if not self.config.get("disable_recipient_thread_close"):
                     await thread.close(closer=user)
         elif not isinstance(channel, discord.DMChannel):
+            thread = await self.threads.find(channel=message.channel)
+            if not thread:
+                return
+
+            link = await self.links.get(message.id)
+            if link is not None:
+                if link["kind"] != links.RECIPIENT:
+                    return
+                channel = await self._recipient_dm(thread)
+                try:
+                    msg = await channel.fetch_message(link["dm"])
+                except discord.NotFound:
+                    # The DM was deleted since, the link is stale.
+                    return await self.links.remove(link)
+                return await msg.add_reaction(reaction)
+
+            # Messages relayed before links were recorded.
             if not message.embeds:
                 return
             message_id = str(message.embeds[0].author.url).split("/")[-1]
             if message_id.isdigit():
-                thread = await self.threads.find(channel=message.channel)
-                channel = thread.recipient.dm_channel
-                if not channel:
-                    channel = await thread.recipient.create_dm()
+                channel = await self._recipient_dm(thread)
                 async for msg in channel.history():
                     if msg.id == int(message_id):
                         await msg.add_reaction(reaction)
 
+    @staticmethod
+    async def _recipient_dm(thread) -> discord.DMChannel:
+        return thread.recipient.dm_channel or await thread.recipient.create_dm()
+
+    async def on_guild_channel_create(self, channel):
+        if channel.guild == self.modmail_guild:
+            self.config.invalidate()
+
     async def on_guild_channel_delete(self, channel):
         if channel.guild != self.modmail_guild:
             return
 
+        self.config.invalidate()
+        thread = await self.threads.find(channel=channel)
+        self.threads.forget_channel(channel)
+
         audit_logs = self.modmail_guild.audit_logs()
         entry = await audit_logs.find(lambda e: e.target.id == channel.id)
         mod = entry.user
@@ -778,12 +783,20 @@ class ModmailBot(commands.Bot):
             await self.config.update({"log_channel_id": None})
             return
 
-        thread = await self.threads.find(channel=channel)
         if not thread:
             return
 
         await thread.close(closer=mod, silent=True, delete_channel=False)
 
+    async def on_guild_channel_update(self, before, after):
+        if after.guild != self.modmail_guild:
+            return
+        self.config.invalidate()
+        if not isinstance(after, discord.TextChannel):
+            return
+        if before.topic != after.topic:
+            self.threads.reindex_channel(after)
+
     async def on_member_remove(self, member):
         thread = await self.threads.find(recipient=member)
         if thread:
@@ -804,6 +817,24 @@ class ModmailBot(commands.Bot):
     async def on_message_delete(self, message):
         """Support for deleting linked messages"""
         if message.embeds and not isinstance(message.channel, discord.DMChannel):
+            link = await self.links.get(message.id)
+            if link is not None:
+                if link.get("thread") != message.id:
+                    return
+                await self.links.remove(link)
+                if link["kind"] not in links.MOD_REPLIES or link.get("dm") is None:
+                    return
+                thread = await self.threads.find(channel=message.channel)
+                if thread is None or thread.recipient is None:
+                    # The thread is closed, or its recipient unknown.
+                    return
+                channel = await self._recipient_dm(thread)
+                try:
+                    return await self.http.delete_message(channel.id, link["dm"])
+                except discord.NotFound:
+                    return
+
+            # Messages relayed before links were recorded.
             message_id = str(message.embeds[0].author.url).split("/")[-1]
             if message_id.isdigit():
                 thread = await self.threads.find(channel=message.channel)
@@ -816,14 +847,101 @@ class ModmailBot(commands.Bot):
                         if message_id == url.split("/")[-1]:
                             return await msg.delete()
 
-    async def on_bulk_message_delete(self, messages):
-        await discord.utils.async_all(self.on_message_delete(msg) for msg in messages)
+    async def on_bulk_message_delete(self, messages, concurrency: int = 5):
+        """Support for deleting linked messages of purged thread messages."""
+        messages = [
+            m
+            for m in messages
+            if m.embeds and not isinstance(m.channel, discord.DMChannel)
+        ]
+        if not messages:
+            return
+
+        found = await self.links.get_many(m.id for m in messages)
+        if found:
+            await self.links.remove_many(found.values())
+
+        semaphore = asyncio.Semaphore(concurrency)
+        unmatched = []
+
+        async def delete(channel, message_id, purged_id):
+            async with semaphore:
+                try:
+                    await self.http.delete_message(channel.id, message_id)
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException:
+                    unmatched.append(purged_id)
+
+        tasks = []
+        legacy = {}
+        for message in messages:
+            link = found.get(message.id)
+            if link is not None and (
+                link["kind"] not in links.MOD_REPLIES or link.get("dm") is None
+            ):
+                continue
+
+            thread = await self.threads.find(channel=message.channel)
+            if thread is None or thread.recipient is None:
+                unmatched.append(message.id)
+                continue
+            channel = thread.recipient.dm_channel
+            if not channel:
+                channel = await thread.recipient.create_dm()
+
+            if link is not None:
+                tasks.append(delete(channel, link["dm"], message.id))
+                continue
+
+            # Messages relayed before links were recorded.
+            message_id = str(message.embeds[0].author.url).split("/")[-1]
+            if message_id.isdigit():
+                legacy.setdefault(channel, {})[message_id] = message.id
+
+        for channel, ids in legacy.items():
+            async for msg in channel.history():
+                if not ids:
+                    break
+                if msg.embeds and msg.embeds[0].author:
+                    url = str(msg.embeds[0].author.url)
+                    purged_id = ids.pop(url.split("/")[-1], None)
+                    if purged_id is not None:
+                        tasks.append(delete(channel, msg.id, purged_id))
+            unmatched.extend(ids.values())
+
+        await asyncio.gather(*tasks)
+
+        if unmatched:
+            logger.info(
+                info(
+                    f"Could not delete the linked messages of {len(unmatched)} "
+                    "purged message(s): " + ", ".join(map(str, unmatched))
+                )
+            )
 
     async def on_message_edit(self, before, after):
         if before.author.bot:
             return
         if isinstance(before.channel, discord.DMChannel):
             thread = await self.threads.find(recipient=before.author)
+            if not thread:
+                return
+
+            link = await self.links.get(before.id)
+            if link is not None:
+                try:
+                    msg = await thread.channel.fetch_message(link["thread"])
+                except discord.NotFound:
+                    return
+                embed = msg.embeds[0]
+                embed.description = after.content
+                await msg.edit(embed=embed)
+                return await self.api.edit_message(
+                    str(after.id), after.content, thread.channel.id
+                )
+
+            # Messages relayed before links were recorded.
             async for msg in thread.channel.history():
                 if msg.embeds:
                     embed = msg.embeds[0]
@@ -831,7 +949,9 @@ class ModmailBot(commands.Bot):
                     if matches and matches[-1] == str(before.id):
                         embed.description = after.content
                         await msg.edit(embed=embed)
-                        await self.api.edit_message(str(after.id), after.content)
+                        await self.api.edit_message(
+                            str(after.id), after.content, thread.channel.id
+                        )
                         break
 
     async def on_error(self, event_method, *args, **kwargs):
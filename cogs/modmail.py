@@ -12,10 +12,12 @@ from natural.date import duration
 
 from core import checks
 from core.decorators import trigger_typing
+from core.export import FORMATS, export_to_file
 from core.models import PermissionLevel
-from core.paginator import PaginatorSession
+from core.logsearch import LogSearch, parse_filters
+from core.paginator import PaginatorSession, FunctionPageSource
 from core.time import UserFriendlyTime, human_timedelta
-from core.utils import format_preview, User
+from core.utils import format_preview, truncate, User
 
 
 class Modmail(commands.Cog):
@@ -329,10 +331,7 @@ class Modmail(commands.Cog):
         else:
             raise commands.BadArgument(f"{user_or_role} is not a valid role.")
 
-        if str(thread.id) not in self.bot.config["notification_squad"]:
-            self.bot.config["notification_squad"][str(thread.id)] = []
-
-        mentions = self.bot.config["notification_squad"][str(thread.id)]
+        mentions = self.bot.config.notification_squad.get(str(thread.id), [])
 
         if mention in mentions:
             embed = discord.Embed(
@@ -340,8 +339,7 @@ class Modmail(commands.Cog):
                 description=f"{mention} is already " "going to be mentioned.",
             )
         else:
-            mentions.append(mention)
-            await self.bot.config.update()
+            await self.bot.config.notification_squad.add(str(thread.id), mention)
             embed = discord.Embed(
                 color=self.bot.main_color,
                 description=f"{mention} will be mentioned "
@@ -373,10 +371,7 @@ class Modmail(commands.Cog):
         else:
             mention = f"`{user_or_role}`"
 
-        if str(thread.id) not in self.bot.config["notification_squad"]:
-            self.bot.config["notification_squad"][str(thread.id)] = []
-
-        mentions = self.bot.config["notification_squad"][str(thread.id)]
+        mentions = self.bot.config.notification_squad.get(str(thread.id), [])
 
         if mention not in mentions:
             embed = discord.Embed(
@@ -384,8 +379,7 @@ class Modmail(commands.Cog):
                 description=f"{mention} does not have a " "pending notification.",
             )
         else:
-            mentions.remove(mention)
-            await self.bot.config.update()
+            await self.bot.config.notification_squad.remove(str(thread.id), mention)
             embed = discord.Embed(
                 color=self.bot.main_color,
                 description=f"{mention} will no longer " "be notified.",
@@ -418,10 +412,7 @@ class Modmail(commands.Cog):
         else:
             raise commands.BadArgument(f"{user_or_role} is not a valid role.")
 
-        if str(thread.id) not in self.bot.config["subscriptions"]:
-            self.bot.config["subscriptions"][str(thread.id)] = []
-
-        mentions = self.bot.config["subscriptions"][str(thread.id)]
+        mentions = self.bot.config.subscriptions.get(str(thread.id), [])
 
         if mention in mentions:
             embed = discord.Embed(
@@ -429,8 +420,7 @@ class Modmail(commands.Cog):
                 description=f"{mention} is already " "subscribed to this thread.",
             )
         else:
-            mentions.append(mention)
-            await self.bot.config.update()
+            await self.bot.config.subscriptions.add(str(thread.id), mention)
             embed = discord.Embed(
                 color=self.bot.main_color,
                 description=f"{mention} will now be "
@@ -462,10 +452,7 @@ class Modmail(commands.Cog):
         else:
             mention = f"`{user_or_role}`"
 
-        if str(thread.id) not in self.bot.config["subscriptions"]:
-            self.bot.config["subscriptions"][str(thread.id)] = []
-
-        mentions = self.bot.config["subscriptions"][str(thread.id)]
+        mentions = self.bot.config.subscriptions.get(str(thread.id), [])
 
         if mention not in mentions:
             embed = discord.Embed(
@@ -473,8 +460,7 @@ class Modmail(commands.Cog):
                 description=f"{mention} is not already " "subscribed to this thread.",
             )
         else:
-            mentions.remove(mention)
-            await self.bot.config.update()
+            await self.bot.config.subscriptions.remove(str(thread.id), mention)
             embed = discord.Embed(
                 color=self.bot.main_color,
                 description=f"{mention} is now unsubscribed " "to this thread.",
@@ -499,46 +485,60 @@ class Modmail(commands.Cog):
             embed=discord.Embed(color=self.bot.main_color, description=log_link)
         )
 
-    def format_log_embeds(self, logs, avatar_url):
-        embeds = []
-        logs = tuple(logs)
-        title = f"Total Results Found ({len(logs)})"
+    def format_log_embed(self, entry, avatar_url, total):
+        title = f"Total Results Found ({total})"
+        key = entry["key"]
 
-        for entry in logs:
+        created_at = parser.parse(entry["created_at"])
 
-            key = entry["key"]
+        prefix = os.getenv("LOG_URL_PREFIX", "/logs")
+        if prefix == "NONE":
+            prefix = ""
 
-            created_at = parser.parse(entry["created_at"])
+        log_url = self.bot.config.log_url.strip("/") + f"{prefix}/{key}"
 
-            prefix = os.getenv("LOG_URL_PREFIX", "/logs")
-            if prefix == "NONE":
-                prefix = ""
+        username = entry["recipient"]["name"] + "#"
+        username += entry["recipient"]["discriminator"]
 
-            log_url = self.bot.config.log_url.strip("/") + f"{prefix}/{key}"
+        embed = discord.Embed(color=self.bot.main_color, timestamp=created_at)
+        embed.set_author(name=f"{title} - {username}", icon_url=avatar_url, url=log_url)
+        embed.url = log_url
+        embed.add_field(
+            name="Created", value=duration(created_at, now=datetime.utcnow())
+        )
+        embed.add_field(name="Closed By", value=f"<@{entry['closer']['id']}>")
 
-            username = entry["recipient"]["name"] + "#"
-            username += entry["recipient"]["discriminator"]
+        if entry["recipient"]["id"] != entry["creator"]["id"]:
+            embed.add_field(name="Created by", value=f"<@{entry['creator']['id']}>")
 
-            embed = discord.Embed(color=self.bot.main_color, timestamp=created_at)
-            embed.set_author(
-                name=f"{title} - {username}", icon_url=avatar_url, url=log_url
-            )
-            embed.url = log_url
-            embed.add_field(
-                name="Created", value=duration(created_at, now=datetime.utcnow())
-            )
-            embed.add_field(name="Closed By", value=f"<@{entry['closer']['id']}>")
+        embed.add_field(
+            name="Preview", value=format_preview(entry["messages"]), inline=False
+        )
+        embed.add_field(name="Link", value=log_url)
+        embed.set_footer(text="Recipient ID: " + str(entry["recipient"]["id"]))
+        return embed
+
+    async def paginate_logs(self, ctx, search, avatar_url, not_found, summary=None):
+        """Shows the results of a `LogSearch`, rendering only the viewed page."""
+        total = await search.count()
+        if not total:
+            embed = discord.Embed(color=discord.Color.red(), description=not_found)
+            return await ctx.send(embed=embed)
 
-            if entry["recipient"]["id"] != entry["creator"]["id"]:
-                embed.add_field(name="Created by", value=f"<@{entry['creator']['id']}>")
+        async def page_factory(index):
+            entry = await search.get(index)
+            if entry is None:
+                # Deleted or archived since the logs were counted.
+                return discord.Embed(
+                    color=discord.Color.red(), description="This log no longer exists."
+                )
+            embed = self.format_log_embed(entry, avatar_url, total)
+            if summary is not None:
+                embed.description = summary
+            return embed
 
-            embed.add_field(
-                name="Preview", value=format_preview(entry["messages"]), inline=False
-            )
-            embed.add_field(name="Link", value=log_url)
-            embed.set_footer(text="Recipient ID: " + str(entry["recipient"]["id"]))
-            embeds.append(embed)
-        return embeds
+        session = PaginatorSession(ctx, source=FunctionPageSource(total, page_factory))
+        await session.run()
 
     @commands.group(invoke_without_command=True)
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -562,21 +562,21 @@ class Modmail(commands.Cog):
         default_avatar = "https://cdn.discordapp.com/embed/avatars/0.png"
         icon_url = getattr(user, "avatar_url", default_avatar)
 
-        logs = await self.bot.api.get_user_logs(user.id)
-
-        if not any(not log["open"] for log in logs):
-            embed = discord.Embed(
-                color=discord.Color.red(),
-                description="This user does not " "have any previous logs.",
-            )
-            return await ctx.send(embed=embed)
-
-        logs = reversed([e for e in logs if not e["open"]])
-
-        embeds = self.format_log_embeds(logs, avatar_url=icon_url)
-
-        session = PaginatorSession(ctx, *embeds)
-        await session.run()
+        stats = await self.bot.api.get_user_stats(user.id)
+        summary = f"**{stats['total_messages']}** messages in past threads."
+        if stats["last_closed"]:
+            last_closed = parser.parse(stats["last_closed"])
+            summary += f" Last closed {duration(last_closed, now=datetime.utcnow())}."
+
+        # closed_count may lag behind the logs, the pages are counted exactly.
+        search = LogSearch(self.bot.api, {"recipient.id": str(user.id)})
+        await self.paginate_logs(
+            ctx,
+            search,
+            icon_url,
+            "This user does not have any previous logs.",
+            summary=summary,
+        )
 
     @logs.command(name="closed-by", aliases=["closeby"])
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -589,27 +589,13 @@ class Modmail(commands.Cog):
         """
         user = user if user is not None else ctx.author
 
-        query = {
-            "guild_id": str(self.bot.guild_id),
-            "open": False,
-            "closer.id": str(user.id),
-        }
-
-        projection = {"messages": {"$slice": 5}}
-
-        entries = await self.bot.db.logs.find(query, projection).to_list(None)
-
-        embeds = self.format_log_embeds(entries, avatar_url=self.bot.guild.icon_url)
-
-        if not embeds:
-            embed = discord.Embed(
-                color=discord.Color.red(),
-                description="No log entries have been found for that query",
-            )
-            return await ctx.send(embed=embed)
-
-        session = PaginatorSession(ctx, *embeds)
-        await session.run()
+        search = LogSearch(self.bot.api, {"closer.id": str(user.id)})
+        await self.paginate_logs(
+            ctx,
+            search,
+            self.bot.guild.icon_url,
+            "No log entries have been found for that query",
+        )
 
     @logs.command(name="search", aliases=["find"])
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -618,31 +604,158 @@ class Modmail(commands.Cog):
         Retrieve all logs that contain messages with your query.
 
         Provide a `limit` to specify the maximum number of logs the bot should find.
+
+        The query may include filters:
+        - `after:<date>` and `before:<date>`, to only search logs created in that time.
+        - `closer:<user ID>`, to only search logs closed by that user.
         """
 
         await ctx.trigger_typing()
 
-        query = {
-            "guild_id": str(self.bot.guild_id),
-            "open": False,
-            "$text": {"$search": f'"{query}"'},
-        }
+        try:
+            filters, query = parse_filters(query)
+        except ValueError:
+            embed = discord.Embed(
+                color=discord.Color.red(), description="Invalid date in the filters."
+            )
+            return await ctx.send(embed=embed)
+
+        if query:
+            search = await LogSearch.text(self.bot.api, query, filters, limit)
+        else:
+            search = LogSearch(self.bot.api, filters, limit)
+
+        await self.paginate_logs(
+            ctx,
+            search,
+            self.bot.guild.icon_url,
+            "No log entries have been found for that query",
+        )
 
-        projection = {"messages": {"$slice": 5}}
+    @logs.command(name="export")
+    @checks.has_permissions(PermissionLevel.OWNER)
+    async def logs_export(self, ctx, fmt: Optional[str] = "jsonl", *, filters=""):
+        """
+        Export closed logs to a gzip compressed file.
 
-        entries = await self.bot.db.logs.find(query, projection).to_list(limit)
+        `fmt` may be `jsonl`, one log per line, or `csv`, one message per row.
 
-        embeds = self.format_log_embeds(entries, avatar_url=self.bot.guild.icon_url)
+        The same filters as `{prefix}logs search` can be used, as well as
+        `recipient:<user ID>`. The file is uploaded when it is small enough,
+        otherwise it is kept in the bot's `temp` folder.
+        """
+        if fmt not in FORMATS:
+            filters = f"{fmt} {filters}".strip()
+            fmt = "jsonl"
 
-        if not embeds:
+        try:
+            query, _ = parse_filters(filters)
+        except ValueError:
             embed = discord.Embed(
-                color=discord.Color.red(),
-                description="No log entries have been found for that query",
+                color=discord.Color.red(), description="Invalid date in the filters."
             )
             return await ctx.send(embed=embed)
+        query.update({"guild_id": str(self.bot.guild_id), "open": False})
 
-        session = PaginatorSession(ctx, *embeds)
-        await session.run()
+        file_name = f"logs-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}.gz"
+        path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "../temp", file_name
+        )
+
+        async with ctx.typing():
+            count = await export_to_file(
+                self.bot.db, query, path, fmt, archive_store=self.bot.log_archive.store
+            )
+
+        description = f"Exported {count} logs."
+        if os.path.getsize(path) <= 8 * 1024 * 1024:
+            await ctx.send(description, file=discord.File(path, file_name))
+            os.remove(path)
+        else:
+            description += f" It's too large to upload, so it was saved as `{path}`."
+            embed = discord.Embed(color=self.bot.main_color, description=description)
+            await ctx.send(embed=embed)
+
+    @staticmethod
+    def _format_seconds(seconds: float) -> str:
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours:
+            return f"{hours}h {minutes}m"
+        if minutes:
+            return f"{minutes}m {seconds}s"
+        return f"{seconds}s"
+
+    @commands.group(invoke_without_command=True)
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @trigger_typing
+    async def stats(self, ctx, days: int = 7):
+        """
+        Shows thread statistics of the last `days` days.
+
+        Includes threads opened and closed per day, the average time
+        to the first staff reply and the moderators who closed the most threads.
+        """
+        days = max(1, min(days, 365))
+        daily, moderators = await self.bot.analytics.get_period(days)
+
+        opened = sum(d.get("opened", 0) for d in daily)
+        closed = sum(d.get("closed", 0) for d in daily)
+        replies = sum(d.get("first_replies", 0) for d in daily)
+        reply_seconds = sum(d.get("first_reply_seconds", 0) for d in daily)
+
+        embed = discord.Embed(
+            title=f"Statistics of the last {days} days", color=self.bot.main_color
+        )
+        embed.add_field(name="Opened", value=str(opened))
+        embed.add_field(name="Closed", value=str(closed))
+        embed.add_field(
+            name="Average first reply",
+            value=self._format_seconds(reply_seconds / replies) if replies else "N/A",
+        )
+
+        if daily:
+            lines = [
+                f"`{d['day']}` {d.get('opened', 0)} opened, "
+                f"{d.get('closed', 0)} closed"
+                for d in daily[-14:]
+            ]
+            embed.add_field(name="Per day", value="\n".join(lines), inline=False)
+
+        closers = {}
+        for doc in moderators:
+            mod_id = doc["mod_id"]
+            closers[mod_id] = closers.get(mod_id, 0) + doc.get("closed", 0)
+        top = sorted(closers.items(), key=lambda x: x[1], reverse=True)[:5]
+        top = [(mod_id, count) for mod_id, count in top if count]
+        if top:
+            embed.add_field(
+                name="Top closers",
+                value="\n".join(f"<@{mod_id}> - {count}" for mod_id, count in top),
+                inline=False,
+            )
+
+        embed.set_footer(
+            text=f'Use "{self.bot.prefix}stats backfill" to count older threads.'
+        )
+        await ctx.send(embed=embed)
+
+    @stats.command(name="backfill")
+    @checks.has_permissions(PermissionLevel.OWNER)
+    @trigger_typing
+    async def stats_backfill(self, ctx):
+        """
+        Rebuilds the statistics from all existing logs.
+
+        Statistics of the days being rebuilt may be off for
+        threads that change while the backfill runs.
+        """
+        written = await self.bot.analytics.backfill()
+        embed = discord.Embed(
+            color=self.bot.main_color,
+            description=f"Rebuilt the statistics of {written} days and moderators.",
+        )
+        await ctx.send(embed=embed)
 
     @commands.command()
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -690,6 +803,14 @@ class Modmail(commands.Cog):
             await msg.pin()
 
     async def find_linked_message(self, ctx, message_id):
+        if message_id is None:
+            link = await self.bot.links.last_reply(ctx.channel.id)
+        else:
+            link = await self.bot.links.get(message_id)
+        if link is not None:
+            return str(link["_id"])
+
+        # Messages relayed before links were recorded.
         linked_message_id = None
 
         async for msg in ctx.channel.history():
@@ -736,7 +857,7 @@ class Modmail(commands.Cog):
 
         await asyncio.gather(
             thread.edit_message(linked_message_id, message),
-            self.bot.api.edit_message(linked_message_id, message),
+            self.bot.api.edit_message(linked_message_id, message, thread.channel.id),
         )
 
         await ctx.message.add_reaction("✅")
@@ -796,44 +917,40 @@ class Modmail(commands.Cog):
     async def blocked(self, ctx):
         """Retrieve a list of blocked users."""
 
-        embeds = [
-            discord.Embed(
-                title="Blocked Users", color=self.bot.main_color, description=""
+        total = await self.bot.blocks.count()
+        if not total:
+            embed = discord.Embed(
+                title="Blocked Users",
+                color=self.bot.main_color,
+                description="Currently there are no blocked users.",
             )
-        ]
+            return await ctx.send(embed=embed)
 
-        users = []
+        per_page = 10
+        page_count = (total + per_page - 1) // per_page
 
-        for id_, reason in self.bot.blocked_users.items():
-            user = self.bot.get_user(int(id_))
-            if user:
-                users.append((user.mention, reason))
-            else:
-                try:
-                    user = await self.bot.fetch_user(id_)
-                    users.append((str(user), reason))
-                except discord.NotFound:
-                    pass
-
-        if users:
-            em = embeds[-1]
-
-            for mention, reason in users:
-                line = mention + f" - `{reason or 'No reason provided'}`\n"
-                if len(em.description) + len(line) > 2048:
-                    embeds.append(
-                        discord.Embed(
-                            title="Blocked Users (Continued)",
-                            color=self.bot.main_color,
-                            description=line,
-                        )
-                    )
+        async def format_page(index):
+            lines = []
+            for block in await self.bot.blocks.page(index, per_page):
+                id_ = block.user_id
+                user = self.bot.get_user(int(id_))
+                if user:
+                    name = user.mention
                 else:
-                    em.description += line
-        else:
-            embeds[-1].description = "Currently there are no blocked users."
+                    try:
+                        name = str(await self.bot.fetch_user(id_))
+                    except discord.NotFound:
+                        name = f"`{id_}`"
+                reason = truncate(block.description or "No reason provided", max=150)
+                lines.append(f"{name} - `{reason}`")
+
+            title = "Blocked Users" + (" (Continued)" if index else "")
+            return discord.Embed(
+                title=title, color=self.bot.main_color, description="\n".join(lines)
+            )
 
-        await PaginatorSession(ctx, *embeds).run()
+        source = FunctionPageSource(page_count, format_page)
+        await PaginatorSession(ctx, source=source).run()
 
     @blocked.command(name="whitelist")
     @checks.has_permissions(PermissionLevel.MODERATOR)
@@ -852,7 +969,6 @@ class Modmail(commands.Cog):
                 return await ctx.send_help(ctx.command)
 
         mention = getattr(user, "mention", f"`{user.id}`")
-        msg = ""
 
         if str(user.id) in self.bot.blocked_whitelisted_users:
             embed = discord.Embed(
@@ -864,19 +980,14 @@ class Modmail(commands.Cog):
             return await ctx.send(embed=embed)
 
         self.bot.blocked_whitelisted_users.append(str(user.id))
-
-        if str(user.id) in self.bot.blocked_users:
-            msg = self.bot.blocked_users.get(str(user.id))
-            if msg is None:
-                msg = ""
-            del self.bot.config.blocked[str(user.id)]
-
         await self.bot.config.update()
 
-        if msg.startswith("System Message: "):
+        block = await self.bot.blocks.remove(str(user.id))
+
+        if block is not None and block.is_system:
             # If the user is blocked internally (for example: below minimum account age)
             # Show an extended message stating the original internal message
-            reason = msg[16:].strip().rstrip(".") or "no reason"
+            reason = block.description.rstrip(".") or "no reason"
             embed = discord.Embed(
                 title="Success",
                 description=f"{mention} was previously blocked internally due to "
@@ -909,7 +1020,8 @@ class Modmail(commands.Cog):
         `after` may be a simple "human-readable" time text. See `{prefix}help close` for examples.
         """
 
-        reason = ""
+        reason = None
+        expires_at = None
 
         if user is None:
             thread = ctx.thread
@@ -931,30 +1043,22 @@ class Modmail(commands.Cog):
             return await ctx.send(embed=embed)
 
         if after is not None:
-            reason = after.arg
-            if reason.startswith("System Message: "):
-                raise commands.BadArgument(
-                    "The reason cannot start with `System Message:`."
-                )
-            if "%" in reason:
-                raise commands.BadArgument('The reason contains illegal character "%".')
+            reason = after.arg or None
             if after.dt > after.now:
-                reason = f"{reason} %{after.dt.isoformat()}%"
-
-        if not reason:
-            reason = None
+                expires_at = after.dt
 
         extend = f" for `{reason}`" if reason is not None else ""
-        msg = self.bot.blocked_users.get(str(user.id), "")
+        block = self.bot.blocks.get(str(user.id))
 
         if (
-            str(user.id) not in self.bot.blocked_users
+            block is None
             or reason is not None
-            or msg.startswith("System Message: ")
+            or expires_at is not None
+            or block.is_system
         ):
-            if str(user.id) in self.bot.blocked_users:
+            if block is not None:
 
-                old_reason = msg.strip().rstrip(".") or "no reason"
+                old_reason = block.description.rstrip(".") or "no reason"
                 embed = discord.Embed(
                     title="Success",
                     description=f"{mention} was previously blocked for "
@@ -967,8 +1071,12 @@ class Modmail(commands.Cog):
                     color=self.bot.main_color,
                     description=f"{mention} is now blocked{extend}.",
                 )
-            self.bot.config.blocked[str(user.id)] = reason
-            await self.bot.config.update()
+            await self.bot.blocks.add(
+                str(user.id),
+                reason=reason,
+                author_id=str(ctx.author.id),
+                expires_at=expires_at,
+            )
         else:
             embed = discord.Embed(
                 title="Error",
@@ -999,17 +1107,12 @@ class Modmail(commands.Cog):
 
         mention = getattr(user, "mention", f"`{user.id}`")
 
-        if str(user.id) in self.bot.blocked_users:
-            msg = self.bot.blocked_users.get(str(user.id))
-            if msg is None:
-                msg = ""
-            del self.bot.config.blocked[str(user.id)]
-            await self.bot.config.update()
-
-            if msg.startswith("System Message: "):
+        block = await self.bot.blocks.remove(str(user.id))
+        if block is not None:
+            if block.is_system:
                 # If the user is blocked internally (for example: below minimum account age)
                 # Show an extended message stating the original internal message
-                reason = msg[16:].strip().rstrip(".") or "no reason"
+                reason = block.description.rstrip(".") or "no reason"
                 embed = discord.Embed(
                     title="Success",
                     description=f"{mention} was previously blocked internally due to "
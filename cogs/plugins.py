@@ -18,7 +18,7 @@ from pkg_resources import parse_version
 
 from core import checks
 from core.models import PermissionLevel
-from core.paginator import PaginatorSession
+from core.paginator import PaginatorSession, FunctionPageSource
 from core.utils import error, info
 
 logger = logging.getLogger("Modmail")
@@ -387,8 +387,6 @@ class Plugins(commands.Cog):
 
         await self.populate_registry()
 
-        embeds = []
-
         registry = list(self.registry.items())
         random.shuffle(registry)
 
@@ -416,7 +414,8 @@ class Plugins(commands.Cog):
 
             return await ctx.send(embed=embed)
 
-        for name, details in registry:
+        async def format_page(i):
+            name, details = registry[i]
             repo = f"https://github.com/{details['repository']}"
             url = f"{repo}/tree/master/{name}"
 
@@ -438,10 +437,10 @@ class Plugins(commands.Cog):
                 embed.set_thumbnail(url=details.get("thumbnail_url"))
             if details.get("image_url"):
                 embed.set_image(url=details.get("image_url"))
+            return embed
 
-            embeds.append(embed)
-
-        paginator = PaginatorSession(ctx, *embeds)
+        source = FunctionPageSource(len(registry), format_page)
+        paginator = PaginatorSession(ctx, source=source)
         paginator.current = index
         await paginator.run()
 
@@ -20,19 +20,19 @@ from discord.ext import commands
 from aiohttp import ClientResponseError
 from pkg_resources import parse_version
 
-from core import checks
+from core import checks, indexes
 from core.changelog import Changelog
 from core.decorators import trigger_typing
 from core.models import InvalidConfigError, PermissionLevel
 from core.paginator import PaginatorSession, MessagePaginatorSession
+from core.paginator import FunctionPageSource
 from core.utils import cleanup_code, info, error, User, get_perm_level
 
 logger = logging.getLogger("Modmail")
 
 
 class ModmailHelpCommand(commands.HelpCommand):
-    async def format_cog_help(self, cog):
-        bot = self.context.bot
+    async def format_cog_chunks(self, cog):
         prefix = self.clean_prefix
 
         formats = [""]
@@ -52,34 +52,42 @@ class ModmailHelpCommand(commands.HelpCommand):
                 formats.append(format_)
             else:
                 formats[-1] += format_
+        return formats
 
-        embeds = []
-        for format_ in formats:
-            embed = Embed(
-                description=f'*{cog.description or "No description."}*',
-                color=bot.main_color,
-            )
+    def format_cog_page(self, cog, format_: str, continued: bool = False):
+        bot = self.context.bot
+        prefix = self.clean_prefix
 
-            embed.add_field(name="Commands", value=format_ or "No commands.")
+        embed = Embed(
+            description=f'*{cog.description or "No description."}*',
+            color=bot.main_color,
+        )
 
-            continued = " (Continued)" if embeds else ""
-            embed.set_author(
-                name=cog.qualified_name + " - Help" + continued,
-                icon_url=bot.user.avatar_url,
-            )
+        embed.add_field(name="Commands", value=format_ or "No commands.")
 
-            embed.set_footer(
-                text=f'Type "{prefix}{self.command_attrs["name"]} command" '
-                "for more info on a specific command."
-            )
-            embeds.append(embed)
-        return embeds
+        continued = " (Continued)" if continued else ""
+        embed.set_author(
+            name=cog.qualified_name + " - Help" + continued,
+            icon_url=bot.user.avatar_url,
+        )
+
+        embed.set_footer(
+            text=f'Type "{prefix}{self.command_attrs["name"]} command" '
+            "for more info on a specific command."
+        )
+        return embed
+
+    async def format_cog_help(self, cog):
+        formats = await self.format_cog_chunks(cog)
+        return [
+            self.format_cog_page(cog, format_, continued=bool(i))
+            for i, format_ in enumerate(formats)
+        ]
 
     def process_help_msg(self, help_: str):
         return help_.format(prefix=self.clean_prefix) if help_ else "No help message."
 
     async def send_bot_help(self, cogs):
-        embeds = []
         # TODO: Implement for no cog commands
 
         cogs = list(filter(None, cogs))
@@ -95,11 +103,19 @@ class ModmailHelpCommand(commands.HelpCommand):
 
         default_cogs.extend(c for c in cogs if c not in default_cogs)
 
+        # Only the command lists are built up front, embeds when shown.
+        pages = []
         for cog in default_cogs:
-            embeds.extend(await self.format_cog_help(cog))
+            formats = await self.format_cog_chunks(cog)
+            pages.extend((cog, format_, bool(i)) for i, format_ in enumerate(formats))
+
+        async def format_page(index):
+            return self.format_cog_page(*pages[index])
 
         p_session = PaginatorSession(
-            self.context, *embeds, destination=self.get_destination()
+            self.context,
+            source=FunctionPageSource(len(pages), format_page),
+            destination=self.get_destination(),
         )
         return await p_session.run()
 
@@ -316,33 +332,33 @@ class Utility(commands.Cog):
             embed.set_footer(text="Go to Heroku to see your logs.")
             return await ctx.send(embed=embed)
 
-        messages = []
-
         # Using Scala formatting because it's similar to Python for exceptions
         # and it does a fine job formatting the logs.
-        msg = "```Scala\n"
-
-        for line in logs.splitlines(keepends=True):
-            if msg != "```Scala\n":
-                if len(line) + len(msg) + 3 > 2000:
-                    msg += "```"
-                    messages.append(msg)
-                    msg = "```Scala\n"
-            msg += line
-            if len(msg) + 3 > 2000:
-                msg = msg[:1993] + "[...]```"
-                messages.append(msg)
-                msg = "```Scala\n"
-
-        if msg != "```Scala\n":
-            msg += "```"
-            messages.append(msg)
+        max_length = 2000 - len("```Scala\n```")
+
+        # Only find where pages start, their text is built when shown.
+        lines = logs.splitlines(keepends=True)
+        bounds = []
+        start = length = 0
+        for i, line in enumerate(lines):
+            if i > start and length + len(line) > max_length:
+                bounds.append((start, i))
+                start, length = i, 0
+            length += len(line)
+        bounds.append((start, len(lines)))
+
+        async def format_page(index):
+            text = "".join(lines[slice(*bounds[index])])
+            if len(text) > max_length:
+                text = text[: max_length - 5] + "[...]"
+            return f"```Scala\n{text}```"
 
         embed = Embed(color=self.bot.main_color)
         embed.set_footer(text="Debug logs - Navigate using the reactions below.")
 
-        session = MessagePaginatorSession(ctx, *messages, embed=embed)
-        session.current = len(messages) - 1
+        source = FunctionPageSource(len(bounds), format_page)
+        session = MessagePaginatorSession(ctx, embed=embed, source=source)
+        session.current = len(bounds) - 1
         return await session.run()
 
     @debug.command(name="hastebin", aliases=["haste"])
@@ -405,6 +421,74 @@ class Utility(commands.Cog):
             )
         )
 
+    @debug.command(name="queue", aliases=["inbound"])
+    @checks.has_permissions(PermissionLevel.OWNER)
+    async def debug_queue(self, ctx):
+        """Shows the depth and wait times of the incoming message queue."""
+        metrics = self.bot.inbound.metrics
+
+        embed = Embed(title="Incoming Messages", color=self.bot.main_color)
+        embed.add_field(name="Waiting", value=metrics["depth"])
+        embed.add_field(name="Active Recipients", value=metrics["active_recipients"])
+        embed.add_field(
+            name="Longest Recipient Queue", value=metrics["max_recipient_depth"]
+        )
+        embed.add_field(name="Processed", value=metrics["processed"])
+        embed.add_field(
+            name="Average Wait", value=f"{metrics['average_wait'] * 1000:.0f} ms"
+        )
+        embed.add_field(
+            name="Longest Wait", value=f"{metrics['max_wait'] * 1000:.0f} ms"
+        )
+        await ctx.send(embed=embed)
+
+    @debug.command(name="indexes", aliases=["explain"])
+    @checks.has_permissions(PermissionLevel.OWNER)
+    @trigger_typing
+    async def debug_indexes(self, ctx):
+        """
+        Checks that the bot's database queries use indexes.
+
+        Runs `explain()` on each query and flags the ones
+        that scan the whole collection or sort in memory.
+        """
+        results = await indexes.explain_queries(self.bot)
+
+        lines = []
+        scans = 0
+        for name, stages in results:
+            if "COLLSCAN" in stages:
+                scans += 1
+                lines.append(f"❌ `{name}`: {' < '.join(stages)}")
+            elif "SORT" in stages:
+                lines.append(f"⚠️ `{name}`: {' < '.join(stages)}")
+            else:
+                lines.append(f"✅ `{name}`: {' < '.join(stages)}")
+
+        # Embed descriptions are limited to 2048 characters.
+        descriptions = [""]
+        for line in lines:
+            if len(descriptions[-1]) + len(line) + 1 > 2048:
+                descriptions.append("")
+            descriptions[-1] += line + "\n"
+
+        embeds = []
+        for description in descriptions:
+            embed = Embed(
+                title="Query Plans",
+                color=Color.red() if scans else self.bot.main_color,
+                description=description,
+            )
+            if scans:
+                embed.set_footer(
+                    text=f"{scans} queries scan whole collections, "
+                    "indexes may still be building."
+                )
+            embeds.append(embed)
+
+        session = PaginatorSession(ctx, *embeds)
+        await session.run()
+
     @commands.command(aliases=["presence"])
     @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
     async def activity(self, ctx, activity_type: str.lower, *, message: str = ""):
@@ -692,6 +776,8 @@ class Utility(commands.Cog):
                 embed = exc.embed
             else:
                 await self.bot.config.update({key: value})
+                if key.endswith("_emoji"):
+                    self.bot.clear_emoji_cache()
                 embed = Embed(
                     title="Success",
                     color=self.bot.main_color,
@@ -717,6 +803,8 @@ class Utility(commands.Cog):
             try:
                 del self.bot.config.cache[key]
                 await self.bot.config.update()
+                if key.endswith("_emoji"):
+                    self.bot.clear_emoji_cache()
             except KeyError:
                 # when no values were set
                 pass
@@ -0,0 +1,357 @@
+import logging
+import typing
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from core.indexes import Query
+from core.utils import error, info
+
+logger = logging.getLogger("Modmail")
+
+REPLY_TYPES = ["thread_message", "anonymous"]
+
+
+def _day(timestamp: typing.Union[datetime, str]) -> str:
+    return str(timestamp)[:10]
+
+
+def _parse_date(field: str) -> dict:
+    """Aggregation expression parsing a `str(datetime)` field, to the second."""
+    return {
+        "$dateFromString": {
+            "dateString": {
+                "$concat": [
+                    {"$substr": [field, 0, 10]},
+                    "T",
+                    {"$substr": [field, 11, 8]},
+                ]
+            }
+        }
+    }
+
+
+class Analytics:
+    """
+    Keeps daily rollups of thread activity in the `rollups` collection.
+
+    There is one document per day, with the number of threads opened
+    and closed and the number and total time of first staff replies,
+    and one document per moderator per day, with their closures and
+    first replies. They are updated as threads are opened, answered
+    and closed, so reading a period only touches its own days.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @property
+    def collection(self):
+        return self.bot.db.rollups
+
+    @property
+    def guild_id(self) -> str:
+        return str(self.bot.guild_id)
+
+    @staticmethod
+    def period_query(guild_id: typing.Union[int, str], start: str) -> Query:
+        return Query(
+            "rollups",
+            {"guild_id": str(guild_id), "day": {"$gte": start}},
+            sort=[("day", 1)],
+        )
+
+    def _day_key(self, day: str) -> dict:
+        return {"_id": f"{self.guild_id}:{day}"}
+
+    def _mod_key(self, day: str, mod_id: str) -> dict:
+        return {"_id": f"{self.guild_id}:{day}:{mod_id}"}
+
+    def _day_fields(self, day: str) -> dict:
+        return {"guild_id": self.guild_id, "day": day, "kind": "day"}
+
+    def _mod_fields(self, day: str, mod_id: str) -> dict:
+        return {"guild_id": self.guild_id, "day": day, "kind": "mod", "mod_id": mod_id}
+
+    async def _inc(self, day: str, counts: dict, mod_id: str = None) -> None:
+        updates = [
+            UpdateOne(
+                self._day_key(day),
+                {"$inc": counts, "$setOnInsert": self._day_fields(day)},
+                upsert=True,
+            )
+        ]
+        if mod_id is not None:
+            updates.append(
+                UpdateOne(
+                    self._mod_key(day, mod_id),
+                    {"$inc": counts, "$setOnInsert": self._mod_fields(day, mod_id)},
+                    upsert=True,
+                )
+            )
+        try:
+            await self.collection.bulk_write(updates, ordered=False)
+        except Exception:
+            logger.error(error("Failed to update rollups."), exc_info=True)
+
+    async def thread_opened(self) -> None:
+        await self._inc(_day(datetime.utcnow()), {"opened": 1})
+
+    async def first_reply(self, thread, message) -> None:
+        """Counts the first staff reply of a thread, once per thread."""
+        now = datetime.utcnow()
+        query = {"channel_id": str(thread.channel.id), "first_reply_at": None}
+        result = await self.bot.api.logs.update_one(
+            query, {"$set": {"first_reply_at": str(now)}}
+        )
+        if not result.modified_count:
+            return
+
+        seconds = (now - thread.channel.created_at).total_seconds()
+        await self._inc(
+            _day(thread.channel.created_at),
+            {"first_replies": 1, "first_reply_seconds": seconds},
+            mod_id=str(message.author.id),
+        )
+
+    async def thread_closed(self, log: dict) -> None:
+        closer_id = log["closer"]["id"]
+        # Threads closed by their recipient aren't a moderator's closure.
+        mod_id = closer_id if closer_id != log["recipient"]["id"] else None
+        await self._inc(_day(log["closed_at"]), {"closed": 1}, mod_id=mod_id)
+
+    async def get_period(self, days: int) -> typing.Tuple[list, list]:
+        """
+        Reads the rollups of the last `days` days.
+
+        Returns
+        -------
+        Tuple[List[dict], List[dict]]
+            The daily documents, and the per-moderator documents.
+        """
+        start = _day(datetime.utcnow() - timedelta(days=days - 1))
+        daily, moderators = [], []
+        async for doc in self.period_query(self.guild_id, start).find(self.bot.db):
+            (daily if doc["kind"] == "day" else moderators).append(doc)
+        return daily, moderators
+
+    @staticmethod
+    def archived_query(guild_id: typing.Union[int, str]) -> Query:
+        return Query("logs", {"guild_id": str(guild_id), "archived": {"$exists": True}})
+
+    async def _backfill_archived(self, totals: dict, batch_size: int = 50) -> None:
+        """
+        Adds the first replies of archived logs to `totals`, their
+        messages are read back from the archive `batch_size` at a time.
+        """
+        projection = {"key": True, "created_at": True, "archived": True}
+        cursor = self.archived_query(self.guild_id).find(self.bot.db, projection)
+        while True:
+            batch = await cursor.to_list(batch_size)
+            if not batch:
+                break
+            await self.bot.api.load_messages(batch)
+            for log in batch:
+                first = next(
+                    (
+                        message
+                        for message in log.get("messages") or []
+                        if message.get("author", {}).get("mod")
+                        and message.get("type") in REPLY_TYPES
+                    ),
+                    None,
+                )
+                if first is None:
+                    continue
+                # Parsed to the second, like the pipelines.
+                seconds = (
+                    datetime.fromisoformat(first["timestamp"][:19])
+                    - datetime.fromisoformat(log["created_at"][:19])
+                ).total_seconds()
+                day = _day(log["created_at"])
+                for key in ((day, None), (day, first["author"]["id"])):
+                    totals[key]["first_replies"] += 1
+                    totals[key]["first_reply_seconds"] += seconds
+
+    def _backfill_pipelines(self) -> typing.List[typing.Tuple[str, list]]:
+        guild = {"guild_id": self.guild_id}
+        first_reply = [
+            {
+                "$project": {
+                    "day": {"$substr": ["$created_at", 0, 10]},
+                    "mod_id": "$first.author.id",
+                    "seconds": {
+                        "$divide": [
+                            {
+                                "$subtract": [
+                                    _parse_date("$first.timestamp"),
+                                    _parse_date("$created_at"),
+                                ]
+                            },
+                            1000,
+                        ]
+                    },
+                }
+            },
+            {
+                "$group": {
+                    "_id": {"day": "$day", "mod_id": "$mod_id"},
+                    "first_replies": {"$sum": 1},
+                    "first_reply_seconds": {"$sum": "$seconds"},
+                }
+            },
+        ]
+        is_reply = {"author.mod": True, "type": {"$in": REPLY_TYPES}}
+        is_reply_expr = {
+            "$and": [
+                {"$eq": ["$$this.author.mod", True]},
+                {"$in": ["$$this.type", REPLY_TYPES]},
+            ]
+        }
+
+        return [
+            (
+                "logs",
+                [
+                    {"$match": guild},
+                    {
+                        "$group": {
+                            "_id": {"day": {"$substr": ["$created_at", 0, 10]}},
+                            "opened": {"$sum": 1},
+                        }
+                    },
+                ],
+            ),
+            (
+                "logs",
+                [
+                    {"$match": {**guild, "open": False}},
+                    {
+                        "$group": {
+                            "_id": {
+                                "day": {"$substr": ["$closed_at", 0, 10]},
+                                "mod_id": {
+                                    "$cond": [
+                                        {"$eq": ["$closer.id", "$recipient.id"]},
+                                        None,
+                                        "$closer.id",
+                                    ]
+                                },
+                            },
+                            "closed": {"$sum": 1},
+                        }
+                    },
+                ],
+            ),
+            # First replies of logs with embedded messages only, logs in
+            # the log_messages collection keep a copy that may be truncated.
+            (
+                "logs",
+                [
+                    {
+                        "$match": {
+                            **guild,
+                            "messages_collection": {"$ne": True},
+                            "messages": {"$elemMatch": is_reply},
+                        }
+                    },
+                    {
+                        "$project": {
+                            "created_at": True,
+                            "first": {
+                                "$arrayElemAt": [
+                                    {
+                                        "$filter": {
+                                            "input": "$messages",
+                                            "cond": is_reply_expr,
+                                        }
+                                    },
+                                    0,
+                                ]
+                            },
+                        }
+                    },
+                    *first_reply,
+                ],
+            ),
+            # First replies of logs in the log_messages collection.
+            (
+                "log_messages",
+                [
+                    {"$match": is_reply},
+                    {"$sort": {"log_key": 1, "sequence": 1}},
+                    {"$group": {"_id": "$log_key", "first": {"$first": "$$ROOT"}}},
+                    {
+                        "$lookup": {
+                            "from": "logs",
+                            "localField": "_id",
+                            "foreignField": "key",
+                            "as": "log",
+                        }
+                    },
+                    {"$unwind": "$log"},
+                    {"$match": {"log.guild_id": self.guild_id}},
+                    {"$project": {"created_at": "$log.created_at", "first": True}},
+                    *first_reply,
+                ],
+            ),
+        ]
+
+    async def backfill(self, batch_size: int = 500) -> int:
+        """
+        Rebuilds the rollups from the existing logs.
+
+        Each aggregate is computed by the database, and written back
+        in bulk writes of `batch_size` documents.
+
+        Returns
+        -------
+        int
+            The number of rollup documents written.
+        """
+        totals = defaultdict(lambda: defaultdict(float))
+        for collection, pipeline in self._backfill_pipelines():
+            cursor = self.bot.db[collection].aggregate(pipeline, allowDiskUse=True)
+            async for group in cursor:
+                day = group["_id"]["day"]
+                mod_id = group["_id"].get("mod_id")
+                counts = {k: v for k, v in group.items() if k != "_id"}
+                keys = [(day, None)]
+                if mod_id is not None:
+                    keys.append((day, mod_id))
+                for key in keys:
+                    for name, value in counts.items():
+                        totals[key][name] += value
+        # Archived logs have no messages left in the database.
+        await self._backfill_archived(totals)
+
+        written = 0
+        batch = []
+        for (day, mod_id), counts in totals.items():
+            if mod_id is None:
+                key, fields = self._day_key(day), self._day_fields(day)
+            else:
+                key, fields = self._mod_key(day, mod_id), self._mod_fields(day, mod_id)
+            values = {
+                name: int(counts.get(name, 0))
+                for name in ("opened", "closed", "first_replies")
+            }
+            values["first_reply_seconds"] = counts.get("first_reply_seconds", 0)
+            batch.append(UpdateOne(key, {"$set": {**fields, **values}}, upsert=True))
+
+            if len(batch) >= batch_size:
+                await self.collection.bulk_write(batch, ordered=False)
+                written += len(batch)
+                batch = []
+        if batch:
+            await self.collection.bulk_write(batch, ordered=False)
+            written += len(batch)
+
+        logger.info(info(f"Backfilled {written} rollup documents."))
+        return written
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import typing
+
+from core.utils import error
+
+logger = logging.getLogger("Modmail")
+
+
+class LogAppender:
+    """
+    Write-behind buffer for log messages.
+
+    Messages are grouped per thread channel and handed to `write`
+    together, which stores them with a single update.
+    A channel is flushed once `max_batch` messages are pending, and
+    every channel is flushed every `interval` seconds. Flushes of the
+    same channel are serialised, so messages keep their order.
+
+    A batch that fails to be written is retried, together with the
+    messages queued since, and dropped after `max_attempts` failures.
+    At most `max_pending` messages are queued per channel, later
+    messages are dropped until the queue drains.
+
+    Parameters
+    ----------
+    write : Callable[[str, List[dict]], Awaitable[None]]
+        Coroutine function that stores the messages of a channel.
+        Retries pass it the same message dicts, so it may record
+        what it already did on them.
+    max_batch : int, optional
+        Defaults to 50.
+    interval : float, optional
+        Defaults to 1 second.
+    max_attempts : int, optional
+        Defaults to 5.
+    max_pending : int, optional
+        Defaults to 1000.
+    """
+
+    def __init__(
+        self,
+        write: typing.Callable[[str, typing.List[dict]], typing.Awaitable[None]],
+        max_batch: int = 50,
+        interval: float = 1.0,
+        max_attempts: int = 5,
+        max_pending: int = 1000,
+    ):
+        self.write = write
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self._pending: typing.Dict[str, typing.List[dict]] = {}
+        # channel_id -> failed attempts to write its pending messages
+        self._failures: typing.Dict[str, int] = {}
+        # Channels whose messages are dropped until their queue drains.
+        self._overflowing: typing.Set[str] = set()
+        # channel_id -> lock, dropped once no flush of the channel is running
+        self._locks: typing.Dict[str, asyncio.Lock] = {}
+        self._lock_users: typing.Dict[str, int] = {}
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return sum(map(len, self._pending.values()))
+
+    def add(self, channel_id: str, data: dict) -> None:
+        """Queues a message for the log of `channel_id`."""
+        pending = self._pending.setdefault(channel_id, [])
+        if len(pending) >= self.max_pending:
+            if channel_id not in self._overflowing:
+                self._overflowing.add(channel_id)
+                logger.error(
+                    error(
+                        f"{len(pending)} log messages of channel {channel_id} "
+                        "are pending, dropping new ones until they are written."
+                    )
+                )
+            return
+        pending.append(data)
+
+        if len(pending) >= self.max_batch:
+            asyncio.ensure_future(self.flush(channel_id))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def _flush_channel(self, channel_id: str) -> None:
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        self._lock_users[channel_id] = self._lock_users.get(channel_id, 0) + 1
+        try:
+            async with lock:
+                await self._write_pending(channel_id)
+        finally:
+            self._lock_users[channel_id] -= 1
+            if not self._lock_users[channel_id]:
+                del self._lock_users[channel_id]
+                del self._locks[channel_id]
+
+    async def _write_pending(self, channel_id: str) -> None:
+        entries = self._pending.pop(channel_id, None)
+        if not entries:
+            return
+        try:
+            await self.write(channel_id, entries)
+        except Exception:
+            failures = self._failures.get(channel_id, 0) + 1
+            if failures < self.max_attempts:
+                self._failures[channel_id] = failures
+                logger.warning(
+                    error(f"Failed to append {len(entries)} log messages, retrying."),
+                    exc_info=True,
+                )
+                # Put them back in front of anything queued since.
+                entries.extend(self._pending.get(channel_id, []))
+                self._pending[channel_id] = entries
+                return
+            logger.error(
+                error(
+                    f"Dropped {len(entries)} log messages of channel {channel_id} "
+                    f"after {failures} failed attempts."
+                ),
+                exc_info=True,
+            )
+        self._failures.pop(channel_id, None)
+        self._overflowing.discard(channel_id)
+
+    async def flush(self, channel_id: typing.Union[int, str] = None) -> None:
+        """
+        Writes the pending messages of `channel_id`,
+        or of every channel when it is omitted.
+        """
+        if channel_id is not None:
+            await self._flush_channel(str(channel_id))
+        else:
+            await asyncio.gather(*map(self._flush_channel, list(self._pending)))
+
+    async def close(self) -> None:
+        """Stops the flush loop and writes everything still pending."""
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
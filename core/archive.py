@@ -0,0 +1,290 @@
+import asyncio
+import gzip
+import logging
+import os
+import typing
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from bson import BSON, Binary
+
+from core.indexes import Query
+from core.utils import error, info
+
+logger = logging.getLogger("Modmail")
+
+# Relative store paths are relative to the bot's folder.
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fields dropped from archived logs, everything else is kept in the stub.
+ARCHIVED_FIELDS = ("messages", "messages_collection", "messages_truncated")
+
+
+def _compress(log: dict) -> bytes:
+    return gzip.compress(BSON.encode(log))
+
+
+def _decompress(data: bytes) -> dict:
+    return BSON(gzip.decompress(data)).decode()
+
+
+class CollectionArchiveStore:
+    """
+    Stores archived logs in the `logs_archive` collection, one
+    compressed document per log.
+    """
+
+    name = "collection"
+
+    def __init__(self, db):
+        self.collection = db.logs_archive
+
+    async def save(self, key: str, data: bytes) -> None:
+        await self.collection.replace_one(
+            {"_id": key}, {"_id": key, "data": Binary(data)}, upsert=True
+        )
+
+    async def load(self, key: str) -> bytes:
+        doc = await self.collection.find_one({"_id": key})
+        if doc is None:
+            raise KeyError(key)
+        return doc["data"]
+
+
+class LocalArchiveStore:
+    """
+    Stores archived logs in a local directory, as `<key>.bson.gz` files.
+
+    Parameters
+    ----------
+    path : str
+        The directory to store archives in, created if needed.
+    """
+
+    name = "local"
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.bson.gz")
+
+    def _write(self, key: str, data: bytes) -> None:
+        temp_path = self._path(key) + ".part"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self._path(key))
+
+    def _read(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    async def save(self, key: str, data: bytes) -> None:
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._write, key, data)
+
+    async def load(self, key: str) -> bytes:
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(None, self._read, key)
+        except FileNotFoundError:
+            raise KeyError(key)
+
+
+def get_store(db, kind: str = None, path: str = None):
+    """
+    The archive store of the given kind, "collection" by default.
+
+    Raises
+    ------
+    ValueError
+        `kind` is not a known store.
+    """
+    kind = (kind or "collection").lower()
+    if kind == "collection":
+        return CollectionArchiveStore(db)
+    if kind == "local":
+        path = path or os.path.join("temp", "archive")
+        return LocalArchiveStore(os.path.join(BOT_DIR, path))
+    raise ValueError(f"Unknown log archive store: {kind}.")
+
+
+async def restore(store, key: str) -> dict:
+    """Reads the full document of an archived log from `store`."""
+    data = await store.load(key)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, _decompress, data)
+
+
+class LogArchive:
+    """
+    Moves old closed logs out of the `logs` collection.
+
+    The full document of an archived log, with all of its messages, is
+    compressed into the archive store. Its entry in `logs` is replaced
+    with a stub without messages, so queries on recipients, closers and
+    dates still find it, and `ApiClient.load_messages` reads the messages
+    back from the archive when the log is viewed.
+
+    Logs are archived once they have been closed for `LOG_ARCHIVE_DAYS`
+    days. The store is chosen with `LOG_ARCHIVE_STORE`, either
+    "collection" (the default) or "local", in `LOG_ARCHIVE_PATH`.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    cache_size : int, optional
+        How many restored logs are kept in memory.
+        Defaults to 16.
+    """
+
+    def __init__(self, bot, cache_size: int = 16):
+        self.bot = bot
+        self.cache_size = cache_size
+        self._store = None
+        self._cache = OrderedDict()
+
+    @property
+    def days(self) -> typing.Optional[float]:
+        days = self.bot.config.get("log_archive_days")
+        return float(days) if days else None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_store(
+                self.bot.db,
+                self.bot.config.get("log_archive_store"),
+                self.bot.config.get("log_archive_path"),
+            )
+        return self._store
+
+    async def restore(self, key: str) -> dict:
+        """Gets the full document of an archived log."""
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        log = await restore(self.store, key)
+        self._cache[key] = log
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return log
+
+    async def load_messages(self, logs: list, limit: int = None) -> None:
+        """Fills in the `messages` of archived logs, modified in place."""
+
+        async def load(log):
+            try:
+                messages = (await self.restore(log["key"]))["messages"]
+            except Exception:
+                logger.error(
+                    error(f"Failed to restore archived log {log['key']}."),
+                    exc_info=True,
+                )
+                messages = []
+            log["messages"] = messages if limit is None else messages[:limit]
+
+        await asyncio.gather(*(load(log) for log in logs))
+
+    @staticmethod
+    def archive_query(
+        guild_id: typing.Union[int, str], cutoff: str, skipped: typing.Iterable = ()
+    ) -> Query:
+        """The logs closed before `cutoff` that aren't archived yet."""
+        query = {
+            "guild_id": str(guild_id),
+            "open": False,
+            "closed_at": {"$lt": cutoff},
+            "archived": {"$exists": False},
+        }
+        if skipped:
+            query["_id"] = {"$nin": list(skipped)}
+        return Query("logs", query)
+
+    async def archive_log(self, log: dict) -> bool:
+        """
+        Archives a closed log, its messages must be loaded.
+
+        Returns
+        -------
+        bool
+            Whether the log was archived, it isn't if it changed meanwhile.
+        """
+        messages = log.get("messages") or []
+        full = {k: v for k, v in log.items() if k != "messages_collection"}
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, _compress, full)
+        await self.store.save(log["key"], data)
+
+        stub = {k: v for k, v in log.items() if k not in ARCHIVED_FIELDS}
+        stub["message_count"] = len(messages)
+        stub["archived"] = {"store": self.store.name, "at": str(datetime.utcnow())}
+
+        unchanged = {"_id": log["_id"], "archived": {"$exists": False}}
+        if log.get("messages_collection"):
+            unchanged["message_count"] = log["message_count"]
+        elif "messages" in log:
+            unchanged["messages"] = {"$size": len(messages)}
+        result = await self.bot.api.logs.replace_one(unchanged, stub)
+        if not result.modified_count:
+            return False
+
+        if log.get("messages_collection"):
+            await self.bot.api.log_messages.delete_many({"log_key": log["key"]})
+        return True
+
+    async def archive_logs(
+        self, days: float, batch_size: int = 50, delay: float = 1
+    ) -> int:
+        """
+        Archives every log closed more than `days` days ago.
+
+        Logs are archived `batch_size` at a time, sleeping `delay` seconds
+        between batches, while the bot keeps running.
+
+        Returns
+        -------
+        int
+            The number of logs archived.
+        """
+        # closed_at is stored as str(datetime), which sorts by time.
+        cutoff = str(datetime.utcnow() - timedelta(days=days))
+        archived = 0
+        skipped = set()
+        while True:
+            query = self.archive_query(self.bot.guild_id, cutoff, skipped)
+            batch = await query.find(self.bot.db).to_list(batch_size)
+            if not batch:
+                break
+
+            await self.bot.api.load_messages(batch)
+            for log in batch:
+                try:
+                    done = await self.archive_log(log)
+                except Exception:
+                    logger.error(
+                        error(f"Failed to archive log {log['key']}."), exc_info=True
+                    )
+                    done = False
+                if done:
+                    archived += 1
+                else:
+                    skipped.add(log["_id"])
+            logger.info(info(f"Archived {archived} logs."))
+            await asyncio.sleep(delay)
+        return archived
+
+    async def run(self, interval: float = 24 * 60 * 60) -> None:
+        """Archives old logs every `interval` seconds, if enabled."""
+        while not self.bot.is_closed():
+            days = self.days
+            if days is None:
+                return
+            try:
+                await self.archive_logs(days)
+            except Exception:
+                logger.error(error("Failed to archive logs."), exc_info=True)
+            await asyncio.sleep(interval)
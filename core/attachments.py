@@ -0,0 +1,295 @@
+import asyncio
+import hashlib
+import logging
+import os
+import typing
+import uuid
+
+import discord
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import DuplicateKeyError
+
+from core.indexes import Query
+from core.utils import error, info
+
+logger = logging.getLogger("Modmail")
+
+CHUNK_SIZE = 64 * 1024
+
+DEFAULT_MAX_SIZE = 25 * 1024 * 1024
+
+# Relative store paths are relative to the bot's folder.
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class LocalAttachmentStore:
+    """
+    Stores attachments in a local directory, named after their SHA-256 hash.
+
+    Parameters
+    ----------
+    path : str
+        The directory to store attachments in, created if needed.
+    base_url : str, optional
+        The URL the directory is served under, if any.
+    """
+
+    name = "local"
+
+    def __init__(self, path: str, base_url: str = None):
+        self.path = path
+        self.base_url = base_url.rstrip("/") if base_url else None
+        os.makedirs(path, exist_ok=True)
+
+    def _ref(self, digest: str, ext: str) -> str:
+        if self.base_url is not None:
+            return f"{self.base_url}/{digest}{ext}"
+        return f"local:{digest}{ext}"
+
+    async def save(
+        self, chunks: typing.AsyncIterator[bytes], filename: str
+    ) -> typing.Tuple[str, str]:
+        """
+        Stores the streamed content, unless an identical file exists.
+
+        Returns
+        -------
+        Tuple[str, str]
+            The SHA-256 hex digest and the reference to the stored copy.
+        """
+        loop = asyncio.get_event_loop()
+        ext = os.path.splitext(filename)[1].lower()
+        temp_path = os.path.join(self.path, f".{uuid.uuid4().hex}.part")
+        sha = hashlib.sha256()
+
+        # Every file operation runs in an executor, off the event loop.
+        f = await loop.run_in_executor(None, open, temp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await loop.run_in_executor(None, self._write, f, sha, chunk)
+        except BaseException:
+            await loop.run_in_executor(None, self._discard, f, temp_path)
+            raise
+        await loop.run_in_executor(None, f.close)
+
+        digest = sha.hexdigest()
+        path = os.path.join(self.path, digest + ext)
+        await loop.run_in_executor(None, self._keep, temp_path, path)
+        return digest, self._ref(digest, ext)
+
+    @staticmethod
+    def _write(f: typing.BinaryIO, sha, chunk: bytes) -> None:
+        sha.update(chunk)
+        f.write(chunk)
+
+    @staticmethod
+    def _discard(f: typing.BinaryIO, temp_path: str) -> None:
+        f.close()
+        os.remove(temp_path)
+
+    @staticmethod
+    def _keep(temp_path: str, path: str) -> None:
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, path)
+
+
+class GridFSAttachmentStore:
+    """
+    Stores attachments in GridFS, with their SHA-256 hash in the metadata.
+
+    The hash has a unique index, so an identical file is only stored once
+    even when it is uploaded twice at the same time.
+
+    Parameters
+    ----------
+    db : AsyncIOMotorDatabase
+        The Modmail database.
+    bucket_name : str, optional
+        Defaults to "attachments".
+    """
+
+    name = "gridfs"
+
+    def __init__(self, db, bucket_name: str = "attachments"):
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+        self.db = db
+        self.bucket_name = bucket_name
+        self.files = db[f"{bucket_name}.files"]
+
+    @staticmethod
+    def hash_query(digest: str, bucket_name: str = "attachments") -> Query:
+        return Query(f"{bucket_name}.files", {"metadata.sha256": digest})
+
+    async def save(
+        self, chunks: typing.AsyncIterator[bytes], filename: str
+    ) -> typing.Tuple[str, str]:
+        """
+        Stores the streamed content, unless an identical file exists.
+
+        Returns
+        -------
+        Tuple[str, str]
+            The SHA-256 hex digest and the reference to the stored copy.
+        """
+        sha = hashlib.sha256()
+        grid_in = self.bucket.open_upload_stream(filename)
+        try:
+            async for chunk in chunks:
+                sha.update(chunk)
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+
+        digest = sha.hexdigest()
+        file_id = grid_in._id
+        try:
+            await self.files.update_one(
+                {"_id": file_id}, {"$set": {"metadata.sha256": digest}}
+            )
+        except DuplicateKeyError:
+            query = self.hash_query(digest, self.bucket_name)
+            existing = await query.find_one(self.db, projection={"_id": True})
+            if existing is None:
+                raise
+            await self.bucket.delete(file_id)
+            file_id = existing["_id"]
+        return digest, f"gridfs:{file_id}"
+
+
+class AttachmentMirror:
+    """
+    Copies attachments of logged messages to an `AttachmentStore`,
+    so logs keep working after the Discord CDN links expire.
+
+    Mirroring runs in the background and never delays relaying.
+    Attachments are streamed in chunks, at most `concurrency` at
+    a time, and attachments larger than `max_size` are skipped.
+
+    Mirroring is enabled with the `attachment_store` config,
+    either "local" or "gridfs". A relative `attachment_store_path`
+    is relative to the bot's folder.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    concurrency : int, optional
+        How many attachments may be downloaded at once.
+        Defaults to 3.
+    """
+
+    def __init__(self, bot, concurrency: int = 3):
+        self.bot = bot
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._store = None
+        self._max_size = None
+        self._loaded = False
+
+    def load_config(self) -> None:
+        """
+        Reads the attachment config, and logs an error for invalid values.
+
+        Called when the bot connects, the config is read again
+        only by the next call.
+        """
+        config = self.bot.config
+        self._loaded = True
+
+        max_size = config.get("attachment_max_size")
+        try:
+            self._max_size = int(max_size or DEFAULT_MAX_SIZE)
+            if self._max_size <= 0:
+                raise ValueError
+        except ValueError:
+            logger.error(
+                error(
+                    f"Invalid attachment_max_size: {max_size}, "
+                    "it must be a positive number of bytes."
+                )
+            )
+            self._max_size = DEFAULT_MAX_SIZE
+
+        self._store = None
+        kind = (config.get("attachment_store") or "").lower()
+        if kind == "local":
+            path = config.get(
+                "attachment_store_path", os.path.join("temp", "attachments")
+            )
+            self._store = LocalAttachmentStore(
+                os.path.join(BOT_DIR, path), config.get("attachment_store_url")
+            )
+        elif kind == "gridfs":
+            self._store = GridFSAttachmentStore(self.bot.db)
+        elif kind:
+            logger.error(error(f"Unknown attachment store: {kind}."))
+
+    @property
+    def max_size(self) -> int:
+        if not self._loaded:
+            self.load_config()
+        return self._max_size
+
+    @property
+    def store(self):
+        if not self._loaded:
+            self.load_config()
+        return self._store
+
+    def schedule(self, message: discord.Message, channel_id: typing.Union[int, str]):
+        """Starts mirroring the attachments of a logged message."""
+        if not message.attachments or self.store is None:
+            return
+        for attachment in message.attachments:
+            self.bot.loop.create_task(self._mirror(attachment, message.id, channel_id))
+
+    async def _download(self, attachment: discord.Attachment):
+        max_size = self.max_size
+        received = 0
+        async with self.bot.session.get(attachment.url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_size:
+                    raise AttachmentTooLarge
+                yield chunk
+
+    async def _mirror(
+        self,
+        attachment: discord.Attachment,
+        message_id: int,
+        channel_id: typing.Union[int, str],
+    ) -> None:
+        if attachment.size > self.max_size:
+            logger.info(info(f"Not mirroring {attachment.filename}, it is too large."))
+            return
+
+        async with self._semaphore:
+            try:
+                digest, ref = await self.store.save(
+                    self._download(attachment), attachment.filename
+                )
+            except AttachmentTooLarge:
+                logger.info(
+                    info(f"Not mirroring {attachment.filename}, it is too large.")
+                )
+                return
+            except Exception:
+                logger.error(
+                    error(f"Failed to mirror {attachment.filename}."), exc_info=True
+                )
+                return
+
+        await self.bot.api.set_attachment_mirror(
+            channel_id,
+            message_id,
+            attachment.id,
+            {"store": self.store.name, "sha256": digest, "url": ref},
+        )
@@ -0,0 +1,430 @@
+import logging
+import re
+import typing
+from contextlib import contextmanager
+from datetime import datetime
+
+import isodate
+from discord.ext import commands
+from pymongo import UpdateOne
+
+from core.indexes import Query
+from core.records import watch_collection
+from core.utils import info
+
+logger = logging.getLogger("Modmail")
+
+MANUAL = "manual"
+NEW_ACCOUNT = "new_account"
+RECENTLY_JOINED = "recently_joined"
+
+SYSTEM_LABELS = {NEW_ACCOUNT: "New Account.", RECENTLY_JOINED: "Recently Joined."}
+
+# How blocks were stored in the `blocked` config.
+_LEGACY_PREFIXES = {
+    NEW_ACCOUNT: "System Message: New Account.",
+    RECENTLY_JOINED: "System Message: Recently Joined.",
+}
+_end_time_regex = re.compile(r"%(.+?)%$")
+
+
+def parse_legacy_reason(
+    reason: typing.Optional[str]
+) -> typing.Tuple[str, typing.Optional[str], typing.Optional[datetime]]:
+    """
+    Parses a block reason stored in the `blocked` config.
+
+    Returns
+    -------
+    Tuple[str, Optional[str], Optional[datetime]]
+        The kind of block, the reason without markers, and the time
+        the block ends, if there is one.
+    """
+    if not reason:
+        return MANUAL, None, None
+    for kind, prefix in _LEGACY_PREFIXES.items():
+        if reason.startswith(prefix):
+            return kind, reason[len(prefix) :].strip() or None, None
+
+    end_time = _end_time_regex.search(reason)
+    if end_time is None:
+        return MANUAL, reason, None
+    reason = _end_time_regex.sub("", reason).strip() or None
+    try:
+        return MANUAL, reason, datetime.fromisoformat(end_time.group(1))
+    except ValueError:
+        return MANUAL, reason, None
+
+
+class Block:
+    """
+    A blocked user.
+
+    Attributes
+    ----------
+    user_id : str
+        The ID of the blocked user.
+    kind : str
+        `MANUAL`, or `NEW_ACCOUNT` and `RECENTLY_JOINED` for blocks
+        made by the bot because of the account or guild age limits.
+    reason : Optional[str]
+        The reason given for the block.
+    author_id : Optional[str]
+        The ID of the moderator who made the block.
+    created_at : datetime
+        When the user was blocked.
+    expires_at : Optional[datetime]
+        When the block ends, `None` for permanent blocks.
+    """
+
+    __slots__ = ("user_id", "kind", "reason", "author_id", "created_at", "expires_at")
+
+    def __init__(
+        self,
+        user_id: str,
+        kind: str = MANUAL,
+        reason: str = None,
+        author_id: str = None,
+        created_at: datetime = None,
+        expires_at: datetime = None,
+    ):
+        self.user_id = user_id
+        self.kind = kind
+        self.reason = reason
+        self.author_id = author_id
+        self.created_at = created_at or datetime.utcnow()
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f"<Block user_id={self.user_id!r} kind={self.kind!r}>"
+
+    @property
+    def is_system(self) -> bool:
+        return self.kind != MANUAL
+
+    @property
+    def description(self) -> str:
+        """The reason, as shown to moderators."""
+        if self.is_system:
+            return f"{SYSTEM_LABELS[self.kind]} {self.reason or ''}".strip()
+        description = self.reason or ""
+        if self.expires_at is not None:
+            description += f" (until {self.expires_at:%Y-%m-%d %H:%M} UTC)"
+        return description.strip()
+
+    def is_expired(self, now: datetime = None) -> bool:
+        if self.expires_at is None:
+            return False
+        return self.expires_at <= (now or datetime.utcnow())
+
+    def to_document(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_document(cls, doc: dict) -> "Block":
+        return cls(**{name: doc.get(name) for name in cls.__slots__})
+
+
+class BlockStore:
+    """
+    The blocked users, stored in the `blocks` collection.
+
+    Every block of the bot is kept in memory, so checking a user
+    doesn't touch the database. Temporary blocks are dropped from
+    memory when they end, and removed from the database by a TTL
+    index on `expires_at`. `watch` applies the blocks made and removed
+    by other processes.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._blocks: typing.Dict[str, Block] = {}
+        self._expiry_handles = {}
+        # _id -> user ID, to know whose block a deleted document held.
+        self._user_ids: typing.Dict[typing.Any, str] = {}
+        # The writes made here that are in flight, and that are done.
+        self._pending = 0
+        self._writes = 0
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._blocks
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    @property
+    def collection(self):
+        return self.bot.db.blocks
+
+    def _query(self, user_id: str) -> dict:
+        return {"bot_id": self.bot.user.id, "user_id": user_id}
+
+    @staticmethod
+    def active_query(bot_id: int, now: datetime) -> Query:
+        """The blocks that haven't ended at `now`."""
+        return Query(
+            "blocks",
+            {
+                "bot_id": bot_id,
+                "$or": [{"expires_at": None}, {"expires_at": {"$gt": now}}],
+            },
+        )
+
+    @classmethod
+    def page_query(cls, bot_id: int, now: datetime, index: int, per_page: int) -> Query:
+        """A page of the blocks that haven't ended at `now`, oldest first."""
+        return Query(
+            "blocks",
+            cls.active_query(bot_id, now).filter,
+            sort=[("created_at", 1)],
+            skip=index * per_page,
+            limit=per_page,
+        )
+
+    def get(self, user_id: str) -> typing.Optional[Block]:
+        return self._blocks.get(user_id)
+
+    def _cache(self, block: Block) -> None:
+        self._blocks[block.user_id] = block
+        handle = self._expiry_handles.pop(block.user_id, None)
+        if handle is not None:
+            handle.cancel()
+        if block.expires_at is not None:
+            delay = (block.expires_at - datetime.utcnow()).total_seconds()
+            self._expiry_handles[block.user_id] = self.bot.loop.call_later(
+                max(delay, 0), self._expire, block
+            )
+
+    def _uncache(self, user_id: str) -> typing.Optional[Block]:
+        handle = self._expiry_handles.pop(user_id, None)
+        if handle is not None:
+            handle.cancel()
+        return self._blocks.pop(user_id, None)
+
+    def _expire(self, block: Block) -> None:
+        if self._blocks.get(block.user_id) is not block:
+            return
+        del self._blocks[block.user_id]
+        self._expiry_handles.pop(block.user_id, None)
+        logger.debug(info(f"The block of {block.user_id} has ended."))
+
+    @contextmanager
+    def _writing(self):
+        self._pending += 1
+        try:
+            yield
+        finally:
+            self._pending -= 1
+            self._writes += 1
+
+    async def load(self) -> None:
+        """Reads the blocks of the bot that haven't ended yet."""
+        while True:
+            writes = self._writes
+            query = self.active_query(self.bot.user.id, datetime.utcnow())
+            docs = await query.find(self.bot.db).to_list(None)
+            # Read again if a change made here may be missing.
+            if not self._pending and writes == self._writes:
+                break
+
+        for handle in self._expiry_handles.values():
+            handle.cancel()
+        self._blocks, self._expiry_handles = {}, {}
+        self._user_ids = {doc["_id"]: doc["user_id"] for doc in docs}
+        for doc in docs:
+            self._cache(Block.from_document(doc))
+
+    def _apply_change(self, change: dict) -> None:
+        if change["operationType"] == "delete":
+            user_id = self._user_ids.pop(change["documentKey"]["_id"], None)
+            if user_id is not None:
+                self._uncache(user_id)
+            return
+        doc = change.get("fullDocument")
+        if doc is None:
+            # Deleted since, the delete follows.
+            return
+        self._user_ids[doc["_id"]] = doc["user_id"]
+        block = Block.from_document(doc)
+        if block.is_expired():
+            self._uncache(block.user_id)
+        else:
+            self._cache(block)
+
+    async def watch(self, poll_interval: float = 30) -> None:
+        """
+        Applies the changes other processes make, until the bot closes.
+        See `core.records.watch_collection`.
+        """
+        await watch_collection(
+            self.bot, self.collection, self._apply_change, self.load, poll_interval
+        )
+
+    async def add(
+        self,
+        user_id: str,
+        kind: str = MANUAL,
+        reason: str = None,
+        author_id: str = None,
+        expires_at: datetime = None,
+    ) -> Block:
+        """Blocks a user, replacing their previous block."""
+        block = Block(user_id, kind, reason, author_id, expires_at=expires_at)
+        with self._writing():
+            self._cache(block)
+            await self.collection.replace_one(
+                self._query(user_id),
+                {"bot_id": self.bot.user.id, **block.to_document()},
+                upsert=True,
+            )
+        return block
+
+    async def remove(self, user_id: str) -> typing.Optional[Block]:
+        """Unblocks a user, returns their block if they were blocked."""
+        block = self._uncache(user_id)
+        if block is not None:
+            with self._writing():
+                await self.collection.delete_one(self._query(user_id))
+        return block
+
+    async def count(self) -> int:
+        """Counts the blocks that haven't ended, as `page` pages them."""
+        query = self.active_query(self.bot.user.id, datetime.utcnow())
+        return await self.collection.count_documents(query.filter)
+
+    async def page(self, index: int, per_page: int = 10) -> typing.List[Block]:
+        """
+        Reads a page of blocks, oldest first. Ended blocks the TTL
+        index hasn't removed yet are skipped by the query.
+        """
+        query = self.page_query(self.bot.user.id, datetime.utcnow(), index, per_page)
+        return [Block.from_document(doc) async for doc in query.find(self.bot.db)]
+
+    async def migrate(self, old: dict, batch_size: int = 500) -> int:
+        """
+        Writes the blocks of `old`, the `blocked` config, in bulk writes
+        of `batch_size` blocks. Existing blocks are kept.
+
+        Returns
+        -------
+        int
+            The number of blocks written.
+        """
+        now = datetime.utcnow()
+        updates = []
+        for user_id, reason in old.items():
+            kind, reason, expires_at = parse_legacy_reason(reason)
+            if expires_at is not None and expires_at <= now:
+                continue
+            block = Block(user_id, kind, reason, created_at=now, expires_at=expires_at)
+            fields = block.to_document()
+            del fields["user_id"]
+            updates.append(
+                UpdateOne(self._query(user_id), {"$setOnInsert": fields}, upsert=True)
+            )
+        for i in range(0, len(updates), batch_size):
+            await self.collection.bulk_write(updates[i : i + batch_size], ordered=False)
+        return len(updates)
+
+
+class BlockPolicy:
+    """
+    The block related configuration, parsed once.
+
+    Use `BlockPolicy.compile` to create a policy, and
+    `BlockPolicy.is_current` to know when it needs to be
+    compiled again.
+
+    Attributes
+    ----------
+    key : Tuple[str, ...]
+        The raw config values this policy was compiled from.
+    account_age : Optional[Union[timedelta, Duration]]
+        Minimum account age, `None` when there is no requirement.
+    guild_age : Optional[Union[timedelta, Duration]]
+        Minimum time in the guild, `None` when there is no requirement.
+    sent_emoji : Union[str, Emoji]
+        The resolved sent emoji, or "disable".
+    blocked_emoji : Union[str, Emoji]
+        The resolved blocked emoji, or "disable".
+    """
+
+    __slots__ = ("key", "account_age", "guild_age", "sent_emoji", "blocked_emoji")
+
+    def __init__(self, key, account_age, guild_age, sent_emoji, blocked_emoji):
+        self.key = key
+        self.account_age = account_age
+        self.guild_age = guild_age
+        self.sent_emoji = sent_emoji
+        self.blocked_emoji = blocked_emoji
+
+    @staticmethod
+    def config_key(config) -> tuple:
+        return (
+            config.get("account_age"),
+            config.get("guild_age"),
+            config.get("sent_emoji", "✅"),
+            config.get("blocked_emoji", "🚫"),
+        )
+
+    @staticmethod
+    async def _parse_age(bot, key: str, name: str):
+        value = bot.config.get(key)
+        if value is None:
+            return None
+        try:
+            age = isodate.parse_duration(value)
+        except isodate.ISO8601Error:
+            logger.warning(
+                f"The {name} limit needs to be a "
+                "ISO-8601 duration formatted duration string "
+                'greater than 0 days, not "%s".',
+                str(value),
+            )
+            del bot.config.cache[key]
+            await bot.config.update()
+            return None
+        if not age:
+            return None
+        return age
+
+    @staticmethod
+    async def _resolve_emoji(bot, key: str, default: str):
+        emoji = bot.config.get(key, default)
+        if emoji == "disable":
+            return emoji
+        try:
+            return await bot.convert_emoji(emoji)
+        except commands.BadArgument:
+            logger.warning(info(f"Removed {key.replace('_', ' ')} (%s)."), emoji)
+            del bot.config.cache[key]
+            await bot.config.update()
+            return default
+
+    @classmethod
+    async def compile(cls, bot) -> "BlockPolicy":
+        """
+        Parses the block related configuration of `bot`.
+
+        Invalid values are removed from the config, like the
+        per-message checks used to do.
+        """
+        account_age = await cls._parse_age(bot, "account_age", "account age")
+        guild_age = await cls._parse_age(bot, "guild_age", "guild join age")
+        sent_emoji = await cls._resolve_emoji(bot, "sent_emoji", "✅")
+        blocked_emoji = await cls._resolve_emoji(bot, "blocked_emoji", "🚫")
+        return cls(
+            cls.config_key(bot.config),
+            account_age,
+            guild_age,
+            sent_emoji,
+            blocked_emoji,
+        )
+
+    def is_current(self, config) -> bool:
+        return self.key == self.config_key(config)
@@ -1,19 +1,26 @@
+import asyncio
 import os
 import logging
 import secrets
 from datetime import datetime
 from json import JSONDecodeError
-from typing import Union, Optional
+from typing import Iterable, Union, Optional
 
 from discord import Member, DMChannel, TextChannel, Message
 from discord.ext import commands
 
 from aiohttp import ClientResponseError, ClientResponse
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 
-from core.utils import info
+from core.appender import LogAppender
+from core.indexes import Query
+from core.utils import error, info
 
 logger = logging.getLogger("Modmail")
 
+# Error codes of updates that would grow a document past 16 MB.
+DOCUMENT_TOO_LARGE = {10334, 17419}
+
 prefix = os.getenv("LOG_URL_PREFIX", "/logs")
 if prefix == "NONE":
     prefix = ""
@@ -255,6 +262,63 @@ class ApiClient(RequestClient):
         super().__init__(bot)
         if self.token:
             self.headers = {"Authorization": "Bearer " + self.token}
+        self.log_appender = LogAppender(self._write_log_messages)
+        # channel_id -> log key, or None for logs with embedded messages
+        self._log_layouts = {}
+        # Channels whose log, with embedded messages, reached 16 MB.
+        self._full_logs = set()
+
+    # The queries below are also checked by `core.indexes.sample_queries`.
+
+    @staticmethod
+    def log_query(channel_id: Union[int, str]) -> Query:
+        return Query("logs", {"channel_id": str(channel_id)})
+
+    @staticmethod
+    def log_key_query(key: str) -> Query:
+        return Query("logs", {"key": key})
+
+    @staticmethod
+    def user_logs_query(guild_id: Union[int, str], user_id: Union[int, str]) -> Query:
+        return Query("logs", {"recipient.id": str(user_id), "guild_id": str(guild_id)})
+
+    @staticmethod
+    def open_logs_query(guild_id: Union[int, str]) -> Query:
+        return Query("logs", {"open": True, "guild_id": str(guild_id)})
+
+    @staticmethod
+    def unmigrated_logs_query(guild_id: Union[int, str]) -> Query:
+        return Query(
+            "logs",
+            {
+                "guild_id": str(guild_id),
+                "open": False,
+                "messages_collection": {"$ne": True},
+                # Archived logs keep their messages in the archive store.
+                "archived": {"$exists": False},
+            },
+        )
+
+    @staticmethod
+    def messages_query(keys: Iterable[str], limit: int = None) -> Query:
+        query = {"log_key": {"$in": list(keys)}}
+        if limit is not None:
+            query["sequence"] = {"$lt": limit}
+        return Query("log_messages", query, sort=[("log_key", 1), ("sequence", 1)])
+
+    @staticmethod
+    def message_query(message_id: Union[int, str], embedded: bool = False) -> Query:
+        if embedded:
+            return Query("logs", {"messages.message_id": str(message_id)})
+        return Query("log_messages", {"message_id": str(message_id)})
+
+    @staticmethod
+    def user_stats_query(guild_id: Union[int, str], user_id: Union[int, str]) -> Query:
+        return Query("user_stats", {"user_id": str(user_id), "guild_id": str(guild_id)})
+
+    @staticmethod
+    def config_query(bot_id: int) -> Query:
+        return Query("config", {"bot_id": bot_id})
 
     @property
     def token(self) -> Optional[str]:
@@ -268,14 +332,160 @@ class ApiClient(RequestClient):
     def logs(self):
         return self.db.logs
 
+    @property
+    def log_messages(self):
+        return self.db.log_messages
+
+    @property
+    def user_stats(self):
+        return self.db.user_stats
+
+    @property
+    def separate_log_messages(self) -> bool:
+        value = self.bot.config.get("log_messages_collection", False)
+        return str(value).lower() in {"1", "true", "yes", "on"}
+
+    async def load_messages(self, logs: list, limit: int = None) -> list:
+        """
+        Fills in the `messages` of logs whose messages are stored in the
+        `log_messages` collection or in the log archive, so every layout
+        reads the same.
+
+        Parameters
+        ----------
+        logs : List[dict]
+            The log documents, modified in place.
+        limit : int, optional
+            Only load the first `limit` messages of each log.
+        """
+        by_key = {}
+        archived = []
+        for log in logs:
+            if log is None:
+                continue
+            if log.get("archived"):
+                archived.append(log)
+            elif log.get("messages_collection"):
+                log["messages"] = []
+                by_key[log["key"]] = log
+        if archived:
+            await self.bot.log_archive.load_messages(archived, limit)
+        if not by_key:
+            return logs
+
+        query = self.messages_query(by_key, limit)
+        async for message in query.find(self.db, {"_id": False}):
+            log = by_key[message.pop("log_key")]
+            message.pop("sequence")
+            if limit is None or len(log["messages"]) < limit:
+                log["messages"].append(message)
+        return logs
+
     async def get_user_logs(self, user_id: Union[str, int]) -> list:
-        query = {"recipient.id": str(user_id), "guild_id": str(self.bot.guild_id)}
+        query = self.user_logs_query(self.bot.guild_id, user_id)
 
         projection = {"messages": {"$slice": 5}}
-        return await self.logs.find(query, projection).to_list(None)
+        logs = await query.find(self.db, projection).to_list(None)
+        return await self.load_messages(logs, limit=5)
+
+    async def get_user_stats(self, user_id: Union[str, int]) -> dict:
+        """
+        Gets the log statistics of a recipient.
+
+        Returns
+        -------
+        dict
+            `closed_count`, `last_closed` and `total_messages`
+            of the recipient's closed logs.
+        """
+        query = self.user_stats_query(self.bot.guild_id, user_id)
+        stats = await query.find_one(self.db)
+        if stats is None:
+            stats = await self._seed_user_stats(str(user_id))
+        return stats
+
+    async def _seed_user_stats(self, user_id: str) -> dict:
+        """Computes the statistics of a recipient from their logs."""
+        query = self.user_stats_query(self.bot.guild_id, user_id).filter
+        pipeline = [
+            {
+                "$match": {
+                    "recipient.id": user_id,
+                    "guild_id": str(self.bot.guild_id),
+                    "open": False,
+                }
+            },
+            {
+                "$group": {
+                    "_id": None,
+                    "closed_count": {"$sum": 1},
+                    "last_closed": {"$max": "$closed_at"},
+                    "total_messages": {
+                        "$sum": {
+                            "$ifNull": [
+                                "$message_count",
+                                {"$size": {"$ifNull": ["$messages", []]}},
+                            ]
+                        }
+                    },
+                }
+            },
+        ]
+        result = await self.logs.aggregate(pipeline).to_list(1)
+        stats = {"closed_count": 0, "last_closed": None, "total_messages": 0}
+        if result:
+            stats.update({k: v for k, v in result[0].items() if k != "_id"})
+
+        try:
+            await self.user_stats.update_one(
+                query, {"$setOnInsert": stats}, upsert=True
+            )
+        except DuplicateKeyError:
+            # Seeded by another task at the same time.
+            pass
+        return {**query, **stats}
+
+    async def record_closed_log(self, log: dict) -> None:
+        """Updates the statistics of a recipient after their log was closed."""
+        user_id = log["recipient"]["id"]
+        if "message_count" in log:
+            message_count = log["message_count"]
+        else:
+            # Only the first messages of the log may have been read.
+            pipeline = [
+                {"$match": {"key": log["key"]}},
+                {"$project": {"count": {"$size": {"$ifNull": ["$messages", []]}}}},
+            ]
+            result = await self.logs.aggregate(pipeline).to_list(1)
+            message_count = result[0]["count"] if result else 0
+
+        query = self.user_stats_query(self.bot.guild_id, user_id)
+        # Statistics seeded after the log was closed already count it.
+        not_counted = [
+            {"last_closed": None},
+            {"last_closed": {"$lt": log["closed_at"]}},
+        ]
+        result = await self.user_stats.update_one(
+            {**query.filter, "$or": not_counted},
+            {
+                "$inc": {"closed_count": 1, "total_messages": message_count},
+                "$set": {"last_closed": log["closed_at"]},
+            },
+        )
+        if not result.matched_count and await query.find_one(self.db) is None:
+            # The log is already closed, so it is counted.
+            await self._seed_user_stats(user_id)
+
+    async def get_open_logs(self) -> list:
+        query = self.open_logs_query(self.bot.guild_id)
+        projection = {"channel_id": True, "recipient.id": True}
+        return await query.find(self.db, projection).to_list(None)
 
     async def get_log(self, channel_id: Union[str, int]) -> dict:
-        return await self.logs.find_one({"channel_id": str(channel_id)})
+        await self.log_appender.flush(channel_id)
+        log = await self.log_query(channel_id).find_one(self.db)
+        await self.load_messages([log])
+        return log
 
     async def get_log_link(self, channel_id: Union[str, int]) -> str:
         doc = await self.get_log(channel_id)
@@ -286,8 +496,16 @@ class ApiClient(RequestClient):
     ) -> str:
         key = secrets.token_hex(6)
 
+        if self.separate_log_messages:
+            layout = {"messages_collection": True, "message_count": 0, "messages": []}
+            self._log_layouts[str(channel.id)] = key
+        else:
+            layout = {"messages": []}
+            self._log_layouts[str(channel.id)] = None
+
         await self.logs.insert_one(
             {
+                **layout,
                 "_id": key,
                 "key": key,
                 "open": True,
@@ -311,34 +529,66 @@ class ApiClient(RequestClient):
                     "mod": isinstance(creator, Member),
                 },
                 "closer": None,
-                "messages": [],
             }
         )
 
         return f"{self.bot.config.log_url.strip('/')}{prefix}/{key}"
 
     async def get_config(self) -> dict:
-        conf = await self.db.config.find_one({"bot_id": self.bot.user.id})
+        conf = await self.config_query(self.bot.user.id).find_one(self.db)
         if conf is None:
             await self.db.config.insert_one({"bot_id": self.bot.user.id})
             return {"bot_id": self.bot.user.id}
         return conf
 
-    async def update_config(self, data: dict):
-        valid_keys = self.bot.config.valid_keys.difference(
-            self.bot.config.protected_keys
-        )
-
-        toset = {k: v for k, v in data.items() if k in valid_keys}
-        unset = {k: 1 for k in valid_keys if k not in data}
+    async def update_config(
+        self, toset: dict, unset: Iterable[str] = (), version: int = None
+    ):
+        """
+        Sets and unsets the given fields of the config document, and
+        increments its version.
 
-        return await self.db.config.update_one(
-            {"bot_id": self.bot.user.id}, {"$set": toset, "$unset": unset}
+        If `version` is given, the config is only updated if it's still
+        at that version, check `matched_count` of the result.
+        """
+        update = {"$inc": {"version": 1}}
+        if toset:
+            update["$set"] = toset
+        if unset:
+            update["$unset"] = {k: 1 for k in unset}
+
+        query = self.config_query(self.bot.user.id).filter
+        if version is not None:
+            # Configs saved before versioning don't have the field.
+            query["version"] = version or None
+        return await self.db.config.update_one(query, update)
+
+    async def get_config_version(self) -> int:
+        conf = await self.config_query(self.bot.user.id).find_one(
+            self.db, {"version": True}
         )
+        return conf.get("version", 0) if conf is not None else 0
 
-    async def edit_message(self, message_id: Union[int, str], new_content: str) -> None:
+    async def edit_message(
+        self,
+        message_id: Union[int, str],
+        new_content: str,
+        channel_id: Union[int, str] = None,
+    ) -> None:
+        """
+        Edits a logged message. The pending messages of `channel_id`,
+        the thread channel of the log, are written first, or those of
+        every channel when it is omitted.
+        """
+        await self.log_appender.flush(channel_id)
+        await self.log_messages.update_one(
+            self.message_query(message_id).filter,
+            {"$set": {"content": new_content, "edited": True}},
+        )
+        # Logs in the new layout keep a copy of their messages for the
+        # logviewer, see `_write_log_messages`.
         await self.logs.update_one(
-            {"messages.message_id": str(message_id)},
+            self.message_query(message_id, embedded=True).filter,
             {"$set": {"messages.$.content": new_content, "messages.$.edited": True}},
         )
 
@@ -373,18 +623,227 @@ class ApiClient(RequestClient):
             ],
         }
 
-        return await self.logs.find_one_and_update(
-            {"channel_id": channel_id},
-            {"$push": {f"messages": data}},
-            return_document=True,
+        self.bot.attachment_mirror.schedule(message, channel_id)
+        self.log_appender.add(channel_id, data)
+        return data
+
+    async def _get_log_layout(self, channel_id: str) -> Optional[str]:
+        if channel_id not in self._log_layouts:
+            log = await self.log_query(channel_id).find_one(
+                self.db, {"key": True, "messages_collection": True}
+            )
+            if log is not None and log.get("messages_collection"):
+                self._log_layouts[channel_id] = log["key"]
+            else:
+                self._log_layouts[channel_id] = None
+        return self._log_layouts[channel_id]
+
+    def _drop_log_messages(self, channel_id: str, entries: list) -> None:
+        self._log_layouts.pop(channel_id, None)
+        logger.warning(
+            error(
+                f"Dropped {len(entries)} log messages, "
+                f"the log of channel {channel_id} doesn't exist."
+            )
+        )
+
+    async def _write_log_messages(self, channel_id: str, entries: list) -> None:
+        key = await self._get_log_layout(channel_id)
+        if key is None:
+            if channel_id in self._full_logs:
+                return
+            try:
+                result = await self.logs.update_one(
+                    {"channel_id": channel_id},
+                    {"$push": {"messages": {"$each": entries}}},
+                )
+            except OperationFailure as e:
+                if e.code not in DOCUMENT_TOO_LARGE:
+                    raise
+                # Retrying can't help, the log can't hold more messages.
+                self._full_logs.add(channel_id)
+                await self.logs.update_one(
+                    {"channel_id": channel_id}, {"$set": {"messages_truncated": True}}
+                )
+                logger.warning(
+                    error(
+                        f"The log of channel {channel_id} is too large, "
+                        "its next messages are not logged."
+                    )
+                )
+                return
+            if not result.matched_count:
+                self._drop_log_messages(channel_id, entries)
+            return
+
+        # A retried batch starts with the messages that already have their
+        # sequence number and are already copied into the log.
+        new = [entry for entry in entries if "sequence" not in entry]
+        if new:
+            start = await self._reserve_sequence(key, new)
+            if start is None:
+                # Retrying can't help, the log was deleted.
+                self._drop_log_messages(channel_id, entries)
+                return
+            for i, entry in enumerate(new):
+                entry["sequence"] = start + i
+
+        try:
+            await self.log_messages.insert_many(
+                [{"log_key": key, **entry} for entry in entries], ordered=False
+            )
+        except BulkWriteError as exc:
+            # Inserted by an earlier attempt.
+            if any(e["code"] != 11000 for e in exc.details["writeErrors"]):
+                raise
+
+    async def _reserve_sequence(self, key: str, entries: list) -> Optional[int]:
+        """
+        Reserves a range of sequence numbers for `entries`, and copies them
+        into the log, where the logviewer reads them, until it grows too
+        large.
+
+        Returns
+        -------
+        Optional[int]
+            The first sequence number, `None` if the log doesn't exist.
+        """
+        update = {"$inc": {"message_count": len(entries)}}
+        try:
+            log = await self.logs.find_one_and_update(
+                {**self.log_key_query(key).filter, "messages_truncated": {"$ne": True}},
+                {**update, "$push": {"messages": {"$each": entries}}},
+                projection={"message_count": True},
+                return_document=True,
+            )
+        except OperationFailure as e:
+            if e.code not in DOCUMENT_TOO_LARGE:
+                raise
+            logger.warning(
+                error(
+                    f"Log {key} is too large, the logviewer "
+                    "only shows its first messages."
+                )
+            )
+            update["$set"] = {"messages_truncated": True}
+            log = None
+        if log is None:
+            log = await self.logs.find_one_and_update(
+                self.log_key_query(key).filter,
+                update,
+                projection={"message_count": True},
+                return_document=True,
+            )
+        if log is None:
+            return None
+        return log["message_count"] - len(entries)
+
+    async def set_attachment_mirror(
+        self,
+        channel_id: Union[int, str],
+        message_id: Union[int, str],
+        attachment_id: int,
+        mirror: dict,
+    ) -> None:
+        await self.log_appender.flush(channel_id)
+        key = await self._get_log_layout(str(channel_id))
+        if key is not None:
+            await self.log_messages.update_one(
+                {"log_key": key, "message_id": str(message_id)},
+                {"$set": {"attachments.$[a].mirror": mirror}},
+                array_filters=[{"a.id": attachment_id}],
+            )
+        await self.logs.update_one(
+            {"channel_id": str(channel_id)},
+            {"$set": {"messages.$[m].attachments.$[a].mirror": mirror}},
+            array_filters=[{"m.message_id": str(message_id)}, {"a.id": attachment_id}],
+        )
+
+    async def remove_log_message(
+        self, channel_id: Union[int, str], message_id: Union[int, str]
+    ) -> None:
+        await self.log_appender.flush(channel_id)
+        key = await self._get_log_layout(str(channel_id))
+        if key is not None:
+            await self.log_messages.delete_one(
+                {"log_key": key, "message_id": str(message_id)}
+            )
+        await self.logs.update_one(
+            {"channel_id": str(channel_id)},
+            {"$pull": {"messages": {"message_id": str(message_id)}}},
         )
 
-    async def post_log(self, channel_id: Union[int, str], data: dict) -> dict:
-        return await self.logs.find_one_and_update(
+    async def post_log(
+        self, channel_id: Union[int, str], data: dict, projection: dict = None
+    ) -> dict:
+        await self.log_appender.flush(channel_id)
+        log = await self.logs.find_one_and_update(
             {"channel_id": str(channel_id)},
             {"$set": {k: v for k, v in data.items()}},
+            projection=projection,
             return_document=True,
         )
+        if data.get("open") is False:
+            self._log_layouts.pop(str(channel_id), None)
+            self._full_logs.discard(str(channel_id))
+        await self.load_messages([log], limit=1)
+        return log
+
+    async def migrate_log_messages(self, batch_size: int = 50, delay: float = 1) -> int:
+        """
+        Moves the messages of closed logs into the `log_messages` collection.
+
+        Logs are migrated `batch_size` at a time, sleeping `delay` seconds
+        between batches, while the bot keeps running. Open logs are left
+        alone until they are closed, as they may still receive messages.
+        Migrated logs keep their embedded messages for the logviewer.
+
+        Returns
+        -------
+        int
+            The number of logs migrated.
+        """
+        query = self.unmigrated_logs_query(self.bot.guild_id)
+        projection = {"key": True, "messages": True}
+        migrated = 0
+        while True:
+            batch = await query.find(self.db, projection).to_list(batch_size)
+            if not batch:
+                break
+
+            for log in batch:
+                messages = log.get("messages") or []
+                if messages:
+                    try:
+                        await self.log_messages.insert_many(
+                            [
+                                {"log_key": log["key"], "sequence": i, **message}
+                                for i, message in enumerate(messages)
+                            ],
+                            ordered=False,
+                        )
+                    except BulkWriteError as exc:
+                        # Left over from an interrupted migration.
+                        if any(e["code"] != 11000 for e in exc.details["writeErrors"]):
+                            raise
+                # Skip logs that changed since they were read, the next batch
+                # picks them up again.
+                unchanged = {"_id": log["_id"]}
+                if "messages" in log:
+                    unchanged["messages"] = {"$size": len(messages)}
+                await self.logs.update_one(
+                    unchanged,
+                    {
+                        "$set": {
+                            "messages_collection": True,
+                            "message_count": len(messages),
+                        }
+                    },
+                )
+            migrated += len(batch)
+            logger.info(info(f"Migrated the messages of {migrated} logs."))
+            await asyncio.sleep(delay)
+        return migrated
 
     async def update_repository(self) -> dict:
         user = await GitHub.login(self.bot)
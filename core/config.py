@@ -1,19 +1,178 @@
 import asyncio
 import json
+import logging
 import os
 import typing
+from copy import deepcopy
+from types import MappingProxyType
 
-from dotenv import load_dotenv
+import discord
 import isodate
+from dotenv import load_dotenv
 from discord.ext.commands import BadArgument
+from pymongo.errors import PyMongoError
 
 from core._color_data import ALL_COLORS
 from core.models import InvalidConfigError
+from core.records import RecordMap
 from core.time import UserFriendlyTime
+from core.utils import error, info
 
+logger = logging.getLogger("Modmail")
 
 load_dotenv()
 
+_missing = object()
+
+
+def _is_field_name(key: typing.Any) -> bool:
+    return isinstance(key, str) and key and "." not in key and key[0] != "$"
+
+
+def _parse_color(value: typing.Optional[str], default: discord.Color, name: str):
+    if not value:
+        return default
+    try:
+        return int(value.lstrip("#"), base=16)
+    except ValueError:
+        logger.error(error(f"Invalid {name} provided"))
+        return default
+
+
+def _parse_duration(value: typing.Optional[str], name: str):
+    if value is None:
+        return None
+    try:
+        return isodate.parse_duration(value)
+    except isodate.ISO8601Error:
+        logger.warning(
+            error(
+                f"The {name} limit needs to be a "
+                "ISO-8601 duration formatted duration string "
+                f'greater than 0 days, not "{value}".'
+            )
+        )
+        return None
+
+
+class ConfigSnapshot:
+    """
+    The config values used on every message, parsed once.
+
+    A snapshot is never modified, `ConfigManager.snapshot` replaces
+    it with a new one after the config changed. An invalid auto close
+    time is removed from the config when it is parsed.
+
+    Attributes
+    ----------
+    prefix : str
+        The command prefix.
+    main_color : Union[Color, int]
+        The colour of the bot's own embeds.
+    mod_color : Union[Color, int]
+        The colour of staff replies.
+    recipient_color : Union[Color, int]
+        The colour of recipient messages.
+    thread_auto_close : Optional[Union[timedelta, Duration]]
+        How long threads stay open without a reply, `None` to keep
+        them open.
+    main_category : Optional[CategoryChannel]
+        The category threads are created in.
+    log_channel : Optional[TextChannel]
+        The channel closed threads are logged in.
+    snippets : Mapping[str, str]
+        The snippets, without empty ones.
+    aliases : Mapping[str, str]
+        The aliases, without empty ones.
+    """
+
+    __slots__ = (
+        "prefix",
+        "main_color",
+        "mod_color",
+        "recipient_color",
+        "thread_auto_close",
+        "main_category",
+        "log_channel",
+        "snippets",
+        "aliases",
+    )
+
+    def __init__(
+        self,
+        *,
+        prefix,
+        main_color,
+        mod_color,
+        recipient_color,
+        thread_auto_close,
+        main_category,
+        log_channel,
+        snippets,
+        aliases,
+    ):
+        self.prefix = prefix
+        self.main_color = main_color
+        self.mod_color = mod_color
+        self.recipient_color = recipient_color
+        self.thread_auto_close = thread_auto_close
+        self.main_category = main_category
+        self.log_channel = log_channel
+        self.snippets = snippets
+        self.aliases = aliases
+
+    @staticmethod
+    def _resolve_main_category(bot) -> typing.Optional[discord.CategoryChannel]:
+        guild = bot.modmail_guild
+        if guild is None:
+            return None
+        category_id = bot.config.get("main_category_id")
+        if category_id is not None:
+            return discord.utils.get(guild.categories, id=int(category_id))
+        return discord.utils.get(guild.categories, name="Modmail")
+
+    @staticmethod
+    def _resolve_log_channel(
+        bot, main_category
+    ) -> typing.Optional[discord.TextChannel]:
+        channel_id = bot.config.get("log_channel_id")
+        if channel_id is not None:
+            return bot.get_channel(int(channel_id))
+        if main_category is not None and main_category.channels:
+            return main_category.channels[0]
+        return None
+
+    @classmethod
+    def build(cls, bot) -> "ConfigSnapshot":
+        config = bot.config
+        main_category = cls._resolve_main_category(bot)
+        thread_auto_close = _parse_duration(
+            config.get("thread_auto_close"), "auto_close_thread"
+        )
+        if thread_auto_close is None and config.get("thread_auto_close") is not None:
+            config.discard("thread_auto_close")
+        return cls(
+            prefix=config.get("prefix", "?"),
+            main_color=_parse_color(
+                config.get("main_color"), discord.Color.blurple(), "main_color"
+            ),
+            mod_color=_parse_color(
+                config.get("mod_color"), discord.Color.green(), "mod_color"
+            ),
+            recipient_color=_parse_color(
+                config.get("recipient_color"), discord.Color.gold(), "recipient_color"
+            ),
+            thread_auto_close=thread_auto_close,
+            main_category=main_category,
+            log_channel=cls._resolve_log_channel(bot, main_category),
+            snippets=MappingProxyType(
+                {k: v for k, v in config.get("snippets", {}).items() if v}
+            ),
+            aliases=MappingProxyType(
+                {k: v for k, v in config.get("aliases", {}).items() if v}
+            ),
+        )
+
 
 class ConfigManager:
 
@@ -47,6 +206,7 @@ class ConfigManager:
         "thread_close_title",
         "thread_close_response",
         "thread_self_close_response",
+        "pipelined_relay",
         # moderation
         "recipient_color",
         "mod_tag",
@@ -64,15 +224,11 @@ class ConfigManager:
         "status",
         "oauth_whitelist",
         # moderation
-        "blocked",
         "blocked_whitelist",
         "command_permissions",
         "level_permissions",
         # threads
         "snippets",
-        "notification_squad",
-        "subscriptions",
-        "closures",
         # misc
         "aliases",
         "plugins",
@@ -91,6 +247,16 @@ class ConfigManager:
         "github_access_token",
         # Logging
         "log_level",
+        # Attachments
+        "attachment_store",
+        "attachment_store_path",
+        "attachment_store_url",
+        "attachment_max_size",
+        # Logs
+        "log_messages_collection",
+        "log_archive_days",
+        "log_archive_store",
+        "log_archive_path",
     }
 
     colors = {"mod_color", "recipient_color", "main_color"}
@@ -99,12 +265,28 @@ class ConfigManager:
 
     valid_keys = allowed_to_change_in_command | internal_keys | protected_keys
 
-    def __init__(self, bot):
+    # Keys moved to their own collections, see `migrate_records`.
+    moved_keys = {"blocked", "closures", "subscriptions", "notification_squad"}
+
+    def __init__(self, bot, write_delay: float = 0.5):
         self.bot = bot
+        self.write_delay = write_delay
         self._cache = {}
+        # The values last written to or read from the database, and the
+        # version of the config document they are from.
+        self._saved = {}
+        self.version = 0
+        self._write_lock = asyncio.Lock()
+        self._pending_write = None
+        self._snapshot = None
         self._ready_event = asyncio.Event()
         self.populate_cache()
 
+        # Per-thread maps, kept in their own collections.
+        self.closures = RecordMap(bot, "closures")
+        self.subscriptions = RecordMap(bot, "subscriptions")
+        self.notification_squad = RecordMap(bot, "notification_squads")
+
     def __repr__(self):
         return repr(self.cache)
 
@@ -112,6 +294,20 @@ class ConfigManager:
     def api(self):
         return self.bot.api
 
+    @property
+    def snapshot(self) -> ConfigSnapshot:
+        """The parsed config, rebuilt after `update` or `refresh`."""
+        if self._snapshot is None:
+            self._snapshot = ConfigSnapshot.build(self.bot)
+        return self._snapshot
+
+    def invalidate(self) -> None:
+        """
+        Rebuilds the snapshot when it's next used, for when the
+        channels it resolved may have changed.
+        """
+        self._snapshot = None
+
     @property
     def ready_event(self) -> asyncio.Event:
         return self._ready_event
@@ -129,14 +325,10 @@ class ConfigManager:
             "snippets": {},
             "plugins": [],
             "aliases": {},
-            "blocked": {},
             "blocked_whitelist": [],
             "oauth_whitelist": [],
             "command_permissions": {},
             "level_permissions": {},
-            "notification_squad": {},
-            "subscriptions": {},
-            "closures": {},
             "log_level": "INFO",
         }
 
@@ -215,16 +407,287 @@ class ConfigManager:
         return clean_value, value_text
 
     async def update(self, data: typing.Optional[dict] = None) -> dict:
-        """Updates the config with data from the cache"""
+        """
+        Updates the config with data from the cache.
+
+        The write is delayed by `write_delay` seconds, so updates made
+        in the meantime are sent together. Await `flush` to make sure
+        the changes are saved.
+        """
         if data is not None:
+            self._check_keys(data)
             self.cache.update(data)
-        await self.api.update_config(self.cache)
+        self._snapshot = None
+        if self._pending_write is None:
+            self._pending_write = self.bot.loop.create_task(self._delayed_flush())
         return self.cache
 
+    def _check_keys(self, keys: typing.Iterable[str]) -> None:
+        moved = self.moved_keys.intersection(keys)
+        if moved:
+            raise InvalidConfigError(
+                f"{', '.join(sorted(moved))} can't be set in the config, "
+                "use `bot.blocks` and `bot.config.records` instead."
+            )
+
+    def discard(self, key: str) -> None:
+        """Removes an invalid value from the config, and saves it."""
+        self.cache.pop(key, None)
+        self.bot.loop.create_task(self.update())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.write_delay)
+        self._pending_write = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.error(error("Failed to save the config."), exc_info=True)
+
+    def _diff(self) -> typing.Tuple[dict, typing.List[str], dict]:
+        """
+        Compares the cache with the saved values.
+
+        Values of dicts are compared one item at a time, so only the
+        changed items are written.
+
+        Returns
+        -------
+        Tuple[dict, List[str], dict]
+            The fields to set, the fields to unset, and the new
+            saved values.
+        """
+        toset, unset, saved = {}, [], {}
+        for key in self.valid_keys - self.protected_keys:
+            if key not in self.cache:
+                if key in self._saved:
+                    unset.append(key)
+                continue
+
+            value = self.cache[key]
+            old = self._saved.get(key)
+            if key in self._saved and old == value:
+                continue
+            saved[key] = deepcopy(value)
+
+            if (
+                isinstance(value, dict)
+                and isinstance(old, dict)
+                and all(_is_field_name(k) for k in value.keys() | old.keys())
+            ):
+                for k, v in value.items():
+                    if k not in old or old[k] != v:
+                        toset[f"{key}.{k}"] = saved[key][k]
+                unset.extend(f"{key}.{k}" for k in old if k not in value)
+            else:
+                toset[key] = saved[key]
+        return toset, unset, saved
+
+    async def flush(self) -> None:
+        """
+        Writes the changed config values to the database now.
+
+        The write only succeeds if the config is still at `version`.
+        Otherwise another process saved it first, its changes are read
+        back and merged, and the diff is written again.
+        """
+        if self._pending_write is not None:
+            self._pending_write.cancel()
+            self._pending_write = None
+
+        async with self._write_lock:
+            while True:
+                toset, unset, saved = self._diff()
+                if not toset and not unset:
+                    return
+                result = await self.api.update_config(toset, unset, self.version)
+                if result.matched_count:
+                    break
+                logger.debug("The config changed since it was read, merging.")
+                await self._reload()
+
+            self.version += 1
+            self._saved.update(saved)
+            for key in unset:
+                if "." not in key:
+                    self._saved.pop(key, None)
+
+    def _merge(self, data: dict, keys: typing.Iterable[str] = None) -> list:
+        """
+        Applies the values another process saved to the cache.
+
+        Only values that changed since they were last read are applied,
+        unless they were also changed in this process, which are kept
+        to be written over them. Dicts are merged one item at a time.
+
+        Parameters
+        ----------
+        data : dict
+            The config document.
+        keys : Iterable[str], optional
+            The keys that changed, every key by default.
+
+        Returns
+        -------
+        list
+            The keys that changed.
+        """
+        self.version = data.get("version", 0)
+        changed = []
+        for key in self.valid_keys - self.protected_keys:
+            if keys is not None and key not in keys:
+                continue
+            old = self._saved.get(key, _missing)
+            new = data.get(key, _missing)
+            if old == new:
+                continue
+            changed.append(key)
+
+            local = self.cache.get(key, _missing)
+            if (
+                isinstance(local, dict)
+                and isinstance(new, dict)
+                and (old is _missing or isinstance(old, dict))
+            ):
+                old = {} if old is _missing else old
+                for k in old.keys() | new.keys():
+                    if local.get(k, _missing) != old.get(k, _missing):
+                        continue
+                    if k in new:
+                        local[k] = deepcopy(new[k])
+                    else:
+                        local.pop(k, None)
+            # Keys that were never saved hold defaults, which the saved
+            # values replace.
+            elif old is _missing or local == old:
+                if new is _missing:
+                    self.cache.pop(key, None)
+                else:
+                    self.cache[key] = deepcopy(new)
+
+            if new is _missing:
+                self._saved.pop(key, None)
+            else:
+                self._saved[key] = deepcopy(new)
+
+        if changed:
+            self._snapshot = None
+            logger.debug(info(f"Config changed elsewhere: {', '.join(changed)}."))
+        return changed
+
+    async def _reload(self) -> None:
+        data = await self.api.get_config()
+        await self.migrate_records(data)
+        self._merge(data)
+
+    async def _watch_changes(self) -> None:
+        pipeline = [{"$match": {"fullDocument.bot_id": self.bot.user.id}}]
+        async with self.bot.db.config.watch(
+            pipeline, full_document="updateLookup"
+        ) as stream:
+            async for change in stream:
+                data = change.get("fullDocument")
+                if data is None or data.get("version", 0) < self.version:
+                    continue
+                # Saved by a process that still keeps them in the config.
+                await self.migrate_records(data)
+                keys = None
+                description = change.get("updateDescription")
+                if description is not None:
+                    fields = [*description["updatedFields"]]
+                    fields += description["removedFields"]
+                    keys = {field.split(".")[0] for field in fields}
+                async with self._write_lock:
+                    self._merge(data, keys)
+
+    async def _poll_changes(self, interval: float) -> None:
+        while not self.bot.is_closed():
+            await asyncio.sleep(interval)
+            try:
+                version = await self.api.get_config_version()
+                if version > self.version:
+                    async with self._write_lock:
+                        await self._reload()
+            except Exception:
+                logger.error(error("Failed to reload the config."), exc_info=True)
+
+    async def watch(self, poll_interval: float = 30) -> None:
+        """
+        Applies the config changes saved by other processes, until the
+        bot closes.
+
+        Changes are read from a change stream of the config collection.
+        Change streams need a replica set, without one the config version
+        is checked every `poll_interval` seconds instead. Writers other
+        than Modmail must increment `version` for polling to see them.
+        """
+        try:
+            await self._watch_changes()
+        except PyMongoError as exc:
+            logger.info(
+                info(f"Polling for config changes, change streams failed: {exc}.")
+            )
+        await self._poll_changes(poll_interval)
+
+    @property
+    def records(self) -> typing.Dict[str, RecordMap]:
+        return {
+            "closures": self.closures,
+            "subscriptions": self.subscriptions,
+            "notification_squad": self.notification_squad,
+        }
+
+    async def migrate_records(self, data: dict) -> typing.List[str]:
+        """
+        Moves the blocked users and the per-thread maps out of the config
+        document, for configs saved before they had their own collections
+        and for changes saved by processes that still keep them there.
+        Entries that already exist in their collection are kept.
+
+        Returns
+        -------
+        List[str]
+            The config keys that were moved.
+        """
+        moved = []
+        blocked = data.pop("blocked", None)
+        if blocked is not None:
+            count = await self.bot.blocks.migrate(blocked)
+            logger.info(info(f"Moved {count} blocks to their own collection."))
+            moved.append("blocked")
+
+        for key, records in self.records.items():
+            old = data.pop(key, None)
+            if old is None:
+                continue
+            count = await records.migrate(old)
+            logger.info(info(f"Moved {count} {key} to their own collection."))
+            moved.append(key)
+        if moved:
+            await self.api.update_config({}, moved)
+        return moved
+
     async def refresh(self) -> dict:
         """Refreshes internal cache with data from database"""
         data = await self.api.get_config()
+        if await self.migrate_records(data):
+            # The migration saved a new version.
+            data = await self.api.get_config()
+        await asyncio.gather(*(records.load() for records in self.records.values()))
+
+        if self.ready_event.is_set():
+            # Reconnected, keep the changes that aren't saved yet.
+            async with self._write_lock:
+                self._merge(data)
+            return self.cache
+
         self.cache.update(data)
+        self._snapshot = None
+        self._saved = {
+            k: deepcopy(v)
+            for k, v in data.items()
+            if k in self.valid_keys and k not in self.protected_keys
+        }
+        self.version = data.get("version", 0)
         self.ready_event.set()
         return self.cache
 
@@ -235,6 +698,7 @@ class ConfigManager:
         return self.cache[value]
 
     def __setitem__(self, key: str, item: typing.Any) -> None:
+        self._check_keys([key])
         self.cache[key] = item
 
     def __getitem__(self, key: str) -> typing.Any:
@@ -0,0 +1,221 @@
+"""
+Exports logs to gzip compressed JSONL or CSV files.
+
+Can also be used without running the bot::
+
+    python -m core.export logs.jsonl.gz --after 2019-01-01 --closer 1234
+
+The database is read from the `MONGO_URI` and `GUILD_ID` environment
+variables, or from the `.env` file.
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import os
+import typing
+
+from bson import json_util
+from dotenv import load_dotenv
+
+from core.archive import get_store, restore
+from core.indexes import Query
+
+FORMATS = ("jsonl", "csv")
+
+CSV_COLUMNS = [
+    "log_key",
+    "index",
+    "timestamp",
+    "author_id",
+    "author_name",
+    "mod",
+    "type",
+    "content",
+    "attachments",
+]
+
+
+def export_query(query: dict) -> Query:
+    return Query("logs", query, sort=[("created_at", 1)])
+
+
+async def _iter_messages(
+    db, log: dict, archive_store=None
+) -> typing.AsyncIterator[dict]:
+    if log.get("archived"):
+        archive_store = archive_store or get_store(db)
+        for message in (await restore(archive_store, log["key"]))["messages"]:
+            yield message
+    elif log.get("messages_collection"):
+        cursor = db.log_messages.find(
+            {"log_key": log["key"]}, {"_id": False, "log_key": False}
+        ).sort("sequence", 1)
+        async for message in cursor:
+            message.pop("sequence", None)
+            yield message
+    else:
+        for message in log.get("messages") or []:
+            yield message
+
+
+async def _jsonl_rows(db, log: dict, archive_store) -> typing.List[dict]:
+    if log.get("archived") or log.get("messages_collection"):
+        log["messages"] = [m async for m in _iter_messages(db, log, archive_store)]
+    return [log]
+
+
+async def _csv_rows(db, log: dict, archive_store) -> typing.List[list]:
+    rows = []
+    index = 0
+    async for message in _iter_messages(db, log, archive_store):
+        author = message.get("author") or {}
+        rows.append(
+            [
+                log["key"],
+                index,
+                message.get("timestamp"),
+                author.get("id"),
+                author.get("name"),
+                author.get("mod"),
+                message.get("type"),
+                message.get("content"),
+                " ".join(a["url"] for a in message.get("attachments") or []),
+            ]
+        )
+        index += 1
+    return rows
+
+
+async def export_logs(
+    db,
+    query: dict,
+    file: typing.BinaryIO,
+    fmt: str = "jsonl",
+    batch_size: int = 100,
+    archive_store=None,
+) -> int:
+    """
+    Streams the logs matching `query` into `file`, gzip compressed.
+
+    Logs are read from the database `batch_size` at a time and written
+    as they arrive, so memory use doesn't grow with the number of logs.
+    Serialising, compressing and writing run in an executor.
+
+    Parameters
+    ----------
+    db : AsyncIOMotorDatabase
+        The Modmail database.
+    query : dict
+        The filter for the `logs` collection.
+    file : BinaryIO
+        Where to write the compressed export.
+    fmt : str, optional
+        "jsonl", one log per line, or "csv", one message per row.
+        Defaults to "jsonl".
+    batch_size : int, optional
+        Defaults to 100.
+    archive_store : optional
+        Where archived logs are read from, see `core.archive`.
+        Defaults to the `logs_archive` collection.
+
+    Returns
+    -------
+    int
+        The number of logs exported.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}.")
+
+    loop = asyncio.get_event_loop()
+    rows_of = _jsonl_rows if fmt == "jsonl" else _csv_rows
+    count = 0
+    with gzip.GzipFile(fileobj=file, mode="wb") as compressed:
+        text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+
+        def write(rows):
+            for row in rows:
+                if fmt == "jsonl":
+                    text.write(json_util.dumps(row))
+                    text.write("\n")
+                else:
+                    writer.writerow(row)
+            text.flush()
+
+        pending = [CSV_COLUMNS] if fmt == "csv" else []
+        cursor = export_query(query).find(db, batch_size=batch_size)
+        async for log in cursor:
+            pending += await rows_of(db, log, archive_store)
+            count += 1
+            if len(pending) >= batch_size:
+                await loop.run_in_executor(None, write, pending)
+                pending = []
+        await loop.run_in_executor(None, write, pending)
+        text.detach()
+    return count
+
+
+async def export_to_file(db, query: dict, path: str, fmt: str = "jsonl", **options):
+    """
+    Exports the logs matching `query` to the file at `path`, see
+    `export_logs`. The partial file is removed if the export fails.
+
+    Returns
+    -------
+    int
+        The number of logs exported.
+    """
+    try:
+        with open(path, "wb") as f:
+            return await export_logs(db, query, f, fmt, **options)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+def main(argv: typing.List[str] = None) -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from core.logsearch import parse_filters
+
+    args = argparse.ArgumentParser(description="Export Modmail logs.")
+    args.add_argument("path", help="Where to write the export, e.g. logs.jsonl.gz.")
+    args.add_argument("--format", choices=FORMATS, default=None)
+    args.add_argument("--after", help="Only logs created after this date.")
+    args.add_argument("--before", help="Only logs created before this date.")
+    args.add_argument("--recipient", help="Only logs of this recipient ID.")
+    args.add_argument("--closer", help="Only logs closed by this user ID.")
+    args.add_argument("--include-open", action="store_true")
+    args = args.parse_args(argv)
+
+    fmt = args.format or ("csv" if ".csv" in args.path else "jsonl")
+    filters = " ".join(
+        f"{name}:{getattr(args, name)}"
+        for name in ("after", "before", "recipient", "closer")
+        if getattr(args, name)
+    )
+    query, _ = parse_filters(filters)
+
+    load_dotenv()
+    if os.getenv("GUILD_ID"):
+        query["guild_id"] = os.getenv("GUILD_ID")
+    if not args.include_open:
+        query["open"] = False
+
+    db = AsyncIOMotorClient(os.environ["MONGO_URI"]).modmail_bot
+    archive_store = get_store(
+        db, os.getenv("LOG_ARCHIVE_STORE"), os.getenv("LOG_ARCHIVE_PATH")
+    )
+
+    count = asyncio.get_event_loop().run_until_complete(
+        export_to_file(db, query, args.path, fmt, archive_store=archive_store)
+    )
+    print(f"Exported {count} logs to {args.path}.")
+
+
+if __name__ == "__main__":
+    main()
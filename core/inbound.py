@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import typing
+from collections import deque
+from time import perf_counter
+
+import discord
+
+from core.utils import error
+
+logger = logging.getLogger("Modmail")
+
+
+class InboundQueue:
+    """
+    Per-recipient queues for messages sent to the bot.
+
+    Messages of a single recipient are handled strictly in order, while
+    different recipients are processed in parallel, up to `concurrency`
+    at a time. Messages that pile up while a batch is being handled
+    (for example while the thread is being set up) are handed over to
+    the handler together as the next batch.
+
+    Parameters
+    ----------
+    handler : Callable[[List[Message]], Awaitable[None]]
+        Coroutine function that processes a batch of messages
+        from the same recipient.
+    concurrency : int, optional
+        How many recipients may be processed at once.
+        Defaults to 10.
+
+    Attributes
+    ----------
+    processed : int
+        The number of messages handled so far.
+    max_wait : float
+        The longest time, in seconds, a message waited in a queue.
+    """
+
+    def __init__(
+        self,
+        handler: typing.Callable[[typing.List[discord.Message]], typing.Awaitable],
+        concurrency: int = 10,
+    ):
+        self.handler = handler
+        self._queues: typing.Dict[int, deque] = {}
+        self._workers: typing.Dict[int, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._recent_waits = deque(maxlen=100)
+        self.processed = 0
+        self.max_wait = 0.0
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def put(self, message: discord.Message) -> None:
+        """Adds a message to its author's queue."""
+        recipient_id = message.author.id
+        queue = self._queues.setdefault(recipient_id, deque())
+        queue.append((message, perf_counter()))
+
+        if recipient_id not in self._workers:
+            self._workers[recipient_id] = asyncio.ensure_future(
+                self._work(recipient_id)
+            )
+
+    @property
+    def metrics(self) -> typing.Dict[str, typing.Any]:
+        waits = self._recent_waits
+        return {
+            "depth": len(self),
+            "active_recipients": len(self._workers),
+            "max_recipient_depth": max(map(len, self._queues.values()), default=0),
+            "processed": self.processed,
+            "average_wait": sum(waits) / len(waits) if waits else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    async def _work(self, recipient_id: int) -> None:
+        queue = self._queues[recipient_id]
+        try:
+            while queue:
+                async with self._semaphore:
+                    now = perf_counter()
+                    batch = []
+                    while queue:
+                        message, enqueued_at = queue.popleft()
+                        wait = now - enqueued_at
+                        self._recent_waits.append(wait)
+                        self.max_wait = max(self.max_wait, wait)
+                        batch.append(message)
+
+                    try:
+                        await self.handler(batch)
+                    except Exception:
+                        logger.error(
+                            error(f"Failed to process messages from {recipient_id}."),
+                            exc_info=True,
+                        )
+                    self.processed += len(batch)
+        finally:
+            del self._workers[recipient_id]
+            if not queue:
+                del self._queues[recipient_id]
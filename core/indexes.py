@@ -0,0 +1,363 @@
+import logging
+import sys
+import typing
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+from core.utils import info, error
+
+logger = logging.getLogger("Modmail")
+
+
+class Index:
+    """
+    An index the bot's queries rely on.
+
+    Parameters
+    ----------
+    collection : str
+        The name of the collection.
+    keys : Union[str, List[Tuple[str, Any]]]
+        The keys, as accepted by `Collection.create_index`.
+    **options
+        Extra options passed to `Collection.create_index`.
+    """
+
+    __slots__ = ("collection", "keys", "options")
+
+    def __init__(self, collection: str, keys, **options):
+        self.collection = collection
+        self.keys = keys
+        self.options = options
+
+    def __repr__(self):
+        return f"<Index collection={self.collection!r} keys={self.keys!r}>"
+
+    @property
+    def fields(self) -> typing.List[typing.Tuple[str, typing.Any]]:
+        if isinstance(self.keys, str):
+            return [(self.keys, ASCENDING)]
+        return list(self.keys)
+
+
+class Query:
+    """
+    A query the bot runs.
+
+    The code that runs a query and `sample_queries` get it from the same
+    function, so the plans checked are those of the real queries.
+
+    Parameters
+    ----------
+    collection : str
+        The name of the collection.
+    filter : dict
+        The filter.
+    sort : List[Tuple[str, int]], optional
+        The sort keys.
+    skip : int, optional
+        How many documents to skip.
+    limit : int, optional
+        The maximum number of documents, 0 for no limit.
+    """
+
+    __slots__ = ("collection", "filter", "sort", "skip", "limit")
+
+    def __init__(
+        self,
+        collection: str,
+        filter: dict,
+        sort: typing.List[typing.Tuple[str, int]] = None,
+        skip: int = 0,
+        limit: int = 0,
+    ):
+        self.collection = collection
+        self.filter = filter
+        self.sort = sort or []
+        self.skip = skip
+        self.limit = limit
+
+    def __repr__(self):
+        return f"<Query collection={self.collection!r} filter={self.filter!r}>"
+
+    def find(self, db, projection: dict = None, **kwargs):
+        """The cursor of the query on `db`."""
+        cursor = db[self.collection].find(self.filter, projection, **kwargs)
+        if self.sort:
+            cursor = cursor.sort(self.sort)
+        if self.skip:
+            cursor = cursor.skip(self.skip)
+        if self.limit:
+            cursor = cursor.limit(self.limit)
+        return cursor
+
+    async def find_one(self, db, projection: dict = None) -> typing.Optional[dict]:
+        return await db[self.collection].find_one(
+            self.filter, projection, sort=self.sort or None
+        )
+
+
+INDEXES = [
+    # logs
+    Index(
+        "logs",
+        [("messages.content", TEXT), ("messages.author.name", TEXT), ("key", TEXT)],
+    ),
+    Index("logs", "channel_id"),
+    Index("logs", "key"),
+    Index(
+        "logs",
+        [
+            ("recipient.id", ASCENDING),
+            ("guild_id", ASCENDING),
+            ("open", ASCENDING),
+            ("created_at", ASCENDING),
+        ],
+    ),
+    Index(
+        "logs",
+        [
+            ("guild_id", ASCENDING),
+            ("open", ASCENDING),
+            ("closer.id", ASCENDING),
+            ("created_at", ASCENDING),
+        ],
+    ),
+    Index(
+        "logs",
+        [("guild_id", ASCENDING), ("open", ASCENDING), ("created_at", ASCENDING)],
+    ),
+    Index("logs", "messages.message_id"),
+    Index(
+        "logs", [("guild_id", ASCENDING), ("open", ASCENDING), ("closed_at", ASCENDING)]
+    ),
+    # log_messages
+    Index(
+        "log_messages", [("log_key", ASCENDING), ("sequence", ASCENDING)], unique=True
+    ),
+    Index("log_messages", "message_id"),
+    Index("log_messages", [("content", TEXT), ("author.name", TEXT)]),
+    # message_links
+    Index("message_links", "dm"),
+    Index("message_links", "thread"),
+    Index("message_links", [("channel_id", ASCENDING), ("thread", DESCENDING)]),
+    # user_stats
+    Index("user_stats", [("user_id", ASCENDING), ("guild_id", ASCENDING)], unique=True),
+    # rollups
+    Index("rollups", [("guild_id", ASCENDING), ("day", ASCENDING)]),
+    # blocks
+    Index("blocks", [("bot_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+    Index(
+        "blocks",
+        [("bot_id", ASCENDING), ("created_at", ASCENDING), ("expires_at", ASCENDING)],
+    ),
+    Index("blocks", "expires_at", expireAfterSeconds=0),
+    # closures, subscriptions and notification_squads
+    *(
+        Index(name, [("bot_id", ASCENDING), ("key", ASCENDING)], unique=True)
+        for name in ("closures", "subscriptions", "notification_squads")
+    ),
+    # config
+    Index("config", "bot_id"),
+    # attachments.files, files are hashed after they are uploaded.
+    Index(
+        "attachments.files",
+        "metadata.sha256",
+        unique=True,
+        partialFilterExpression={"metadata.sha256": {"$exists": True}},
+    ),
+]
+
+OBSOLETE_INDEXES = {
+    "logs": [
+        # Replaced by the text index above, which also covers the log key.
+        "messages.content_text_messages.author.name_text",
+    ]
+}
+
+
+async def setup_indexes(db, indexes: typing.Iterable[Index] = INDEXES) -> None:
+    """
+    Builds every index in `indexes` that doesn't exist yet.
+
+    Indexes are built in the background, so this may run while the bot
+    serves requests.
+    """
+    for collection, names in OBSOLETE_INDEXES.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name in existing:
+                logger.info(info(f"Dropping old index: {name}"))
+                await db[collection].drop_index(name)
+
+    for index in indexes:
+        try:
+            name = await db[index.collection].create_index(
+                index.keys, background=True, **index.options
+            )
+        except Exception:
+            logger.error(error(f"Failed to create index {index!r}."), exc_info=True)
+        else:
+            logger.debug(info(f"Index {name} on {index.collection} is ready."))
+
+
+def sample_queries(
+    guild_id: int = 0, bot_id: int = 0
+) -> typing.List[typing.Tuple[str, Query]]:
+    """
+    The bot's queries, with sample values, built by the same functions
+    the bot runs them with.
+
+    Returns
+    -------
+    List[Tuple[str, Query]]
+        The name and query of each query.
+    """
+    from core.analytics import Analytics
+    from core.archive import LogArchive
+    from core.attachments import GridFSAttachmentStore
+    from core.blocking import BlockStore
+    from core.clients import ApiClient
+    from core.export import export_query
+    from core.links import MessageLinks
+    from core.logsearch import LogSearch
+    from core.records import RecordMap
+
+    def search(query):
+        return LogSearch.chunk_query(LogSearch.build_filter(guild_id, query), 1, 10)
+
+    text = LogSearch.text_filter("0")
+    queries = [
+        ("get_log", ApiClient.log_query("0")),
+        ("log by key", ApiClient.log_key_query("0")),
+        ("get_user_logs", ApiClient.user_logs_query(guild_id, "0")),
+        ("get_open_logs", ApiClient.open_logs_query(guild_id)),
+        ("logs", search({"recipient.id": "0"})),
+        ("logs closed-by", search({"closer.id": "0"})),
+        ("logs search", search(text)),
+        ("logs search (log_messages)", Query("log_messages", text)),
+        ("edit_message", ApiClient.message_query("0", embedded=True)),
+        ("edit_message (log_messages)", ApiClient.message_query("0")),
+        ("load_messages", ApiClient.messages_query(["0"], limit=5)),
+        ("migrate_log_messages", ApiClient.unmigrated_logs_query(guild_id)),
+        ("archive_logs", LogArchive.archive_query(guild_id, "0", ["0"])),
+        ("export", export_query({"guild_id": str(guild_id), "open": False})),
+        ("links.get", MessageLinks.lookup_query(0)),
+        ("links.get_many", MessageLinks.threads_query([0])),
+        ("links.last_reply", MessageLinks.last_reply_query(0)),
+        ("get_user_stats", ApiClient.user_stats_query(guild_id, "0")),
+        ("rollups", Analytics.period_query(guild_id, "0")),
+        ("stats backfill (archived)", Analytics.archived_query(guild_id)),
+        ("get_config", ApiClient.config_query(bot_id)),
+        ("attachments.gridfs", GridFSAttachmentStore.hash_query("0")),
+        ("blocks.load", BlockStore.active_query(bot_id, datetime.utcnow())),
+        ("blocks.page", BlockStore.page_query(bot_id, datetime.utcnow(), 1, 10)),
+    ]
+    for name in ("closures", "subscriptions", "notification_squads"):
+        queries.append((name, RecordMap.entry_query(name, bot_id, "0")))
+        queries.append((f"{name}.load", RecordMap.entries_query(name, bot_id)))
+    return queries
+
+
+def _covers(index: Index, query_filter: dict, sort: list) -> bool:
+    fields = index.fields
+    if fields[0][1] == TEXT:
+        return "$text" in query_filter and not sort
+    names = [name for name, _ in fields]
+
+    # The leading keys of the index matched by the filter.
+    prefix = 0
+    while prefix < len(names) and names[prefix] in query_filter:
+        prefix += 1
+
+    if not sort:
+        return prefix > 0
+    # The sort must follow the matched keys, in the order of the index
+    # or in the exact opposite order.
+    for start in range(prefix + 1):
+        keys = fields[start : start + len(sort)]
+        if [name for name, _ in keys] != [name for name, _ in sort]:
+            continue
+        directions = {key[1] == order for key, order in zip(keys, sort)}
+        if len(directions) == 1:
+            return True
+    return False
+
+
+def is_indexed(query: Query, indexes: typing.Iterable[Index] = INDEXES) -> bool:
+    """
+    Whether `query` can be answered from one of `indexes`, without
+    scanning the collection or sorting in memory.
+
+    This only looks at field names, `explain_queries` checks the plans
+    the database actually picks.
+    """
+    indexes = [
+        Index(query.collection, "_id"),
+        *(index for index in indexes if index.collection == query.collection),
+    ]
+    query_filter = query.filter
+    if "$or" in query_filter:
+        rest = {k: v for k, v in query_filter.items() if k != "$or"}
+        if not any(_covers(index, rest, query.sort) for index in indexes):
+            return all(
+                is_indexed(Query(query.collection, {**rest, **branch}), indexes)
+                for branch in query_filter["$or"]
+            )
+    if "$text" in query_filter:
+        # Text searches are sorted in memory, they are bounded by the search.
+        return any(_covers(index, query_filter, []) for index in indexes)
+    return any(_covers(index, query_filter, query.sort) for index in indexes)
+
+
+def unindexed_queries(indexes: typing.Iterable[Index] = INDEXES) -> typing.List[str]:
+    """The names of the sample queries that no index in `indexes` covers."""
+    indexes = list(indexes)
+    return [name for name, query in sample_queries() if not is_indexed(query, indexes)]
+
+
+def _stages(plan: dict) -> typing.List[str]:
+    stages = [plan["stage"]] if "stage" in plan else []
+    if "inputStage" in plan:
+        stages += _stages(plan["inputStage"])
+    for child in plan.get("inputStages", ()):
+        stages += _stages(child)
+    return stages
+
+
+async def explain_queries(bot) -> typing.List[typing.Tuple[str, typing.List[str]]]:
+    """
+    Runs `explain()` on every sample query.
+
+    Returns
+    -------
+    List[Tuple[str, List[str]]]
+        The name of each query and the stages of its winning plan.
+        Queries that scan whole collections have a "COLLSCAN" stage,
+        queries sorted in memory a "SORT" stage.
+    """
+    results = []
+    for name, query in sample_queries(bot.guild_id, bot.user.id):
+        plan = await query.find(bot.db).explain()
+        results.append((name, _stages(plan["queryPlanner"]["winningPlan"])))
+    return results
+
+
+def main() -> None:
+    """
+    Checks that every sample query is covered by an index, without a
+    database. Exits with status 1 when one isn't::
+
+        python -m core.indexes
+    """
+    missing = unindexed_queries()
+    for name in missing:
+        print(f"Not indexed: {name}")
+    if missing:
+        sys.exit(1)
+    print("Every query is indexed.")
+
+
+if __name__ == "__main__":
+    main()
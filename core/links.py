@@ -0,0 +1,225 @@
+import logging
+import typing
+from collections import OrderedDict
+
+from pymongo.errors import DuplicateKeyError
+
+from core.indexes import Query
+from core.utils import error
+
+logger = logging.getLogger("Modmail")
+
+RECIPIENT = "recipient"
+REPLY = "reply"
+ANONYMOUS = "anonymous"
+NOTE = "note"
+
+MOD_REPLIES = {REPLY, ANONYMOUS}
+
+
+class MessageLinks:
+    """
+    Links relayed messages to their mirrors.
+
+    Every record is keyed by the ID of the source message, the message
+    that was relayed, and stores:
+
+    - `dm`: the ID of the message on the recipient's side.
+    - `thread`: the ID of the message in the thread channel.
+    - `channel_id`: the ID of the thread channel.
+    - `kind`: how the message was relayed, one of `RECIPIENT`,
+      `REPLY`, `ANONYMOUS` or `NOTE`.
+
+    For messages sent by the recipient, `dm` is the source message itself.
+
+    Records are stored in the `message_links` collection, recently used
+    records are also kept in an LRU cache addressed by any of their IDs.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    max_size : int, optional
+        The maximum number of records kept in memory.
+        Defaults to 2000.
+    """
+
+    def __init__(self, bot, max_size: int = 2000):
+        self.bot = bot
+        self.max_size = max_size
+        self._records: typing.Dict[int, dict] = OrderedDict()
+        self._cache: typing.Dict[int, dict] = {}
+        # Records with writes in flight, and those removed meanwhile.
+        self._pending: typing.Dict[int, int] = {}
+        self._removed: typing.Set[int] = set()
+
+    @property
+    def collection(self):
+        return self.bot.db.message_links
+
+    @staticmethod
+    def lookup_query(message_id: int) -> Query:
+        return Query(
+            "message_links",
+            {"$or": [{"_id": message_id}, {"dm": message_id}, {"thread": message_id}]},
+        )
+
+    @staticmethod
+    def threads_query(message_ids: typing.List[int]) -> Query:
+        return Query("message_links", {"thread": {"$in": message_ids}})
+
+    @staticmethod
+    def last_reply_query(channel_id: int) -> Query:
+        return Query(
+            "message_links",
+            {"channel_id": channel_id, "kind": {"$in": list(MOD_REPLIES)}},
+            sort=[("thread", -1)],
+            limit=1,
+        )
+
+    def _remember(self, record: dict) -> None:
+        self._records[record["_id"]] = record
+        self._records.move_to_end(record["_id"])
+        for key in ("_id", "dm", "thread"):
+            if record.get(key) is not None:
+                self._cache[record[key]] = record
+
+        while len(self._records) > self.max_size:
+            _, old = self._records.popitem(last=False)
+            for key in ("_id", "dm", "thread"):
+                if self._cache.get(old.get(key)) is old:
+                    self._cache.pop(old[key], None)
+
+    def _forget(self, record: dict) -> None:
+        self._records.pop(record["_id"], None)
+        for key in ("_id", "dm", "thread"):
+            if self._cache.get(record.get(key)) is record:
+                self._cache.pop(record[key], None)
+        if record["_id"] in self._pending:
+            self._removed.add(record["_id"])
+
+    def add(
+        self,
+        source_id: int,
+        *,
+        channel_id: int,
+        kind: str,
+        dm: int = None,
+        thread: int = None,
+    ) -> dict:
+        """
+        Records a mirror of `source_id`.
+
+        The in-memory record is updated immediately,
+        the database write happens in the background.
+        """
+        fields = {"channel_id": channel_id, "kind": kind}
+        if dm is not None:
+            fields["dm"] = dm
+        if thread is not None:
+            fields["thread"] = thread
+
+        record = self._records.get(source_id)
+        if record is None:
+            record = {"_id": source_id}
+        record.update(fields)
+        self._remember(record)
+
+        self._removed.discard(source_id)
+        self._pending[source_id] = self._pending.get(source_id, 0) + 1
+        self.bot.loop.create_task(self._store(source_id, fields))
+        return record
+
+    async def _store(self, source_id: int, fields: dict) -> None:
+        query = {"_id": source_id}
+        update = {"$set": fields}
+        try:
+            if source_id in self._removed:
+                return
+            try:
+                await self.collection.update_one(query, update, upsert=True)
+            except DuplicateKeyError:
+                # Both mirrors of a message were upserted at the same time.
+                await self.collection.update_one(query, update)
+            if source_id in self._removed:
+                # Removed while it was written, don't bring it back.
+                await self.collection.delete_one(query)
+        except Exception:
+            logger.error(error("Failed to store message link."), exc_info=True)
+        finally:
+            self._pending[source_id] -= 1
+            if not self._pending[source_id]:
+                del self._pending[source_id]
+                self._removed.discard(source_id)
+
+    async def get(self, message_id: int) -> typing.Optional[dict]:
+        """Finds the record of a source message or any of its mirrors."""
+        record = self._cache.get(message_id)
+        if record is not None:
+            self._records.move_to_end(record["_id"])
+            return record
+
+        record = await self.lookup_query(message_id).find_one(self.bot.db)
+        if record is not None:
+            self._remember(record)
+        return record
+
+    async def get_many(
+        self, message_ids: typing.Iterable[int]
+    ) -> typing.Dict[int, dict]:
+        """
+        Finds the records of many thread channel mirrors at once.
+
+        Returns
+        -------
+        Dict[int, dict]
+            A mapping of the thread channel message IDs
+            that could be matched to their records.
+        """
+        found = {}
+        missing = []
+        for message_id in message_ids:
+            record = self._cache.get(message_id)
+            if record is not None and record.get("thread") == message_id:
+                found[message_id] = record
+            else:
+                missing.append(message_id)
+
+        if missing:
+            async for record in self.threads_query(missing).find(self.bot.db):
+                found[record["thread"]] = record
+        return found
+
+    async def last_reply(self, channel_id: int) -> typing.Optional[dict]:
+        """Finds the latest staff reply relayed in a thread channel."""
+        # Records that are still being written are only in memory.
+        replies = [
+            record
+            for record in self._records.values()
+            if record["channel_id"] == channel_id
+            and record["kind"] in MOD_REPLIES
+            and record.get("thread") is not None
+        ]
+
+        stored = await self.last_reply_query(channel_id).find_one(self.bot.db)
+        if stored is not None:
+            replies.append(stored)
+
+        latest = max(replies, key=lambda record: record.get("thread", 0), default=None)
+        if latest is not None and latest is stored:
+            self._remember(stored)
+        return latest
+
+    async def remove(self, record: dict) -> None:
+        """Deletes a record, after its messages were deleted."""
+        self._forget(record)
+        await self.collection.delete_one({"_id": record["_id"]})
+
+    async def remove_many(self, records: typing.Iterable[dict]) -> None:
+        """Deletes many records at once."""
+        ids = []
+        for record in records:
+            self._forget(record)
+            ids.append(record["_id"])
+        if ids:
+            await self.collection.delete_many({"_id": {"$in": ids}})
@@ -0,0 +1,229 @@
+import re
+import typing
+from datetime import datetime
+
+from dateutil import parser
+from pymongo import DESCENDING
+
+from core.indexes import Query
+
+_filter_regex = re.compile(
+    r"(?:^|\s)(after|before|closer|recipient):(\S+)", re.IGNORECASE
+)
+
+
+class LogSearch:
+    """
+    A lazily fetched, sorted query over closed logs.
+
+    Logs are read from the database in chunks of `chunk_size` as pages
+    are requested, instead of loading every match up front.
+
+    Parameters
+    ----------
+    api : ApiClient
+        The API client.
+    query : dict
+        The filter, `guild_id` and `open` are added to it.
+    limit : int, optional
+        The maximum number of logs to return.
+    chunk_size : int, optional
+        How many logs are fetched per round trip.
+        Defaults to 10.
+    count : int, optional
+        The number of matching logs, if it is already known.
+    """
+
+    projection = {"messages": {"$slice": 5}}
+    sort = [("created_at", DESCENDING)]
+
+    def __init__(
+        self,
+        api,
+        query: dict,
+        limit: int = None,
+        chunk_size: int = 10,
+        count: int = None,
+    ):
+        self.api = api
+        self.query = self.build_filter(api.bot.guild_id, query)
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self._count = count
+        self._chunks: typing.Dict[int, list] = {}
+
+    @staticmethod
+    def build_filter(guild_id: typing.Union[int, str], query: dict) -> dict:
+        return {"guild_id": str(guild_id), "open": False, **query}
+
+    @staticmethod
+    def text_filter(text: str) -> dict:
+        return {"$text": {"$search": f'"{text}"'}}
+
+    @classmethod
+    def chunk_query(cls, query: dict, chunk_index: int, chunk_size: int) -> Query:
+        """The query reading the chunk at `chunk_index` of the results."""
+        return Query(
+            "logs",
+            query,
+            sort=cls.sort,
+            skip=chunk_index * chunk_size,
+            limit=chunk_size,
+        )
+
+    @classmethod
+    async def text(cls, api, text: str, filters: dict = None, limit: int = None):
+        """
+        Searches message contents, author names and log keys for `text`,
+        in both log layouts.
+        """
+        query = {**(filters or {}), **cls.text_filter(text)}
+        if api.separate_log_messages:
+            return SplitTextSearch(api, query, text, limit=limit)
+        return cls(api, query, limit=limit)
+
+    async def count(self) -> int:
+        """The number of matching logs, up to `limit`."""
+        if self._count is None:
+            options = {} if self.limit is None else {"limit": self.limit}
+            self._count = await self.api.logs.count_documents(self.query, **options)
+        return self._count
+
+    async def get(self, index: int) -> typing.Optional[dict]:
+        """Gets the log at `index`, fetching its chunk if needed."""
+        if index < 0 or index >= await self.count():
+            return None
+
+        chunk_index, offset = divmod(index, self.chunk_size)
+        chunk = self._chunks.get(chunk_index)
+        if chunk is None:
+            chunk = await self._fetch_chunk(chunk_index)
+            await self.api.load_messages(chunk, limit=5)
+            self._chunks[chunk_index] = chunk
+
+        if offset < len(chunk):
+            return chunk[offset]
+        return None
+
+    async def _fetch_chunk(self, chunk_index: int) -> list:
+        query = self.chunk_query(self.query, chunk_index, self.chunk_size)
+        chunk = []
+        async for log in query.find(self.api.db, self.projection):
+            chunk.append(log)
+        return chunk
+
+
+class SplitTextSearch(LogSearch):
+    """
+    A text search when log messages are stored in `log_messages`.
+
+    Logs with every message embedded, and logs whose key matches, are
+    found in `logs`. Logs too large to keep a copy of every message are
+    found from their messages in `log_messages`, and joined with their
+    log by the database. Both are read only up to the page being viewed
+    and merged by creation date.
+
+    Parameters
+    ----------
+    api : ApiClient
+        The API client.
+    query : dict
+        The filter, with the `$text` search.
+    text : str
+        The searched text.
+    limit : int, optional
+        The maximum number of logs to return.
+    chunk_size : int, optional
+        How many logs are fetched per round trip.
+        Defaults to 10.
+    """
+
+    def __init__(
+        self, api, query: dict, text: str, limit: int = None, chunk_size: int = 10
+    ):
+        super().__init__(api, query, limit=limit, chunk_size=chunk_size)
+        self.pipeline = self.messages_pipeline(self.query, text)
+        self.query["$or"] = [
+            {"messages_truncated": {"$ne": True}},
+            {"messages_collection": {"$ne": True}},
+            {"key": text.strip().lower()},
+        ]
+
+    @classmethod
+    def messages_pipeline(cls, query: dict, text: str) -> list:
+        """The aggregation on `log_messages` finding the logs matching `query`."""
+        filters = {k: v for k, v in query.items() if k != "$text"}
+        return [
+            {"$match": cls.text_filter(text)},
+            {"$group": {"_id": "$log_key"}},
+            {
+                "$lookup": {
+                    "from": "logs",
+                    "localField": "_id",
+                    "foreignField": "key",
+                    "as": "log",
+                }
+            },
+            {"$unwind": "$log"},
+            {"$replaceRoot": {"newRoot": "$log"}},
+            # Other logs, and logs whose key matches, are found in `logs`.
+            {
+                "$match": {
+                    **filters,
+                    "messages_truncated": True,
+                    "key": {"$ne": text.strip().lower()},
+                }
+            },
+        ]
+
+    async def count(self) -> int:
+        if self._count is None:
+            count = await self.api.logs.count_documents(self.query)
+            pipeline = self.pipeline + [{"$count": "count"}]
+            async for result in self.api.log_messages.aggregate(pipeline):
+                count += result["count"]
+            self._count = count if self.limit is None else min(count, self.limit)
+        return self._count
+
+    async def _fetch_chunk(self, chunk_index: int) -> list:
+        # Either source may hold every log up to the end of the chunk.
+        end = (chunk_index + 1) * self.chunk_size
+        query = self.chunk_query(self.query, 0, end)
+        logs = []
+        async for log in query.find(self.api.db, self.projection):
+            logs.append(log)
+
+        pipeline = self.pipeline + [{"$sort": dict(self.sort)}, {"$limit": end}]
+        async for log in self.api.log_messages.aggregate(pipeline):
+            logs.append(log)
+
+        logs.sort(key=lambda log: log["created_at"], reverse=True)
+        return logs[chunk_index * self.chunk_size : end]
+
+
+def parse_filters(text: str) -> typing.Tuple[dict, str]:
+    """
+    Extracts `after:<date>`, `before:<date>`, `closer:<id>` and
+    `recipient:<id>` filters from a search query.
+
+    Returns
+    -------
+    Tuple[dict, str]
+        The filters as a MongoDB query, and the rest of the text.
+
+    Raises
+    ------
+    ValueError
+        A date could not be parsed.
+    """
+    query = {}
+    for name, value in _filter_regex.findall(text):
+        name = name.lower()
+        if name in ("closer", "recipient"):
+            query[f"{name}.id"] = value.strip("<@!>")
+        else:
+            # created_at is stored as str(datetime), which sorts by time.
+            date = str(parser.parse(value, default=datetime(2000, 1, 1)))
+            created_at = query.setdefault("created_at", {})
+            created_at["$gte" if name == "after" else "$lt"] = date
+    return query, _filter_regex.sub("", text).strip()
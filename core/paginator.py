@@ -1,14 +1,133 @@
 import typing
 import asyncio
+from collections import OrderedDict
 
 from discord import User, Reaction, Message, Embed
 from discord import HTTPException, InvalidArgument
 from discord.ext import commands
 
 
+class PageSource:
+    """
+    Provides the pages of a paginator session, built when they are shown.
+
+    Subclasses implement `page_count` and `format_page`.
+    Recently shown pages are cached.
+
+    Parameters
+    ----------
+    cache_size : int, optional
+        How many formatted pages to keep.
+        Defaults to 5.
+    edit_footer : bool, optional
+        Whether to add the page number to the footer of `Embed` pages.
+        Defaults to `True`.
+    """
+
+    def __init__(self, cache_size: int = 5, edit_footer: bool = True):
+        self.cache_size = cache_size
+        self.edit_footer = edit_footer
+        self._cache = OrderedDict()
+
+    async def page_count(self) -> int:
+        """The number of pages."""
+        raise NotImplementedError
+
+    async def format_page(self, index: int) -> typing.Union[Embed, str]:
+        """Builds a new page, every time it is called."""
+        raise NotImplementedError
+
+    async def get_page(self, index: int) -> typing.Union[Embed, str]:
+        """
+        Gets a page, from the cache if possible.
+
+        Parameters
+        ----------
+        index : int
+            The index of the page.
+        """
+        page = self._cache.get(index)
+        if page is not None:
+            self._cache.move_to_end(index)
+            return page
+
+        page = await self.format_page(index)
+        page_count = await self.page_count()
+        if self.edit_footer and isinstance(page, Embed) and page_count > 1:
+            footer_text = f"Page {index + 1} of {page_count}"
+            if page.footer.text:
+                footer_text = footer_text + " • " + page.footer.text
+            page.set_footer(text=footer_text, icon_url=page.footer.icon_url)
+
+        if self.cache_size > 0:
+            self._cache[index] = page
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return page
+
+
+class ListPageSource(PageSource):
+    """
+    A `PageSource` over pages that were already built.
+
+    Pages may be appended to `pages` while the session runs, the page
+    numbers are added to a copy of each page when it is shown.
+
+    Parameters
+    ----------
+    pages : List[Union[Embed, str]]
+        The pages.
+    edit_footer : bool, optional
+        Whether to add the page number to the footer of `Embed` pages.
+        Defaults to `True`.
+    """
+
+    def __init__(self, pages: list, edit_footer: bool = True):
+        super().__init__(cache_size=0, edit_footer=edit_footer)
+        self.pages = pages
+
+    async def page_count(self) -> int:
+        return len(self.pages)
+
+    async def format_page(self, index: int) -> typing.Union[Embed, str]:
+        page = self.pages[index]
+        return page.copy() if isinstance(page, Embed) else page
+
+
+class FunctionPageSource(PageSource):
+    """
+    A `PageSource` that builds pages with a coroutine function.
+
+    Parameters
+    ----------
+    page_count : int
+        The number of pages.
+    page_factory : Callable[[int], Awaitable[Union[Embed, str]]]
+        Coroutine function that builds the page at an index.
+    **options
+        Passed to `PageSource`.
+    """
+
+    def __init__(
+        self,
+        page_count: int,
+        page_factory: typing.Callable[[int], typing.Awaitable],
+        **options,
+    ):
+        super().__init__(**options)
+        self._page_count = page_count
+        self.page_factory = page_factory
+
+    async def page_count(self) -> int:
+        return self._page_count
+
+    async def format_page(self, index: int) -> typing.Union[Embed, str]:
+        return await self.page_factory(index)
+
+
 class PaginatorSession:
     """
-    Class that interactively paginates a list of `Embed`.
+    Class that interactively paginates `Embed` pages.
 
     Parameters
     ----------
@@ -18,6 +137,8 @@ class PaginatorSession:
         How long to wait for before the session closes.
     embeds : List[Embed]
         A list of entries to paginate.
+    source : PageSource, optional
+        Where to get the pages from, instead of `embeds`.
     edit_footer : bool, optional
         Whether to set the footer.
         Defaults to `True`.
@@ -30,6 +151,8 @@ class PaginatorSession:
         How long to wait for before the session closes.
     embeds : List[Embed]
         A list of entries to paginate.
+    source : PageSource
+        Where the pages come from.
     running : bool
         Whether the paginate session is running.
     base : Message
@@ -41,7 +164,13 @@ class PaginatorSession:
 
     """
 
-    def __init__(self, ctx: commands.Context, *embeds, **options):
+    def __init__(
+        self,
+        ctx: commands.Context,
+        *embeds,
+        source: typing.Optional[PageSource] = None,
+        **options,
+    ):
         self.ctx = ctx
         self.timeout: int = options.get("timeout", 210)
         self.embeds: typing.List[Embed] = list(embeds)
@@ -56,13 +185,13 @@ class PaginatorSession:
             "⏭": self.last_page,
             "🛑": self.close,
         }
+        self._reactions_task = None
 
-        if options.get("edit_footer", True) and len(self.embeds) > 1:
-            for i, embed in enumerate(self.embeds):
-                footer_text = f"Page {i + 1} of {len(self.embeds)}"
-                if embed.footer.text:
-                    footer_text = footer_text + " • " + embed.footer.text
-                embed.set_footer(text=footer_text, icon_url=embed.footer.icon_url)
+        if source is None:
+            source = ListPageSource(
+                self.embeds, edit_footer=options.get("edit_footer", True)
+            )
+        self.source = source
 
     def add_page(self, embed: Embed) -> None:
         """
@@ -78,26 +207,45 @@ class PaginatorSession:
         else:
             raise TypeError("Page must be an Embed object.")
 
-    async def create_base(self, embed: Embed) -> None:
+    async def send_page(self, page) -> Message:
+        return await self.destination.send(embed=page)
+
+    async def edit_page(self, page) -> None:
+        await self.base.edit(embed=page)
+
+    async def create_base(self, page) -> None:
         """
         Create a base `Message`.
 
         Parameters
         ----------
-        embed : Embed
-            The `Embed` to fill the base `Message`.
+        page : Embed
+            The page to fill the base `Message`.
         """
-        self.base = await self.destination.send(embed=embed)
+        self.base = await self.send_page(page)
 
-        if len(self.embeds) == 1:
+        page_count = await self.source.page_count()
+        if page_count <= 1:
             self.running = False
             return
 
         self.running = True
+        # Reactions are added in the background, so the
+        # session responds while they are still being added.
+        self._reactions_task = self.ctx.bot.loop.create_task(
+            self.add_reactions(page_count)
+        )
+
+    async def add_reactions(self, page_count: int) -> None:
         for reaction in self.reaction_map:
-            if len(self.embeds) == 2 and reaction in "⏮⏭":
+            if page_count == 2 and reaction in "⏮⏭":
                 continue
-            await self.base.add_reaction(reaction)
+            if not self.running:
+                return
+            try:
+                await self.base.add_reaction(reaction)
+            except HTTPException:
+                return
 
     async def show_page(self, index: int) -> None:
         """
@@ -108,14 +256,14 @@ class PaginatorSession:
         index : int
             The index of the page.
         """
-        if not 0 <= index < len(self.embeds):
+        if not 0 <= index < await self.source.page_count():
             return
 
         self.current = index
-        page = self.embeds[index]
+        page = await self.source.get_page(index)
 
         if self.running:
-            await self.base.edit(embed=page)
+            await self.edit_page(page)
         else:
             await self.create_base(page)
 
@@ -193,6 +341,8 @@ class PaginatorSession:
             If `delete` is `True`.
         """
         self.running = False
+        if self._reactions_task is not None:
+            self._reactions_task.cancel()
 
         self.ctx.bot.loop.create_task(self.ctx.message.add_reaction("✅"))
 
@@ -214,37 +364,46 @@ class PaginatorSession:
         """
         Go to the last page.
         """
-        await self.show_page(len(self.embeds) - 1)
+        await self.show_page(await self.source.page_count() - 1)
 
 
-class MessagePaginatorSession:
+class MessagePaginatorSession(PaginatorSession):
+    """
+    Class that interactively paginates text pages, shown
+    together with an optional `Embed`.
 
-    # TODO: Subclass MessagePaginatorSession from PaginatorSession
+    Parameters
+    ----------
+    ctx : Context
+        The context of the command.
+    messages : List[str]
+        A list of entries to paginate.
+    embed : Embed, optional
+        The `Embed` shown under every page, its footer shows the page number.
+    source : PageSource, optional
+        Where to get the pages from, instead of `messages`.
+    """
 
     def __init__(
-        self, ctx: commands.Context, *messages, embed: Embed = None, **options
+        self,
+        ctx: commands.Context,
+        *messages,
+        embed: Embed = None,
+        source: typing.Optional[PageSource] = None,
+        **options,
     ):
-        self.ctx = ctx
-        self.timeout: int = options.get("timeout", 180)
+        options.setdefault("timeout", 180)
         self.messages: typing.List[str] = list(messages)
+        if source is None:
+            source = ListPageSource(self.messages, edit_footer=False)
+        super().__init__(ctx, source=source, **options)
 
-        self.running = False
-        self.base: Message = None
         self.embed = embed
         if embed is not None:
             self.footer_text = self.embed.footer.text
         else:
             self.footer_text = None
 
-        self.current = 0
-        self.reaction_map = {
-            "⏮": self.first_page,
-            "◀": self.previous_page,
-            "▶": self.next_page,
-            "⏭": self.last_page,
-            "🛑": self.close,
-        }
-
     def add_page(self, msg: str) -> None:
         """
         Add a message page.
@@ -259,152 +418,18 @@ class MessagePaginatorSession:
         else:
             raise TypeError("Page must be a str object.")
 
-    async def create_base(self, msg: str) -> None:
-        """
-        Create a base `Message`.
-
-        Parameters
-        ----------
-        msg : str
-            The message content to fill the base `Message`.
-        """
-        if self.embed is not None:
-            footer_text = f"Page {self.current+1} of {len(self.messages)}"
-            if self.footer_text:
-                footer_text = footer_text + " • " + self.footer_text
-            self.embed.set_footer(text=footer_text, icon_url=self.embed.footer.icon_url)
-
-        self.base = await self.ctx.send(content=msg, embed=self.embed)
-
-        if len(self.messages) == 1:
-            self.running = False
-            return
-
-        self.running = True
-        for reaction in self.reaction_map:
-            if len(self.messages) == 2 and reaction in "⏮⏭":
-                continue
-            await self.base.add_reaction(reaction)
-
-    async def show_page(self, index: int) -> None:
-        """
-        Show a page by page number.
-
-        Parameters
-        ----------
-        index : int
-            The index of the page.
-        """
-        if not 0 <= index < len(self.messages):
-            return
-
-        self.current = index
-        page = self.messages[index]
-
+    async def _update_footer(self) -> None:
         if self.embed is not None:
-            footer_text = f"Page {self.current + 1} of {len(self.messages)}"
+            page_count = await self.source.page_count()
+            footer_text = f"Page {self.current + 1} of {page_count}"
             if self.footer_text:
                 footer_text = footer_text + " • " + self.footer_text
             self.embed.set_footer(text=footer_text, icon_url=self.embed.footer.icon_url)
 
-        if self.running:
-            await self.base.edit(content=page, embed=self.embed)
-        else:
-            await self.create_base(page)
-
-    def react_check(self, reaction: Reaction, user: User) -> bool:
-        """
-
-        Parameters
-        ----------
-        reaction : Reaction
-            The `Reaction` object of the reaction.
-        user : User
-            The `User` or `Member` object of who sent the reaction.
-
-        Returns
-        -------
-        bool
-        """
-        return (
-            reaction.message.id == self.base.id
-            and user.id == self.ctx.author.id
-            and reaction.emoji in self.reaction_map.keys()
-        )
-
-    async def run(self) -> typing.Optional[Message]:
-        """
-        Starts the pagination session.
+    async def send_page(self, page) -> Message:
+        await self._update_footer()
+        return await self.destination.send(content=page, embed=self.embed)
 
-        Returns
-        -------
-        Optional[Message]
-            If it's closed before running ends.
-        """
-        if not self.running:
-            await self.show_page(self.current)
-        while self.running:
-            try:
-                reaction, user = await self.ctx.bot.wait_for(
-                    "reaction_add", check=self.react_check, timeout=self.timeout
-                )
-            except asyncio.TimeoutError:
-                return await self.close(delete=False)
-            else:
-                action = self.reaction_map.get(reaction.emoji)
-                await action()
-            try:
-                await self.base.remove_reaction(reaction, user)
-            except (HTTPException, InvalidArgument):
-                pass
-
-    async def previous_page(self) -> None:
-        """
-        Go to the previous page.
-        """
-        await self.show_page(self.current - 1)
-
-    async def next_page(self) -> None:
-        """
-        Go to the next page.
-        """
-        await self.show_page(self.current + 1)
-
-    async def close(self, delete: bool = True) -> typing.Optional[Message]:
-        """
-        Closes the pagination session.
-
-        Parameters
-        ----------
-        delete : bool, optional
-            Whether or delete the message upon closure.
-            Defaults to `True`.
-
-        Returns
-        -------
-        Optional[Message]
-            If `delete` is `True`.
-        """
-        self.running = False
-
-        self.ctx.bot.loop.create_task(self.ctx.message.add_reaction("✅"))
-
-        if delete:
-            return await self.base.delete()
-
-        try:
-            await self.base.clear_reactions()
-        except HTTPException:
-            pass
-
-    async def first_page(self) -> None:
-        """
-        Go to the first page.
-        """
-        await self.show_page(0)
-
-    async def last_page(self) -> None:
-        """
-        Go to the last page.
-        """
-        await self.show_page(len(self.messages) - 1)
+    async def edit_page(self, page) -> None:
+        await self._update_footer()
+        await self.base.edit(content=page, embed=self.embed)
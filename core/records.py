@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import typing
+from contextlib import contextmanager
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from core.indexes import Query
+from core.utils import error, info
+
+logger = logging.getLogger("Modmail")
+
+_missing = object()
+
+
+async def watch_collection(
+    bot,
+    collection,
+    on_change: typing.Callable[[dict], None],
+    reload: typing.Callable[[], typing.Awaitable[None]],
+    poll_interval: float = 30,
+) -> None:
+    """
+    Applies the changes other processes make to the documents of the
+    bot in `collection`, until the bot closes.
+
+    Each change is passed to `on_change`, read from a change stream
+    like the config's. Change streams need a replica set, without one
+    `reload` is awaited every `poll_interval` seconds instead.
+    """
+    # Deleted documents are only known by their _id.
+    pipeline = [
+        {
+            "$match": {
+                "$or": [
+                    {"fullDocument.bot_id": bot.user.id},
+                    {"operationType": "delete"},
+                ]
+            }
+        }
+    ]
+    try:
+        async with collection.watch(pipeline, full_document="updateLookup") as stream:
+            async for change in stream:
+                on_change(change)
+    except PyMongoError as exc:
+        logger.info(
+            info(
+                f"Polling for {collection.name} changes, "
+                f"change streams failed: {exc}."
+            )
+        )
+
+    while not bot.is_closed():
+        await asyncio.sleep(poll_interval)
+        try:
+            await reload()
+        except Exception:
+            logger.error(error(f"Failed to reload {collection.name}."), exc_info=True)
+
+
+class RecordMap:
+    """
+    A map of keys to values stored in its own collection, one document
+    per entry, like `{"bot_id": ..., "key": ..., "value": ...}`.
+
+    Every entry is loaded into memory by `load`, reads are served from
+    there. Changes update the memory copy, then write only the changed
+    document. `watch` applies the changes made by other processes.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    name : str
+        The name of the collection.
+    """
+
+    def __init__(self, bot, name: str):
+        self.bot = bot
+        self.name = name
+        self._cache: typing.Dict[str, typing.Any] = {}
+        # _id -> key, to know which entry a deleted document held.
+        self._keys: typing.Dict[typing.Any, str] = {}
+        # The writes made here that are in flight, and that are done.
+        self._pending = 0
+        self._writes = 0
+
+    def __repr__(self):
+        return f"<RecordMap name={self.name!r} entries={len(self._cache)}>"
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._cache
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @property
+    def collection(self):
+        return self.bot.db[self.name]
+
+    @staticmethod
+    def entries_query(name: str, bot_id: int) -> Query:
+        return Query(name, {"bot_id": bot_id})
+
+    @staticmethod
+    def entry_query(name: str, bot_id: int, key: str) -> Query:
+        return Query(name, {"bot_id": bot_id, "key": key})
+
+    def _query(self, key: str) -> dict:
+        return self.entry_query(self.name, self.bot.user.id, key).filter
+
+    def get(self, key: str, default: typing.Any = None) -> typing.Any:
+        return self._cache.get(key, default)
+
+    def items(self) -> typing.ItemsView[str, typing.Any]:
+        return self._cache.items()
+
+    def copy(self) -> dict:
+        return self._cache.copy()
+
+    @contextmanager
+    def _writing(self):
+        self._pending += 1
+        try:
+            yield
+        finally:
+            self._pending -= 1
+            self._writes += 1
+
+    async def load(self) -> None:
+        """Reads every entry of the bot from the database."""
+        query = self.entries_query(self.name, self.bot.user.id)
+        while True:
+            writes = self._writes
+            docs = await query.find(self.bot.db).to_list(None)
+            # Read again if a change made here may be missing.
+            if not self._pending and writes == self._writes:
+                break
+        self._cache = {doc["key"]: doc["value"] for doc in docs}
+        self._keys = {doc["_id"]: doc["key"] for doc in docs}
+
+    def _apply_change(self, change: dict) -> None:
+        if change["operationType"] == "delete":
+            key = self._keys.pop(change["documentKey"]["_id"], None)
+            if key is not None:
+                self._cache.pop(key, None)
+            return
+        doc = change.get("fullDocument")
+        if doc is None:
+            # Deleted since, the delete follows.
+            return
+        self._keys[doc["_id"]] = doc["key"]
+        self._cache[doc["key"]] = doc["value"]
+
+    async def watch(self, poll_interval: float = 30) -> None:
+        """
+        Applies the changes other processes make, until the bot closes.
+        See `watch_collection`.
+        """
+        await watch_collection(
+            self.bot, self.collection, self._apply_change, self.load, poll_interval
+        )
+
+    async def set(self, key: str, value: typing.Any) -> None:
+        with self._writing():
+            self._cache[key] = value
+            await self.collection.update_one(
+                self._query(key), {"$set": {"value": value}}, upsert=True
+            )
+
+    async def pop(self, key: str, default: typing.Any = None) -> typing.Any:
+        value = self._cache.pop(key, _missing)
+        if value is _missing:
+            return default
+        with self._writing():
+            await self.collection.delete_one(self._query(key))
+        return value
+
+    async def add(self, key: str, item: typing.Any) -> None:
+        """Adds `item` to the list stored under `key`."""
+        items = self._cache.setdefault(key, [])
+        if item in items:
+            return
+        with self._writing():
+            items.append(item)
+            await self.collection.update_one(
+                self._query(key), {"$addToSet": {"value": item}}, upsert=True
+            )
+
+    async def remove(self, key: str, item: typing.Any) -> None:
+        """Removes `item` from the list stored under `key`."""
+        items = self._cache.get(key)
+        if not items or item not in items:
+            return
+        if len(items) == 1:
+            await self.pop(key)
+            return
+        with self._writing():
+            items.remove(item)
+            await self.collection.update_one(
+                self._query(key), {"$pull": {"value": item}}
+            )
+
+    async def migrate(self, old: dict, batch_size: int = 500) -> int:
+        """
+        Writes the entries of `old`, the map as it was stored in the
+        config, in bulk writes of `batch_size` entries. Existing entries
+        are kept.
+
+        Returns
+        -------
+        int
+            The number of entries written.
+        """
+        updates = [
+            UpdateOne(self._query(key), {"$setOnInsert": {"value": value}}, upsert=True)
+            for key, value in old.items()
+        ]
+        for i in range(0, len(updates), batch_size):
+            await self.collection.bulk_write(updates[i : i + batch_size], ordered=False)
+        return len(updates)
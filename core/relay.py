@@ -0,0 +1,211 @@
+import re
+import typing
+
+import discord
+
+from core import links
+from core.utils import is_image_url
+
+URL_REGEX = re.compile(
+    r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"
+)
+
+SYSTEM_AVATAR_URL = "https://discordapp.com/assets/f78426a064bc9dd24847519259bc42af.png"
+
+
+class RelaySettings:
+    """
+    The configuration used to render relayed messages, parsed once.
+
+    Attributes
+    ----------
+    key : tuple
+        The config snapshot and guild icon these settings were compiled
+        from.
+    mod_tag : Optional[str]
+        The footer of staff replies, `None` to use the top role of the author.
+    anon_username : Optional[str]
+        The name shown on anonymous replies, `None` to use the mod tag.
+    anon_avatar_url : str
+        The avatar shown on anonymous replies.
+    anon_tag : str
+        The footer of anonymous replies.
+    mod_color : Union[Color, int]
+        The colour of staff replies.
+    recipient_color : Union[Color, int]
+        The colour of recipient messages.
+    """
+
+    __slots__ = (
+        "key",
+        "mod_tag",
+        "anon_username",
+        "anon_avatar_url",
+        "anon_tag",
+        "mod_color",
+        "recipient_color",
+    )
+
+    def __init__(
+        self,
+        key,
+        *,
+        mod_tag,
+        anon_username,
+        anon_avatar_url,
+        anon_tag,
+        mod_color,
+        recipient_color,
+    ):
+        self.key = key
+        self.mod_tag = mod_tag
+        self.anon_username = anon_username
+        self.anon_avatar_url = anon_avatar_url
+        self.anon_tag = anon_tag
+        self.mod_color = mod_color
+        self.recipient_color = recipient_color
+
+    @staticmethod
+    def config_key(bot) -> tuple:
+        # The snapshot is replaced whenever the config changes.
+        return (bot.config.snapshot, bot.guild.icon if bot.guild is not None else None)
+
+    @classmethod
+    def compile(cls, bot) -> "RelaySettings":
+        config = bot.config
+        return cls(
+            cls.config_key(bot),
+            mod_tag=config.get("mod_tag"),
+            anon_username=config.get("anon_username"),
+            anon_avatar_url=config.get(
+                "anon_avatar_url", bot.guild.icon_url if bot.guild is not None else ""
+            ),
+            anon_tag=config.get("anon_tag", "Response"),
+            mod_color=config.snapshot.mod_color,
+            recipient_color=config.snapshot.recipient_color,
+        )
+
+    def is_current(self, bot) -> bool:
+        return self.key == self.config_key(bot)
+
+
+class RelayRenderer:
+    """
+    Builds the embeds of relayed messages.
+
+    The settings are compiled from the config the first time they are
+    needed and again only after the config they depend on changed.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._settings: typing.Optional[RelaySettings] = None
+
+    @property
+    def settings(self) -> RelaySettings:
+        if self._settings is None or not self._settings.is_current(self.bot):
+            self._settings = RelaySettings.compile(self.bot)
+        return self._settings
+
+    def render(
+        self, message: discord.Message, mode: str, *, to_recipient: bool = False
+    ) -> typing.Tuple[discord.Embed, typing.List[discord.Embed]]:
+        """
+        Renders a message that is being relayed.
+
+        Parameters
+        ----------
+        message : Message
+            The message being relayed.
+        mode : str
+            How the message is relayed, one of `links.RECIPIENT`,
+            `links.REPLY`, `links.ANONYMOUS` or `links.NOTE`.
+        to_recipient : bool, optional
+            Whether the message is sent to the recipient
+            instead of the thread channel.
+
+        Returns
+        -------
+        Tuple[Embed, List[Embed]]
+            The message embed, and one embed per additional image upload.
+        """
+        settings = self.settings
+        author = message.author
+        from_mod = mode in links.MOD_REPLIES
+
+        embed = discord.Embed(description=message.content, timestamp=message.created_at)
+
+        if mode == links.NOTE:
+            color = discord.Color.blurple()
+            embed.set_author(
+                name=f"Note ({author.name})",
+                icon_url=SYSTEM_AVATAR_URL,
+                url=message.jump_url,
+            )
+        else:
+            color = settings.mod_color if from_mod else settings.recipient_color
+            if mode == links.ANONYMOUS and to_recipient:
+                # Anonymously sending to the user.
+                name = (
+                    settings.anon_username or settings.mod_tag or str(author.top_role)
+                )
+                embed.set_author(
+                    name=name, icon_url=settings.anon_avatar_url, url=message.jump_url
+                )
+            else:
+                embed.set_author(
+                    name=str(author), icon_url=author.avatar_url, url=message.jump_url
+                )
+
+        images = []
+        files = []
+        for attachment in message.attachments:
+            item = (attachment.url, attachment.filename)
+            (images if is_image_url(attachment.url) else files).append(item)
+
+        images.extend(
+            (link, None)
+            for link in URL_REGEX.findall(message.content)
+            if is_image_url(link)
+        )
+
+        prioritize_uploads = any(filename is not None for _, filename in images)
+        embedded_image = False
+        additional = []
+
+        for url, filename in images:
+            if not prioritize_uploads or (not embedded_image and filename):
+                embed.set_image(url=url)
+                if filename:
+                    embed.add_field(name="Image", value=f"[{filename}]({url})")
+                embedded_image = True
+            elif filename is not None:
+                img_embed = discord.Embed(
+                    color=color, title=filename, url=url, timestamp=message.created_at
+                )
+                img_embed.set_image(url=url)
+                img_embed.set_footer(
+                    text=f"Additional Image Upload ({len(additional) + 1})"
+                )
+                additional.append(img_embed)
+
+        for count, (url, filename) in enumerate(files, start=1):
+            embed.add_field(name=f"File upload ({count})", value=f"[{filename}]({url})")
+
+        # noinspection PyUnresolvedReferences,PyDunderSlots
+        embed.color = color  # pylint: disable=E0237
+        if mode == links.RECIPIENT:
+            embed.set_footer(text="Recipient")
+        elif mode == links.ANONYMOUS:
+            embed.set_footer(
+                text=settings.anon_tag if to_recipient else "Anonymous Reply"
+            )
+        elif mode == links.REPLY:
+            embed.set_footer(text=settings.mod_tag or str(author.top_role))
+
+        return embed, additional
@@ -8,15 +8,27 @@ from datetime import datetime, timedelta
 from types import SimpleNamespace as param
 
 import discord
-import isodate
 from discord.ext.commands import MissingRequiredArgument, CommandError
 
+from core import links
 from core.time import human_timedelta
-from core.utils import is_image_url, days, match_user_id
-from core.utils import truncate, ignore, error
+from core.utils import days, match_user_id
+from core.utils import truncate, ignore, error, info, StageTimer
 
 logger = logging.getLogger("Modmail")
 
+# What closing a thread reads back from its log: the key, the first
+# message for the sneak peek and what the statistics need.
+CLOSED_LOG_PROJECTION = {
+    "key": True,
+    "recipient.id": True,
+    "closer.id": True,
+    "closed_at": True,
+    "message_count": True,
+    "messages_collection": True,
+    "messages": {"$slice": 1},
+}
+
 
 class Thread:
     """Represents a discord Modmail thread"""
@@ -42,6 +54,7 @@ class Thread:
         self._ready_event = asyncio.Event()
         self.close_task = None
         self.auto_close_task = None
+        self._first_reply_counted = False
 
     def __repr__(self):
         return (
@@ -103,7 +116,7 @@ class Thread:
                 reason="Creating a thread channel",
             )
         except discord.HTTPException as e:  # Failed to create due to 50 channel limit.
-            del self.manager.cache[self.id]
+            self.manager.unregister(self)
             log_channel = self.bot.log_channel
 
             em = discord.Embed(color=discord.Color.red())
@@ -115,14 +128,16 @@ class Thread:
                 return await log_channel.send(embed=em)
 
         self._channel = channel
+        self.manager.register(self)
 
         try:
-            log_url, log_data = await asyncio.gather(
+            log_url, stats = await asyncio.gather(
                 self.bot.api.create_log_entry(recipient, channel, creator or recipient),
-                self.bot.api.get_user_logs(recipient.id),
+                self.bot.api.get_user_stats(recipient.id),
             )
 
-            log_count = sum(1 for log in log_data if not log["open"])
+            log_count = stats["closed_count"]
+            self.bot.loop.create_task(self.bot.analytics.thread_opened())
         except:  # Something went wrong with database?
             log_url = log_count = None
             # ensure core functionality still works
@@ -191,8 +206,13 @@ class Thread:
         delete_channel: bool = True,
         message: str = None,
         auto_close: bool = False,
-    ) -> None:
-        """Close a thread now or after a set time in seconds"""
+    ) -> typing.Optional[StageTimer]:
+        """
+        Close a thread now or after a set time in seconds
+
+        When the thread is closed now, the timings of each close stage
+        are returned.
+        """
 
         # restarts the after timer
         await self.cancel_closure(auto_close)
@@ -200,7 +220,6 @@ class Thread:
         if after > 0:
             # TODO: Add somewhere to clean up broken closures
             #  (when channel is already deleted)
-            await self.bot.config.update()
             now = datetime.utcnow()
             items = {
                 # 'initiation_time': now.isoformat(),
@@ -211,8 +230,7 @@ class Thread:
                 "message": message,
                 "auto_close": auto_close,
             }
-            self.bot.config.closures[str(self.id)] = items
-            await self.bot.config.update()
+            await self.bot.config.closures.set(str(self.id), items)
 
             task = self.bot.loop.call_later(
                 after, self._close_after, closer, silent, delete_channel, message
@@ -223,42 +241,61 @@ class Thread:
             else:
                 self.close_task = task
         else:
-            await self._close(closer, silent, delete_channel, message)
+            return await self._close(closer, silent, delete_channel, message)
 
     async def _close(
         self, closer, silent=False, delete_channel=True, message=None, scheduled=False
-    ):
-        del self.manager.cache[self.id]
+    ) -> StageTimer:
+        timer = StageTimer("Close")
+        self.manager.unregister(self)
 
+        # Cancel auto closing the thread if closed by any means.
         await self.cancel_closure(all=True)
 
-        # Cancel auto closing the thread if closed by any means.
+        tasks = [
+            timer.measure(
+                "subscriptions", self.bot.config.subscriptions.pop(str(self.id))
+            ),
+            self._post_close_log(closer, silent, message, scheduled, timer),
+        ]
+        if delete_channel:
+            tasks.append(timer.measure("delete_channel", self.channel.delete()))
 
-        if str(self.id) in self.bot.config.subscriptions:
-            del self.bot.config.subscriptions[str(self.id)]
-
-        # Logging
-        log_data = await self.bot.api.post_log(
-            self.channel.id,
-            {
-                "open": False,
-                "closed_at": str(datetime.utcnow()),
-                "close_message": message if not silent else None,
-                "closer": {
-                    "id": str(closer.id),
-                    "name": closer.name,
-                    "discriminator": closer.discriminator,
-                    "avatar_url": str(closer.avatar_url),
-                    "mod": True,
+        await asyncio.gather(*tasks)
+        logger.debug(info(str(timer)))
+        return timer
+
+    async def _post_close_log(self, closer, silent, message, scheduled, timer) -> None:
+        """Closes the log, then sends the embeds that link to it."""
+        log_data = await timer.measure(
+            "post_log",
+            self.bot.api.post_log(
+                self.channel.id,
+                {
+                    "open": False,
+                    "closed_at": str(datetime.utcnow()),
+                    "close_message": message if not silent else None,
+                    "closer": {
+                        "id": str(closer.id),
+                        "name": closer.name,
+                        "discriminator": closer.discriminator,
+                        "avatar_url": str(closer.avatar_url),
+                        "mod": True,
+                    },
                 },
-            },
+                projection=CLOSED_LOG_PROJECTION,
+            ),
         )
 
         if log_data is not None and isinstance(log_data, dict):
+            self.bot.loop.create_task(self.bot.api.record_closed_log(log_data))
+            self.bot.loop.create_task(self.bot.analytics.thread_closed(log_data))
+
             prefix = os.getenv("LOG_URL_PREFIX", "/logs")
             if prefix == "NONE":
                 prefix = ""
-            log_url = f"{self.bot.config.log_url.strip('/')}{prefix}/{log_data['key']}"
+            log_key = log_data["key"]
+            log_url = f"{self.bot.config.log_url.strip('/')}{prefix}/{log_key}"
 
             if log_data["messages"]:
                 content = str(log_data["messages"][0]["content"])
@@ -266,11 +303,11 @@ class Thread:
             else:
                 sneak_peak = "No content"
 
-            desc = f"[`{log_data['key']}`]({log_url}): "
+            desc = f"[`{log_key}`]({log_url}): "
             desc += truncate(sneak_peak, max=75 - 13)
         else:
             desc = "Could not resolve log url."
-            log_url = None
+            log_url = log_key = None
 
         embed = discord.Embed(description=desc, color=discord.Color.red())
 
@@ -291,10 +328,12 @@ class Thread:
         embed.set_footer(text=f"{event} by {_closer}")
         embed.timestamp = datetime.utcnow()
 
-        tasks = [self.bot.config.update()]
+        tasks = []
 
         try:
-            tasks.append(self.bot.log_channel.send(embed=embed))
+            tasks.append(
+                timer.measure("log_channel", self.bot.log_channel.send(embed=embed))
+            )
         except (ValueError, AttributeError):
             pass
 
@@ -317,7 +356,7 @@ class Thread:
                     "{closer.mention} has closed this Modmail thread.",
                 )
 
-        message = message.format(closer=closer, loglink=log_url, logkey=log_data["key"])
+        message = message.format(closer=closer, loglink=log_url, logkey=log_key)
 
         embed.description = message
         footer = self.bot.config.get(
@@ -326,10 +365,7 @@ class Thread:
         embed.set_footer(text=footer, icon_url=self.bot.guild.icon_url)
 
         if not silent and self.recipient is not None:
-            tasks.append(self.recipient.send(embed=embed))
-
-        if delete_channel:
-            tasks.append(self.channel.delete())
+            tasks.append(timer.measure("recipient", self.recipient.send(embed=embed)))
 
         await asyncio.gather(*tasks)
 
@@ -341,9 +377,36 @@ class Thread:
             self.auto_close_task.cancel()
             self.auto_close_task = None
 
-        to_update = self.bot.config.closures.pop(str(self.id), None)
-        if to_update is not None:
-            await self.bot.config.update()
+        await self.bot.config.closures.pop(str(self.id))
+
+    @staticmethod
+    async def _fetch_message(channel, message_id):
+        if message_id is None:
+            return None
+        try:
+            return await channel.fetch_message(message_id)
+        except discord.HTTPException:
+            return None
+
+    async def _find_linked_messages(
+        self, message_id
+    ) -> typing.Tuple[
+        typing.Optional[discord.Message], typing.Optional[discord.Message]
+    ]:
+        """Finds the recipient and thread channel mirrors of a relayed message."""
+        link = await self.bot.links.get(int(message_id))
+        if link is None:
+            # Messages relayed before links were recorded.
+            return await asyncio.gather(
+                self._find_thread_message(self.recipient, message_id),
+                self._find_thread_message(self.channel, message_id),
+            )
+
+        dm_channel = self.recipient.dm_channel or await self.recipient.create_dm()
+        return await asyncio.gather(
+            self._fetch_message(dm_channel, link.get("dm")),
+            self._fetch_message(self.channel, link.get("thread")),
+        )
 
     @staticmethod
     async def _find_thread_message(channel, message_id):
@@ -355,39 +418,12 @@ class Thread:
                 if str(message_id) == str(embed.author.url).split("/")[-1]:
                     return msg
 
-    async def _fetch_timeout(
-        self
-    ) -> typing.Union[None, isodate.duration.Duration, timedelta]:
-        """
-        This grabs the timeout value for closing threads automatically
-        from the ConfigManager and parses it for use internally.
-
-        :returns: None if no timeout is set.
-        """
-        timeout = self.bot.config.get("thread_auto_close")
-        if timeout is None:
-            return timeout
-        else:
-            try:
-                timeout = isodate.parse_duration(timeout)
-            except isodate.ISO8601Error:
-                logger.warning(
-                    "The auto_close_thread limit needs to be a "
-                    "ISO-8601 duration formatted duration string "
-                    'greater than 0 days, not "%s".',
-                    str(timeout),
-                )
-                del self.bot.config.cache["thread_auto_close"]
-                await self.bot.config.update()
-                timeout = None
-        return timeout
-
     async def _restart_close_timer(self):
         """
         This will create or restart a timer to automatically close this
         thread.
         """
-        timeout = await self._fetch_timeout()
+        timeout = self.bot.config.snapshot.thread_auto_close
 
         # Exit if timeout was not set
         if timeout is None:
@@ -419,10 +455,7 @@ class Thread:
         )
 
     async def edit_message(self, message_id: int, message: str) -> None:
-        recipient_msg, channel_msg = await asyncio.gather(
-            self._find_thread_message(self.recipient, message_id),
-            self._find_thread_message(self.channel, message_id),
-        )
+        recipient_msg, channel_msg = await self._find_linked_messages(message_id)
 
         channel_embed = channel_msg.embeds[0]
         channel_embed.description = message
@@ -437,12 +470,13 @@ class Thread:
         await asyncio.gather(*tasks)
 
     async def delete_message(self, message_id):
-        msg_recipient, msg_channel = await asyncio.gather(
-            self._find_thread_message(self.recipient, message_id),
-            self._find_thread_message(self.channel, message_id),
-        )
+        msg_recipient, msg_channel = await self._find_linked_messages(message_id)
         await asyncio.gather(msg_recipient.delete(), msg_channel.delete())
 
+        link = await self.bot.links.get(int(message_id))
+        if link is not None:
+            await self.bot.links.remove(link)
+
     async def note(self, message: discord.Message) -> None:
         if not message.content and not message.attachments:
             raise MissingRequiredArgument(param(name="msg"))
@@ -466,14 +500,23 @@ class Thread:
                 )
             )
 
+        timer = StageTimer("Reply")
+        type_ = "anonymous" if anonymous else "thread_message"
+
+        if self.bot.config.get("pipelined_relay"):
+            delivered = await self._reply_pipelined(message, anonymous, type_, timer)
+        else:
+            delivered = await self._reply_sequential(message, anonymous, type_, timer)
+
+        logger.debug(info(str(timer)))
+
+        if delivered and not self._first_reply_counted:
+            self._first_reply_counted = True
+            self.bot.loop.create_task(self.bot.analytics.first_reply(self, message))
+
         tasks = []
 
-        try:
-            await self.send(
-                message, destination=self.recipient, from_mod=True, anonymous=anonymous
-            )
-        except Exception:
-            logger.info(error("Message delivery failed:"), exc_info=True)
+        if not delivered:
             tasks.append(
                 message.channel.send(
                     embed=discord.Embed(
@@ -485,38 +528,106 @@ class Thread:
                     )
                 )
             )
-        else:
-            # Send the same thing in the thread channel.
+        elif self.close_task is not None:
+            # Cancel closing if a thread message is sent.
+            await self.cancel_closure()
             tasks.append(
+                self.channel.send(
+                    embed=discord.Embed(
+                        color=discord.Color.red(),
+                        description="Scheduled close has been cancelled.",
+                    )
+                )
+            )
+
+        await asyncio.gather(*tasks)
+
+    async def _reply_sequential(self, message, anonymous, type_, timer) -> bool:
+        try:
+            await timer.measure(
+                "recipient",
                 self.send(
                     message,
-                    destination=self.channel,
+                    destination=self.recipient,
                     from_mod=True,
                     anonymous=anonymous,
-                )
+                ),
             )
+        except Exception:
+            logger.info(error("Message delivery failed:"), exc_info=True)
+            return False
 
-            tasks.append(
-                self.bot.api.append_log(
+        # Send the same thing in the thread channel.
+        await asyncio.gather(
+            timer.measure(
+                "channel",
+                self.send(
                     message,
-                    self.channel.id,
-                    type_="anonymous" if anonymous else "thread_message",
-                )
-            )
+                    destination=self.channel,
+                    from_mod=True,
+                    anonymous=anonymous,
+                ),
+            ),
+            timer.measure(
+                "log", self.bot.api.append_log(message, self.channel.id, type_=type_)
+            ),
+        )
+        return True
 
-            # Cancel closing if a thread message is sent.
-            if self.close_task is not None:
-                await self.cancel_closure()
-                tasks.append(
-                    self.channel.send(
-                        embed=discord.Embed(
-                            color=discord.Color.red(),
-                            description="Scheduled close has been cancelled.",
-                        )
-                    )
-                )
+    async def _reply_pipelined(self, message, anonymous, type_, timer) -> bool:
+        """
+        Sends the recipient message, the thread channel mirror and the
+        log entry at once, without triggering typing first.
 
-        await asyncio.gather(*tasks)
+        If the recipient message fails, the mirror and the log entry
+        are removed again, leaving the same state as a sequential reply.
+        """
+        recipient_msg, channel_msg, _ = await asyncio.gather(
+            timer.measure(
+                "recipient",
+                self.send(
+                    message,
+                    destination=self.recipient,
+                    from_mod=True,
+                    anonymous=anonymous,
+                    trigger_typing=False,
+                    delete_source=False,
+                ),
+            ),
+            timer.measure(
+                "channel",
+                self.send(
+                    message,
+                    destination=self.channel,
+                    from_mod=True,
+                    anonymous=anonymous,
+                    trigger_typing=False,
+                    delete_source=False,
+                ),
+            ),
+            timer.measure(
+                "log", self.bot.api.append_log(message, self.channel.id, type_=type_)
+            ),
+            return_exceptions=True,
+        )
+
+        if isinstance(recipient_msg, Exception):
+            logger.info(error("Message delivery failed:"), exc_info=recipient_msg)
+            tasks = [self.bot.api.remove_log_message(self.channel.id, message.id)]
+            if isinstance(channel_msg, discord.Message):
+                tasks.append(ignore(channel_msg.delete()))
+            link = await self.bot.links.get(message.id)
+            if link is not None:
+                tasks.append(self.bot.links.remove(link))
+            await asyncio.gather(*tasks)
+            return False
+
+        if isinstance(channel_msg, Exception):
+            raise channel_msg
+
+        if not message.attachments:
+            self.bot.loop.create_task(ignore(message.delete()))
+        return True
 
     async def send(
         self,
@@ -527,7 +638,9 @@ class Thread:
         from_mod: bool = False,
         note: bool = False,
         anonymous: bool = False,
-    ) -> None:
+        trigger_typing: bool = True,
+        delete_source: bool = True,
+    ) -> discord.Message:
 
         self.bot.loop.create_task(
             self._restart_close_timer()
@@ -553,129 +666,41 @@ class Thread:
 
         destination = destination or self.channel
 
-        author = message.author
-
-        embed = discord.Embed(description=message.content, timestamp=message.created_at)
-
-        system_avatar_url = (
-            "https://discordapp.com/assets/f78426a064bc9dd24847519259bc42af.png"
-        )
-
-        if not note:
-            if (
-                anonymous
-                and from_mod
-                and not isinstance(destination, discord.TextChannel)
-            ):
-                # Anonymously sending to the user.
-                tag = self.bot.config.get("mod_tag", str(message.author.top_role))
-                name = self.bot.config.get("anon_username", tag)
-                avatar_url = self.bot.config.get(
-                    "anon_avatar_url", self.bot.guild.icon_url
-                )
-            else:
-                # Normal message
-                name = str(author)
-                avatar_url = author.avatar_url
-
-            embed.set_author(name=name, icon_url=avatar_url, url=message.jump_url)
+        if note:
+            kind = links.NOTE
+        elif not from_mod:
+            kind = links.RECIPIENT
+        elif anonymous:
+            kind = links.ANONYMOUS
         else:
-            # Special note messages
-            embed.set_author(
-                name=f"Note ({author.name})",
-                icon_url=system_avatar_url,
-                url=message.jump_url,
-            )
-
-        delete_message = not bool(message.attachments)
-
-        attachments = [(a.url, a.filename) for a in message.attachments]
-
-        images = [x for x in attachments if is_image_url(*x)]
-        attachments = [x for x in attachments if not is_image_url(*x)]
-
-        image_links = [
-            (link, None)
-            for link in re.findall(
-                r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
-                message.content,
-            )
-        ]
-
-        image_links = [x for x in image_links if is_image_url(*x)]
-        images.extend(image_links)
-
-        embedded_image = False
-
-        prioritize_uploads = any(i[1] is not None for i in images)
-
-        additional_images = []
-        additional_count = 1
-
-        for att in images:
-            if not prioritize_uploads or (
-                is_image_url(*att) and not embedded_image and att[1]
-            ):
-                embed.set_image(url=att[0])
-                if att[1]:
-                    embed.add_field(name="Image", value=f"[{att[1]}]({att[0]})")
-                embedded_image = True
-            elif att[1] is not None:
-                if note:
-                    color = discord.Color.blurple()
-                elif from_mod:
-                    color = self.bot.mod_color
-                else:
-                    color = self.bot.recipient_color
-
-                img_embed = discord.Embed(color=color)
-                img_embed.set_image(url=att[0])
-                img_embed.title = att[1]
-                img_embed.url = att[0]
-                img_embed.set_footer(
-                    text=f"Additional Image Upload ({additional_count})"
-                )
-                img_embed.timestamp = message.created_at
-                additional_images.append(destination.send(embed=img_embed))
-                additional_count += 1
+            kind = links.REPLY
 
-        file_upload_count = 1
+        to_thread = isinstance(destination, discord.TextChannel)
+        embed, image_embeds = self.bot.relay.render(
+            message, kind, to_recipient=not to_thread
+        )
+        additional_images = [destination.send(embed=e) for e in image_embeds]
 
-        for att in attachments:
-            embed.add_field(
-                name=f"File upload ({file_upload_count})", value=f"[{att[1]}]({att[0]})"
-            )
-            file_upload_count += 1
-
-        if from_mod:
-            # noinspection PyUnresolvedReferences,PyDunderSlots
-            embed.color = self.bot.mod_color  # pylint: disable=E0237
-            # Anonymous reply sent in thread channel
-            if anonymous and isinstance(destination, discord.TextChannel):
-                embed.set_footer(text="Anonymous Reply")
-            # Normal messages
-            elif not anonymous:
-                tag = self.bot.config.get("mod_tag", str(message.author.top_role))
-                embed.set_footer(text=tag)  # Normal messages
-            else:
-                embed.set_footer(text=self.bot.config.get("anon_tag", "Response"))
-        elif note:
-            # noinspection PyUnresolvedReferences,PyDunderSlots
-            embed.color = discord.Color.blurple()  # pylint: disable=E0237
-        else:
-            embed.set_footer(text=f"Recipient")
-            # noinspection PyUnresolvedReferences,PyDunderSlots
-            embed.color = self.bot.recipient_color  # pylint: disable=E0237
+        delete_message = delete_source and not message.attachments
 
-        await destination.trigger_typing()
+        if trigger_typing:
+            await destination.trigger_typing()
 
         if not from_mod and not note:
-            mentions = self.get_notifications()
+            mentions = await self.get_notifications()
         else:
             mentions = None
 
         _msg = await destination.send(mentions, embed=embed)
 
+        if to_thread:
+            mirrors = {"thread": _msg.id}
+            if kind == links.RECIPIENT:
+                mirrors["dm"] = message.id
+        else:
+            mirrors = {"dm": _msg.id}
+        self.bot.links.add(message.id, channel_id=self.channel.id, kind=kind, **mirrors)
+
         if additional_images:
             self.ready = False
             await asyncio.gather(*additional_images)
@@ -686,17 +711,13 @@ class Thread:
 
         return _msg
 
-    def get_notifications(self) -> str:
+    async def get_notifications(self) -> str:
         config = self.bot.config
         key = str(self.id)
 
         mentions = []
-        mentions.extend(config["subscriptions"].get(key, []))
-
-        if key in config["notification_squad"]:
-            mentions.extend(config["notification_squad"][key])
-            del config["notification_squad"][key]
-            self.bot.loop.create_task(config.update())
+        mentions.extend(config.subscriptions.get(key, []))
+        mentions.extend(await config.notification_squad.pop(key, []))
 
         return " ".join(mentions)
 
@@ -704,18 +725,115 @@ class Thread:
 class ThreadManager:
     """Class that handles storing, finding and creating Modmail threads."""
 
-    def __init__(self, bot):
+    def __init__(self, bot, populate_timeout: float = 60):
         self.bot = bot
         self.cache = {}
+        self.channel_index = {}
+        # How long incoming DMs wait for the cache before going ahead.
+        self.populate_timeout = populate_timeout
+        self._populated = asyncio.Event()
 
-    async def populate_cache(self) -> None:
-        for channel in self.bot.modmail_guild.text_channels:
-            if (
-                channel.category != self.bot.main_category
-                and not self.bot.using_multiple_server_setup
-            ):
-                continue
-            await self.find(channel=channel)
+    async def populate_cache(self, concurrency: int = 5) -> None:
+        """
+        Warms up the thread cache.
+
+        Open logs in the database seed the cache, only channels that
+        disagree with the database are checked against Discord, with at
+        most `concurrency` history fetches running at once.
+        """
+        try:
+            try:
+                open_logs = await self.bot.api.get_open_logs()
+            except Exception:
+                logger.warning(
+                    error("Failed to fetch open logs, falling back to channel topics."),
+                    exc_info=True,
+                )
+                open_logs = []
+
+            seeded = {}
+            for log in open_logs:
+                try:
+                    seeded[int(log["channel_id"])] = int(log["recipient"]["id"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+            to_check = []
+            for channel in self.bot.modmail_guild.text_channels:
+                user_id = seeded.pop(channel.id, None)
+                topic_id = match_user_id(channel.topic) if channel.topic else -1
+
+                if topic_id != -1:
+                    # Threads moved out of the main category are still indexed by topic.
+                    if user_id is not None and user_id != topic_id:
+                        logger.warning(
+                            error(
+                                f"Channel {channel.id} belongs to {topic_id}, "
+                                f"but its open log belongs to {user_id}."
+                            )
+                        )
+                    if topic_id not in self.cache:
+                        self._add_from_channel(topic_id, channel)
+                elif user_id is not None:
+                    if user_id not in self.cache:
+                        self._add_from_channel(user_id, channel)
+                elif channel.topic is None and (
+                    channel.category == self.bot.main_category
+                    or self.bot.using_multiple_server_setup
+                ):
+                    # BUG: When discord fails to create channel topic.
+                    to_check.append(channel)
+
+            if seeded:
+                logger.info(
+                    info(f"{len(seeded)} open log(s) no longer have a thread channel.")
+                )
+
+            if to_check:
+                await self._check_channels(to_check, concurrency)
+
+            logger.info(info(f"Thread cache populated with {len(self)} thread(s)."))
+        finally:
+            self._populated.set()
+
+    async def _check_channels(self, channels, concurrency: int) -> None:
+        semaphore = asyncio.Semaphore(concurrency)
+        total = len(channels)
+        done = 0
+
+        logger.info(info(f"Searching history of {total} channel(s) without a topic."))
+
+        async def check(channel):
+            nonlocal done
+            async with semaphore:
+                user_id = await self._find_user_id_from_history(channel)
+            if user_id != -1 and user_id not in self.cache:
+                self._add_from_channel(user_id, channel)
+            done += 1
+            if done % 25 == 0 or done == total:
+                logger.info(info(f"Checked {done}/{total} channel(s)."))
+
+        await asyncio.gather(*(check(c) for c in channels))
+
+    def mark_populated(self) -> None:
+        """Stops waiting for a cache that won't be populated, without a guild."""
+        self._populated.set()
+
+    async def wait_until_populated(self, timeout: float = None) -> bool:
+        """
+        Blocks execution until the thread cache has been warmed up.
+
+        Returns
+        -------
+        bool
+            Whether the cache was populated, `False` if `timeout` seconds
+            passed first.
+        """
+        try:
+            await asyncio.wait_for(self._populated.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
 
     def __len__(self):
         return len(self.cache)
@@ -726,6 +844,48 @@ class ThreadManager:
     def __getitem__(self, item: str) -> Thread:
         return self.cache[item]
 
+    def register(self, thread: Thread) -> None:
+        """Stores a thread and indexes its channel, if it has one."""
+        self.cache[thread.id] = thread
+        if thread.channel is not None:
+            self.channel_index[thread.channel.id] = thread.id
+
+    def unregister(self, thread: Thread) -> None:
+        """Removes a thread and its channel from the cache."""
+        if self.cache.get(thread.id) is thread:
+            del self.cache[thread.id]
+        if thread.channel is not None:
+            if self.channel_index.get(thread.channel.id) == thread.id:
+                del self.channel_index[thread.channel.id]
+
+    def reindex_channel(self, channel: discord.TextChannel) -> None:
+        """
+        Updates the channel index after the topic of `channel` was changed.
+
+        A topic that no longer contains a user ID is ignored, the
+        thread stays attached to its channel until it is closed.
+        """
+        user_id = match_user_id(channel.topic) if channel.topic else -1
+        if user_id == -1 or self.channel_index.get(channel.id) == user_id:
+            return
+
+        old_id = self.channel_index.pop(channel.id, None)
+        if old_id is not None:
+            thread = self.cache.get(old_id)
+            if thread is not None and thread.channel == channel:
+                del self.cache[old_id]
+
+        if user_id not in self.cache:
+            self._add_from_channel(user_id, channel)
+
+    def forget_channel(self, channel: discord.abc.GuildChannel) -> None:
+        """Drops a deleted channel from the channel index."""
+        user_id = self.channel_index.pop(channel.id, None)
+        if user_id is not None:
+            thread = self.cache.get(user_id)
+            if thread is not None and thread.channel == channel:
+                del self.cache[user_id]
+
     async def find(
         self,
         *,
@@ -733,17 +893,15 @@ class ThreadManager:
         channel: discord.TextChannel = None,
         recipient_id: int = None,
     ) -> Thread:
-        """Finds a thread from cache or from discord channel topics."""
+        """Finds a thread from cache or from the channel index."""
         if recipient is None and channel is not None:
-            return await self._find_from_channel(channel)
-
-        thread = None
+            return self._find_from_channel(channel)
 
         if recipient:
             recipient_id = recipient.id
 
-        try:
-            thread = self.cache[recipient_id]
+        thread = self.cache.get(recipient_id)
+        if thread is not None:
             if not thread.channel or not self.bot.get_channel(thread.channel.id):
                 self.bot.loop.create_task(
                     thread.close(
@@ -751,57 +909,60 @@ class ThreadManager:
                     )
                 )
                 thread = None
-        except KeyError:
-            channel = discord.utils.get(
-                self.bot.modmail_guild.text_channels, topic=f"User ID: {recipient_id}"
-            )
-            if channel:
-                thread = Thread(self, recipient or recipient_id, channel)
-                self.cache[recipient_id] = thread
-                thread.ready = True
         return thread
 
-    async def _find_from_channel(self, channel):
+    def _find_from_channel(self, channel):
         """
-        Tries to find a thread from a channel channel topic,
-        if channel topic doesnt exist for some reason, falls back to
-        searching channel history for genesis embed and
-        extracts user_id from that.
+        Tries to find a thread from the channel index, falls back to
+        parsing the channel topic for channels that are not indexed yet.
         """
-        user_id = -1
-
-        if channel.topic:
-            user_id = match_user_id(channel.topic)
-
-        # BUG: When discord fails to create channel topic.
-        # search through message history
-        elif channel.topic is None:
-            try:
-                async for message in channel.history(limit=100):
-                    if message.author != self.bot.user:
-                        continue
-                    if message.embeds:
-                        embed = message.embeds[0]
-                        if embed.footer.text:
-                            user_id = match_user_id(embed.footer.text)
-                            if user_id != -1:
-                                break
-            except discord.NotFound:
-                # When the channel's deleted.
-                pass
-
-        if user_id != -1:
-            if user_id in self.cache:
-                return self.cache[user_id]
-
-            recipient = self.bot.get_user(user_id)
-            if recipient is None:
-                self.cache[user_id] = thread = Thread(self, user_id, channel)
-            else:
-                self.cache[user_id] = thread = Thread(self, recipient, channel)
-            thread.ready = True
+        user_id = self.channel_index.get(channel.id)
+        if user_id is not None:
+            thread = self.cache.get(user_id)
+            if thread is not None:
+                return thread
+
+        topic = getattr(channel, "topic", None)
+        if not topic:
+            return None
+
+        user_id = match_user_id(topic)
+        if user_id == -1:
+            return None
+
+        if user_id in self.cache:
+            return self.cache[user_id]
+        return self._add_from_channel(user_id, channel)
+
+    def _add_from_channel(self, user_id: int, channel: discord.TextChannel) -> Thread:
+        recipient = self.bot.get_user(user_id)
+        if recipient is None:
+            thread = Thread(self, user_id, channel)
+        else:
+            thread = Thread(self, recipient, channel)
+        thread.ready = True
+        self.register(thread)
+        return thread
 
-            return thread
+    async def _find_user_id_from_history(self, channel) -> int:
+        """
+        Searches channel history for the genesis embed and
+        extracts the user ID from that.
+        """
+        try:
+            async for message in channel.history(limit=100):
+                if message.author != self.bot.user:
+                    continue
+                if message.embeds:
+                    embed = message.embeds[0]
+                    if embed.footer.text:
+                        user_id = match_user_id(embed.footer.text)
+                        if user_id != -1:
+                            return user_id
+        except discord.NotFound:
+            # When the channel's deleted.
+            pass
+        return -1
 
     def create(
         self,
@@ -813,13 +974,18 @@ class ThreadManager:
         """Creates a Modmail thread"""
         # create thread immediately so messages can be processed
         thread = Thread(self, recipient)
-        self.cache[recipient.id] = thread
+        self.register(thread)
 
         # Schedule thread setup for later
         self.bot.loop.create_task(thread.setup(creator=creator, category=category))
         return thread
 
     async def find_or_create(self, recipient) -> Thread:
+        # Avoid creating duplicate threads for channels that are not cached yet.
+        if not await self.wait_until_populated(self.populate_timeout):
+            logger.warning(
+                error("The thread cache is still not populated, finding thread.")
+            )
         return await self.find(recipient=recipient) or self.create(recipient)
 
     def format_channel_name(self, author):
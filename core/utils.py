@@ -1,5 +1,7 @@
 import re
 import typing
+from functools import lru_cache
+from time import perf_counter
 from urllib import parse
 
 from discord import Object
@@ -104,6 +106,7 @@ def is_image_url(url: str, _=None) -> bool:
     return bool(parse_image_url(url))
 
 
+@lru_cache(maxsize=1024)
 def parse_image_url(url: str) -> str:
     """
     Convert the image URL into a sized Discord avatar.
@@ -210,3 +213,46 @@ async def ignore(coro):
         await coro
     except Exception:
         pass
+
+
+class StageTimer:
+    """
+    Measures how long the stages of an operation take.
+
+    Stages may run concurrently, each one is measured
+    from when it is awaited until it finishes.
+
+    Parameters
+    ----------
+    name : str
+        The name of the operation.
+
+    Attributes
+    ----------
+    name : str
+        The name of the operation.
+    stages : Dict[str, float]
+        The duration of each finished stage, in seconds.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: typing.Dict[str, float] = {}
+        self._start = perf_counter()
+
+    async def measure(self, stage: str, coro: typing.Awaitable) -> typing.Any:
+        """Awaits `coro`, recording how long it took as `stage`."""
+        start = perf_counter()
+        try:
+            return await coro
+        finally:
+            self.stages[stage] = perf_counter() - start
+
+    @property
+    def total(self) -> float:
+        """Seconds passed since the operation started."""
+        return perf_counter() - self._start
+
+    def __str__(self):
+        stages = ", ".join(f"{k}: {v * 1000:.0f}ms" for k, v in self.stages.items())
+        return f"{self.name} took {self.total * 1000:.0f}ms ({stages})"
@@ -0,0 +1,95 @@
+"""
+Measures the per-DM cost of the block checks, before and after
+`BlockPolicy`.
+
+Before, every DM parsed `account_age` and `guild_age` and converted the
+sent and blocked emoji again. Now the compiled policy is reused while
+the config is unchanged. Discord isn't contacted, the emoji are looked
+up in a fake guild::
+
+    python scripts/bench_block_policy.py [iterations]
+"""
+
+import asyncio
+import os
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+import isodate
+from discord.ext import commands
+from emoji import UNICODE_EMOJI
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core.blocking import BlockPolicy  # noqa: E402
+
+
+class FakeConfig(dict):
+    @property
+    def cache(self):
+        return self
+
+    async def update(self):
+        pass
+
+
+class FakeBot:
+    def __init__(self, config):
+        self.config = config
+        emoji = [SimpleNamespace(name=f"emoji_{i}", id=i) for i in range(50)]
+        emoji.append(SimpleNamespace(name="modmail_sent", id=50))
+        self.modmail_guild = SimpleNamespace(emojis=emoji)
+        self.emojis = emoji
+        self._policy = None
+
+    async def convert_emoji(self, name: str):
+        # ModmailBot.convert_emoji without its cache, as before.
+        ctx = SimpleNamespace(bot=self, guild=self.modmail_guild)
+        if name not in UNICODE_EMOJI:
+            name = await commands.EmojiConverter().convert(ctx, name.strip(":"))
+        return name
+
+    async def check_before(self, reason: str):
+        config = self.config
+        sent_emoji = await self.convert_emoji(config.get("sent_emoji", "✅"))
+        blocked_emoji = await self.convert_emoji(config.get("blocked_emoji", "🚫"))
+        account_age = isodate.parse_duration(config["account_age"])
+        guild_age = isodate.parse_duration(config["guild_age"])
+        end_time = re.search(r"%(.+?)%$", reason)
+        return sent_emoji, blocked_emoji, account_age, guild_age, end_time
+
+    async def check_after(self, reason: str):
+        policy = self._policy
+        if policy is None or not policy.is_current(self.config):
+            policy = self._policy = await BlockPolicy.compile(self)
+        return policy.sent_emoji, policy.blocked_emoji, policy.account_age
+
+
+async def measure(check, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await check("")
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bot = FakeBot(
+        FakeConfig(
+            account_age="P7D",
+            guild_age="PT12H",
+            sent_emoji=":modmail_sent:",
+            blocked_emoji="🚫",
+        )
+    )
+    loop = asyncio.get_event_loop()
+    before = loop.run_until_complete(measure(bot.check_before, iterations))
+    after = loop.run_until_complete(measure(bot.check_after, iterations))
+    print(f"before: {before:8.2f} µs per DM")
+    print(f"after:  {after:8.2f} µs per DM ({before / after:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
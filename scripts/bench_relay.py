@@ -0,0 +1,268 @@
+"""
+Measures the cost of building the embed of a relayed message, before
+and after `RelayRenderer`.
+
+The "before" numbers run the embed building code of `Thread.send` as it
+was, which read the tags and avatar from the config, parsed the colours,
+compiled the URL regex and parsed every URL again for every message. Now
+the settings are compiled once and reused while the config is unchanged.
+Nothing is sent, the messages are fakes::
+
+    python scripts/bench_relay.py [iterations]
+"""
+
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from urllib import parse
+
+import discord
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core import links  # noqa: E402
+from core.relay import RelayRenderer  # noqa: E402
+
+
+class FakeConfig(dict):
+    def __init__(self, **config):
+        super().__init__(**config)
+        self.snapshot = SimpleNamespace(
+            mod_color=int(config["mod_color"].lstrip("#"), base=16),
+            recipient_color=int(config["recipient_color"].lstrip("#"), base=16),
+        )
+
+
+class FakeAuthor:
+    name = "user"
+    avatar_url = "https://cdn.discordapp.com/avatars/0/0.png"
+    top_role = "Moderator"
+
+    def __str__(self):
+        return "user#0000"
+
+
+def parse_image_url(url: str) -> str:
+    # core.utils.parse_image_url, before it was cached.
+    types = [".png", ".jpg", ".gif", ".jpeg", ".webp"]
+    url = parse.urlsplit(url)
+
+    if any(url.path.lower().endswith(i) for i in types):
+        return parse.urlunsplit((*url[:3], "size=128", url[-1]))
+    return ""
+
+
+def is_image_url(url: str, _=None) -> bool:
+    return bool(parse_image_url(url))
+
+
+class FakeBot:
+    def __init__(self, config):
+        self.config = config
+        self.guild = SimpleNamespace(
+            icon="icon", icon_url="https://cdn.discordapp.com/0.png"
+        )
+        self.recipient = SimpleNamespace(id=0)
+        self.relay = RelayRenderer(self)
+
+    def _parse_color(self, key: str, default) -> discord.Color:
+        # ModmailBot.mod_color and recipient_color, before the snapshot.
+        color = self.config.get(key)
+        if not color:
+            return default
+        try:
+            color = int(color.lstrip("#"), base=16)
+        except ValueError:
+            return default
+        else:
+            return color
+
+    @property
+    def mod_color(self):
+        return self._parse_color("mod_color", discord.Color.green())
+
+    @property
+    def recipient_color(self):
+        return self._parse_color("recipient_color", discord.Color.gold())
+
+
+def render_before(bot, message, from_mod: bool, anonymous: bool) -> discord.Embed:
+    # The embed building part of Thread.send before RelayRenderer, as it
+    # was, sending to the recipient. Additional images are collected
+    # instead of sent.
+    self = SimpleNamespace(bot=bot)
+    note = False
+    destination = bot.recipient
+
+    author = message.author
+
+    embed = discord.Embed(description=message.content, timestamp=message.created_at)
+
+    system_avatar_url = (
+        "https://discordapp.com/assets/f78426a064bc9dd24847519259bc42af.png"
+    )
+
+    if not note:
+        if anonymous and from_mod and not isinstance(destination, discord.TextChannel):
+            # Anonymously sending to the user.
+            tag = self.bot.config.get("mod_tag", str(message.author.top_role))
+            name = self.bot.config.get("anon_username", tag)
+            avatar_url = self.bot.config.get("anon_avatar_url", self.bot.guild.icon_url)
+        else:
+            # Normal message
+            name = str(author)
+            avatar_url = author.avatar_url
+
+        embed.set_author(name=name, icon_url=avatar_url, url=message.jump_url)
+    else:
+        # Special note messages
+        embed.set_author(
+            name=f"Note ({author.name})",
+            icon_url=system_avatar_url,
+            url=message.jump_url,
+        )
+
+    attachments = [(a.url, a.filename) for a in message.attachments]
+
+    images = [x for x in attachments if is_image_url(*x)]
+    attachments = [x for x in attachments if not is_image_url(*x)]
+
+    image_links = [
+        (link, None)
+        for link in re.findall(
+            r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
+            message.content,
+        )
+    ]
+
+    image_links = [x for x in image_links if is_image_url(*x)]
+    images.extend(image_links)
+
+    embedded_image = False
+
+    prioritize_uploads = any(i[1] is not None for i in images)
+
+    additional_images = []
+    additional_count = 1
+
+    for att in images:
+        if not prioritize_uploads or (
+            is_image_url(*att) and not embedded_image and att[1]
+        ):
+            embed.set_image(url=att[0])
+            if att[1]:
+                embed.add_field(name="Image", value=f"[{att[1]}]({att[0]})")
+            embedded_image = True
+        elif att[1] is not None:
+            if note:
+                color = discord.Color.blurple()
+            elif from_mod:
+                color = self.bot.mod_color
+            else:
+                color = self.bot.recipient_color
+
+            img_embed = discord.Embed(color=color)
+            img_embed.set_image(url=att[0])
+            img_embed.title = att[1]
+            img_embed.url = att[0]
+            img_embed.set_footer(text=f"Additional Image Upload ({additional_count})")
+            img_embed.timestamp = message.created_at
+            additional_images.append(img_embed)
+            additional_count += 1
+
+    file_upload_count = 1
+
+    for att in attachments:
+        embed.add_field(
+            name=f"File upload ({file_upload_count})", value=f"[{att[1]}]({att[0]})"
+        )
+        file_upload_count += 1
+
+    if from_mod:
+        embed.color = self.bot.mod_color
+        # Anonymous reply sent in thread channel
+        if anonymous and isinstance(destination, discord.TextChannel):
+            embed.set_footer(text="Anonymous Reply")
+        # Normal messages
+        elif not anonymous:
+            tag = self.bot.config.get("mod_tag", str(message.author.top_role))
+            embed.set_footer(text=tag)  # Normal messages
+        else:
+            embed.set_footer(text=self.bot.config.get("anon_tag", "Response"))
+    elif note:
+        embed.color = discord.Color.blurple()
+    else:
+        embed.set_footer(text=f"Recipient")
+        embed.color = self.bot.recipient_color
+    return embed
+
+
+def render_after(bot, message, from_mod: bool, anonymous: bool) -> discord.Embed:
+    if not from_mod:
+        mode = links.RECIPIENT
+    else:
+        mode = links.ANONYMOUS if anonymous else links.REPLY
+    return bot.relay.render(message, mode, to_recipient=True)[0]
+
+
+def measure(render, bot, messages, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        message, from_mod, anonymous = messages[i % len(messages)]
+        render(bot, message, from_mod, anonymous)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bot = FakeBot(
+        FakeConfig(
+            mod_color="#2ecc71",
+            recipient_color="#f1c40f",
+            mod_tag="Staff",
+            anon_tag="Response",
+        )
+    )
+
+    attachment = SimpleNamespace(
+        url="https://cdn.discordapp.com/attachments/0/0/log.txt", filename="log.txt"
+    )
+    screenshots = [
+        SimpleNamespace(
+            url=f"https://cdn.discordapp.com/attachments/0/0/{i}.png",
+            filename=f"{i}.png",
+        )
+        for i in range(2)
+    ]
+    messages = [
+        (
+            SimpleNamespace(
+                author=FakeAuthor(),
+                content=content,
+                created_at=datetime.utcnow(),
+                jump_url="https://discordapp.com/channels/0/0/0",
+                attachments=attachments,
+            ),
+            from_mod,
+            anonymous,
+        )
+        for content, attachments in (
+            ("Hello, I need some help with my account.", []),
+            ("Here: https://i.imgur.com/example.png", []),
+            ("See the attached file.", [attachment]),
+            ("Two screenshots.", screenshots),
+        )
+        for from_mod, anonymous in ((False, False), (True, False), (True, True))
+    ]
+
+    before = measure(render_before, bot, messages, iterations)
+    after = measure(render_after, bot, messages, iterations)
+    print(f"before: {before:8.2f} µs per message")
+    print(f"after:  {after:8.2f} µs per message ({before / after:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()